@@ -24,6 +24,7 @@ from django.shortcuts import render, redirect
 from . import *
 from gel2mdt.models import *
 from gel2mdt.config import load_config
+from gel2mdt.database_utils.page_loader import ProbandPageLoader
 from django.contrib.auth.decorators import login_required
 from .forms import ProbandCancerForm
 from django.contrib import messages
@@ -64,18 +65,20 @@ def proband_view(request, report_id):
     :return:
     '''
 
-    report = GELInterpretationReport.objects.get(id=report_id)
-    relatives = Relative.objects.filter(proband=report.ir_family.participant_family.proband)
-    proband_variants = ProbandVariant.objects.filter(interpretation_report=report)
-    proband_mdt = MDTReport.objects.filter(interpretation_report=report)
-    panels = InterpretationReportFamilyPanel.objects.filter(ir_family=report.ir_family)
+    loader = ProbandPageLoader(report_id)
+    report = loader.report
+    relatives = loader.relatives
+    proband_variants = loader.proband_variants
+    proband_mdt = loader.proband_mdt
+    panels = loader.panels
 
     if request.method=='POST':
-        form = ProbandCancerForm(request.POST, instance=report.ir_family.participant_family.proband)
+        form = ProbandCancerForm(request.POST, instance=loader.proband)
         form.save()
+        CaseSummary.refresh_family(report.ir_family.participant_family)
         messages.add_message(request, 25, 'Clinical History Updated')
     if report.sample_type == 'cancer':
-        form = ProbandCancerForm(instance=report.ir_family.participant_family.proband)
+        form = ProbandCancerForm(instance=loader.proband)
         return render(request, 'gel2clin/cancer_proband.html', {'report': report,
                                                                      'relatives': relatives,
                                                                      'proband_variants': proband_variants,
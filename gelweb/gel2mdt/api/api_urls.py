@@ -29,4 +29,9 @@ api_urlpatterns = [
         api_views.RareDiseaseCases.as_view(),
         name='gelir-json'
     ),
+    path(
+        'api/gelir/<str:sample_type>/table',
+        api_views.CaseTableServerSide.as_view(),
+        name='gelir-table'
+    ),
 ]
@@ -22,8 +22,16 @@ SOFTWARE.
 from gel2mdt.models import *
 from gel2mdt.api.serializers import *
 
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import cache
 from django.http import Http404
-from django.db.models import Prefetch
+from django.db.models import Prefetch, Q
+from django.utils.decorators import method_decorator
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
 
 from rest_framework.renderers import JSONRenderer
 from rest_framework.parsers import JSONParser
@@ -34,35 +42,276 @@ from rest_framework import mixins
 from rest_framework import generics
 
 
+def case_list_etag(request, sample_type):
+    """
+    ETag for the case list of a sample type, derived from its data version
+    so it changes whenever ingest or a user edits a case.
+    """
+    return 'gelir-{}-{}'.format(sample_type, CaseListVersion.current(sample_type))
+
+
+def case_list_cache_key(sample_type, *parts):
+    """
+    Cache key for a response derived from the case list of a sample type.
+    The current data version is part of the key, so bumping the version
+    invalidates every cached response for that sample type.
+    """
+    return ':'.join(
+        ['gelir', sample_type, str(CaseListVersion.current(sample_type))] + list(parts))
+
+
+@method_decorator(condition(etag_func=case_list_etag), name='dispatch')
 class RareDiseaseCases(generics.ListAPIView):
     """
     List all rare disease cases in our database, filtered by <str:sample_type>.
 
     Sample type may be "raredisease" or "cancer" to return the associated cases.
     Inherits from rest_framework.generics.ListAPIView, which displays a list of
-    all serialised model fields as defined by the GELInterpretationReportSerializer.
+    all serialised model fields as defined by the CaseSummarySerializer.
 
     Attributes:
         serializer_class (rest_framework.serializers.ModelSerializer): serialiser
             which processes the queryset given by class method get_queryset(),
             then used to generate the JSON response for the API view.
+
+    The serialised list is cached per sample type and data version, and the
+    response carries an ETag so clients sending If-None-Match get a 304
+    without the list being rebuilt.
     """
 
     def get_queryset(self):
         """
-        Return a queryset of GELInterpretationReport instances based upon the
-        kwarg 'sample_type' used to initialise the class.
+        Return a queryset of CaseSummary instances based upon the kwarg
+        'sample_type' used to initialise the class.
 
         Returns:
             queryset (django.query.QuerySet): queryset used to initialise the
-                serializer_class from GELInterpretationReportSerializer
+                serializer_class from CaseSummarySerializer
         """
         sample_type = self.kwargs['sample_type']
-        queryset = GELInterpretationReport.objects.filter(sample_type=sample_type).prefetch_related(
-            *[
-                'ir_family',
-                'ir_family__participant_family__proband',
-            ]
-        )
+        queryset = CaseSummary.objects.filter(sample_type=sample_type)
         return queryset
-    serializer_class = GELInterpretationReportSerializer
+    serializer_class = CaseSummarySerializer
+
+    def list(self, request, *args, **kwargs):
+        """
+        Return the serialised case list, from the cache if this version of
+        the list has already been serialised.
+        """
+        cache_key = case_list_cache_key(self.kwargs['sample_type'], 'list')
+        data = cache.get(cache_key)
+        if data is None:
+            serializer = self.get_serializer(self.get_queryset(), many=True)
+            data = list(serializer.data)
+            cache.set(cache_key, data, settings.CASE_LIST_CACHE_TIMEOUT)
+        return Response(data)
+
+
+class CaseTableServerSide(APIView):
+    """
+    Server-side processing endpoint for the rare disease and cancer case
+    tables, filtered by <str:sample_type>.
+
+    Implements the DataTables server-side protocol: the client sends the
+    draw counter, the offset (start) and limit (length) of the page it wants,
+    the requested ordering and any global or per-column searches, and only
+    that page of cases is fetched from the CaseSummary table and serialised.
+    Rows are serialised with CaseSummarySerializer so the JSON for each case
+    is identical to that given by RareDiseaseCases. Pages are cached by their
+    query parameters and the data version of the sample type.
+
+    Attributes:
+        column_lookups (dict): maps the "data" name of each DataTables column
+            to the CaseSummary field used to order, filter and search by it.
+        global_search_columns (tuple): columns which are searched with
+            icontains when the client sends a global search value.
+        boolean_columns (tuple): columns holding booleans, which are searched
+            by an exact match on the strings 'true' and 'false'.
+        max_page_length (int): upper bound on the number of rows returned in
+            a single page, also used when the client asks for all rows.
+        allowed_regex (re.Pattern): the only regex searches passed to the
+            database, i.e. the tier sets sent by the max tier filter. Any
+            other regex search is treated as a plain icontains search.
+    """
+    column_lookups = {
+        'id': 'interpretation_report_id',
+        'gel_id': 'gel_id',
+        'cip_id': 'cip_id',
+        'forename': 'forename',
+        'surname': 'surname',
+        'date_of_birth': 'date_of_birth',
+        'max_tier': 'max_tier',
+        'assembly': 'assembly',
+        'case_status': 'case_status',
+        'pilot_case': 'pilot_case',
+        'trio_sequenced': 'trio_sequenced',
+        'has_de_novo': 'has_de_novo',
+        'updated': 'updated',
+        'priority': 'priority',
+        'recruiting_disease': 'recruiting_disease',
+        'gmc': 'gmc',
+        'clinician': 'clinician',
+    }
+    global_search_columns = (
+        'gel_id',
+        'cip_id',
+        'forename',
+        'surname',
+        'priority',
+        'recruiting_disease',
+        'gmc',
+        'clinician',
+    )
+    boolean_columns = (
+        'pilot_case',
+        'trio_sequenced',
+        'has_de_novo',
+    )
+    max_page_length = 100
+    allowed_regex = re.compile(r'^(\[[0-3]+\]|[0-3])$')
+
+    def get(self, request, sample_type):
+        """
+        Return one page of cases in the format expected by DataTables.
+
+        Returns:
+            response (rest_framework.response.Response): JSON containing the
+                echoed draw counter, the total number of cases for the sample
+                type, the number remaining after searches are applied, and
+                the serialised rows for the requested page.
+        """
+        params = request.query_params
+        # the draw counter and jQuery's cache buster change on every request,
+        # so leave them out of the key
+        cache_params = sorted(
+            (key, value) for key, value in params.items() if key not in ('draw', '_'))
+        cache_key = case_list_cache_key(
+            sample_type, 'table', hashlib.md5(urlencode(cache_params).encode()).hexdigest())
+        page = cache.get(cache_key)
+        if page is None:
+            page = self.get_page(params, sample_type)
+            cache.set(cache_key, page, settings.CASE_LIST_CACHE_TIMEOUT)
+
+        return Response(dict(page, draw=self.get_int(params, 'draw', 0)))
+
+    def get_page(self, params, sample_type):
+        """
+        Apply the searches, ordering and paging in params to the case list.
+
+        Returns:
+            page (dict): the total and filtered case counts and the
+                serialised rows for the requested page.
+        """
+        queryset = CaseSummary.objects.filter(sample_type=sample_type)
+        records_total = queryset.count()
+
+        columns = self.get_columns(params)
+        queryset = queryset.filter(self.get_global_search(params.get('search[value]', '')))
+        for column in columns:
+            queryset = queryset.filter(self.get_column_search(column))
+        records_filtered = queryset.count()
+
+        queryset = queryset.order_by(*self.get_ordering(params, columns))
+
+        start = max(self.get_int(params, 'start', 0), 0)
+        length = self.get_int(params, 'length', self.max_page_length)
+        if length < 0 or length > self.max_page_length:
+            length = self.max_page_length
+        page = queryset[start:start + length]
+
+        serializer = CaseSummarySerializer(page, many=True)
+        return {
+            'recordsTotal': records_total,
+            'recordsFiltered': records_filtered,
+            'data': list(serializer.data),
+        }
+
+    def get_int(self, params, key, default):
+        """
+        Read an integer parameter, falling back to default if it is missing
+        or malformed.
+        """
+        try:
+            return int(params.get(key, default))
+        except (TypeError, ValueError):
+            return default
+
+    def get_columns(self, params):
+        """
+        Collect the column definitions sent by DataTables as
+        columns[i][data], columns[i][search][value] etc.
+
+        Returns:
+            columns (list): dicts holding the data name, ORM lookup, search
+                value and whether the search is a regex for each column, in
+                the order the client sent them. Columns which are unknown are
+                kept as None so that ordering indexes still line up.
+        """
+        columns = []
+        i = 0
+        while 'columns[{}][data]'.format(i) in params:
+            data = params.get('columns[{}][data]'.format(i))
+            if data in self.column_lookups:
+                columns.append({
+                    'data': data,
+                    'lookup': self.column_lookups[data],
+                    'searchable': params.get('columns[{}][searchable]'.format(i), 'true') == 'true',
+                    'orderable': params.get('columns[{}][orderable]'.format(i), 'true') == 'true',
+                    'search': params.get('columns[{}][search][value]'.format(i), ''),
+                    'regex': params.get('columns[{}][search][regex]'.format(i), 'false') == 'true',
+                })
+            else:
+                columns.append(None)
+            i += 1
+        return columns
+
+    def get_global_search(self, value):
+        """
+        Build a Q object matching any of the global_search_columns against
+        the global search value.
+        """
+        query = Q()
+        if value:
+            for column in self.global_search_columns:
+                query |= Q(**{self.column_lookups[column] + '__icontains': value})
+        return query
+
+    def get_column_search(self, column):
+        """
+        Build a Q object for an individual column search. Boolean columns
+        match 'true'/'false', case status matches on its display value, and
+        regex searches sent by the max tier filter are passed to the database
+        as regular expressions. Other regex searches fall back to icontains so
+        a malformed pattern from the client cannot reach the database.
+        """
+        if not column or not column['searchable'] or not column['search']:
+            return Q()
+        value = column['search']
+        lookup = column['lookup']
+        if column['data'] in self.boolean_columns:
+            if value.lower() not in ('true', 'false'):
+                return Q()
+            return Q(**{lookup: value.lower() == 'true'})
+        if column['data'] == 'case_status':
+            status_choices = CaseSummary._meta.get_field('case_status').choices
+            codes = [code for code, name in status_choices if value.lower() in name.lower()]
+            return Q(case_status__in=codes)
+        if column['regex'] and self.allowed_regex.match(value):
+            return Q(**{lookup + '__regex': value})
+        return Q(**{lookup + '__icontains': value})
+
+    def get_ordering(self, params, columns):
+        """
+        Translate order[i][column] and order[i][dir] into a list of ORM order
+        lookups, always ending with the primary key so that pages are stable.
+        """
+        ordering = []
+        i = 0
+        while 'order[{}][column]'.format(i) in params:
+            index = self.get_int(params, 'order[{}][column]'.format(i), -1)
+            if 0 <= index < len(columns) and columns[index] and columns[index]['orderable']:
+                direction = '-' if params.get('order[{}][dir]'.format(i)) == 'desc' else ''
+                ordering.append(direction + columns[index]['lookup'])
+            i += 1
+        ordering.append('pk')
+        return ordering
@@ -265,3 +265,89 @@ class GELInterpretationReportSerializer(serializers.ModelSerializer):
             'priority',
             'recruiting_disease',
         )
+
+
+class CaseSummarySerializer(serializers.ModelSerializer):
+    """
+    Serialiser for returning case list rows from the denormalised CaseSummary
+    table via REST framework.
+
+    Produces the same fields, in the same format, as
+    GELInterpretationReportSerializer so that the case tables can read from
+    either. Every field comes from the CaseSummary row itself, so serialising
+    a page of cases requires no further queries.
+
+    Attributes:
+        id (serializers.IntegerField): define source of the ID of the
+            GELInterpretationReport this summary row represents.
+        ir_family (serializers.CharField): define source of GEL IR ID as
+            string repr in form XXXX-X.
+        case_status (serializers.CharField): define source of string repr of
+            the status of the case, as manually set by users.
+        trio_sequenced (serializers.CharField): define source of string repr
+            of whether (T) or not (F) a case has a proband, mother, and father
+            sequenced.
+        date_of_birth (serializers.DateTimeField): define source of DT repr of
+            cases' patient date of birth.
+        updated (serializer.DateTimeField): defines source of DT repr of
+            when the JSON was last changed in the CIP-API.
+    """
+    id = serializers.IntegerField(
+        source="interpretation_report_id",
+        read_only=True
+    )
+    ir_family = serializers.CharField(
+        source="cip_id",
+        read_only=True
+    )
+    case_status = serializers.CharField(
+        source="get_case_status_display",
+        read_only=True
+    )
+    trio_sequenced = serializers.CharField(
+        read_only=True
+    )
+    date_of_birth = serializers.DateTimeField(
+        read_only=True,
+        format='%Y/%m/%d'
+    )
+    updated = serializers.DateTimeField(
+        format='%Y/%m/%d',
+        read_only=True
+    )
+
+    class Meta:
+        """
+        Meta for CaseSummarySerializer, defines the model and fields.
+
+        Attributes:
+            model (gel2mdt.models.CaseSummary): class def for CaseSummary model
+            fields (tuple): tuple of strings related to CaseSummary model
+                attrs
+        """
+        model = CaseSummary
+        fields = (
+            'id',
+            'gel_id',
+            'cip_id',
+            'gmc',
+            'clinician',
+            'forename',
+            'surname',
+            'date_of_birth',
+            'case_status',
+            'trio_sequenced',
+            'has_de_novo',
+            'pilot_case',
+            'ir_family',
+            'archived_version',
+            'status',
+            'updated',
+            'sample_type',
+            'max_tier',
+            'assembly',
+            'user',
+            'assigned_user',
+            'priority',
+            'recruiting_disease',
+        )
@@ -0,0 +1,273 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+from ..config import load_config
+
+logger = logging.getLogger(__name__)
+
+# seconds a cached response is used without asking the API again, unless
+# set in config.txt with <api>_cache_ttl. After that the response is
+# revalidated with If-None-Match/If-Modified-Since. Responses from APIs not
+# listed here are only cached if they are given a TTL; a negative TTL turns
+# the cache off for an API.
+DEFAULT_CACHE_TTLS = {
+    # cases change status, so always revalidate, which costs a 304
+    'cip_api': 0,
+    # panels are requested by version, so rarely change
+    'panelapp': 24 * 60 * 60,
+}
+
+
+class CacheEntry(object):
+    """
+    A cached API response.
+
+    Attributes:
+        url (str): URL the response came from.
+        etag (str): ETag header of the response, or None.
+        last_modified (str): Last-Modified header of the response, or None.
+        stored_at (float): time.time() when the response was fetched or
+            last revalidated.
+        content (bytes): body of the response.
+        path (str): file the entry is stored in.
+    """
+    def __init__(self, url, etag, last_modified, stored_at, content, path):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.stored_at = stored_at
+        self.content = content
+        self.path = path
+
+    def is_fresh(self, ttl):
+        return time.time() - self.stored_at < ttl
+
+    def conditional_headers(self):
+        """
+        :return: headers asking the API to answer 304 if the response has not
+            changed
+        """
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class HttpCache(object):
+    """
+    Disk cache of successful API responses, keyed by URL and shared by every
+    process using the same directory. Each entry is one file, holding a JSON
+    header line followed by the response body, written atomically. Reading
+    an entry touches its file, so when the cache grows past max_bytes the
+    least recently used entries are removed.
+
+    Attributes:
+        directory (str): where entries are stored.
+        max_bytes (int): size the cache is trimmed back to.
+        size (int): estimated size of the cache, from a scan of directory
+            plus the entries stored since.
+        stats (defaultdict): API name to counts of hits (served without a
+            request), revalidated (304), misses and stored responses.
+    """
+    counters = ('hits', 'revalidated', 'misses', 'stored')
+
+    def __init__(self, directory, max_bytes=500 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = None
+        self.stats = defaultdict(lambda: dict.fromkeys(self.counters, 0))
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def count(self, api, counter):
+        with self.lock:
+            self.stats[api][counter] += 1
+
+    def path(self, url):
+        return os.path.join(self.directory, hashlib.sha256(url.encode('utf-8')).hexdigest())
+
+    def get(self, url):
+        """
+        :return: the CacheEntry for url, or None if it is not cached
+        """
+        path = self.path(url)
+        try:
+            with open(path, 'rb') as entry_file:
+                header = json.loads(entry_file.readline().decode('utf-8'))
+                content = entry_file.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        if header.get('url') != url:
+            return None
+        return CacheEntry(url, header.get('etag'), header.get('last_modified'),
+                          header['stored_at'], content, path)
+
+    def put(self, url, content, etag=None, last_modified=None):
+        """
+        Store a response, then trim the cache if it has grown too large.
+        :return: the new CacheEntry
+        """
+        path = self.path(url)
+        header = json.dumps({'url': url, 'etag': etag, 'last_modified': last_modified,
+                             'stored_at': time.time()})
+        handle, temp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as entry_file:
+                entry_file.write(header.encode('utf-8') + b'\n')
+                entry_file.write(content)
+            os.replace(temp_path, path)
+        except OSError:
+            logger.warning('Could not cache response from %s', url, exc_info=True)
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        with self.lock:
+            if self.size is None:
+                self.size = self.scan_size()
+            else:
+                self.size += len(header) + 1 + len(content)
+            trim = self.size > self.max_bytes
+        if trim:
+            self.evict()
+        return CacheEntry(url, etag, last_modified, json.loads(header)['stored_at'], content, path)
+
+    def touch(self, entry):
+        """
+        Store an entry again after the API confirmed it is unchanged, so it
+        is fresh for another TTL.
+        """
+        return self.put(entry.url, entry.content, entry.etag, entry.last_modified)
+
+    def entries(self):
+        """
+        :return: list of (last used time, size, path) of every stored entry
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.startswith('.tmp'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def scan_size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """
+        Remove least recently used entries until the cache is 90% of
+        max_bytes.
+        """
+        with self.lock:
+            entries = sorted(self.entries())
+            size = sum(size for _, size, _ in entries)
+            target = self.max_bytes * 0.9
+            removed = 0
+            for _, entry_size, path in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= entry_size
+                removed += 1
+            self.size = size
+        logger.info('Evicted %s responses from the HTTP cache', removed)
+
+    def clear(self):
+        with self.lock:
+            for _, _, path in self.entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self.size = 0
+
+    def metrics(self):
+        """
+        :return: Prometheus text format counters for each API
+        """
+        with self.lock:
+            stats = {api: dict(counters) for api, counters in self.stats.items()}
+        lines = ['# TYPE gel2mdt_http_cache_{}_total counter'.format(counter) for counter in self.counters]
+        for api, counters in sorted(stats.items()):
+            for counter, value in counters.items():
+                lines.append('gel2mdt_http_cache_{}_total{{api="{}"}} {}'.format(counter, api, value))
+        return '\n'.join(lines) + '\n'
+
+
+def get_cache_ttl(api):
+    """
+    :return: seconds a cached response of the API stays fresh, or None if
+        its responses are not cached
+    """
+    ttl = load_config.get_config().get(api + '_cache_ttl', DEFAULT_CACHE_TTLS.get(api))
+    if ttl is None or ttl < 0:
+        return None
+    return ttl
+
+
+_cache = None
+_cache_lock = threading.Lock()
+# directories which could not be created, so are not tried again
+_unusable = set()
+
+
+def get_http_cache():
+    """
+    :return: the HttpCache in http_cache_dir from config.txt (by default
+        http_cache inside cip_api_storage), or None if http_cache_dir is
+        set to None
+    """
+    global _cache
+    config_dict = load_config.get_config()
+    directory = config_dict.get('http_cache_dir') or os.path.join(
+        config_dict['cip_api_storage'], 'http_cache')
+    if directory == 'None' or directory in _unusable:
+        return None
+    with _cache_lock:
+        if _cache is None or _cache.directory != directory:
+            max_bytes = int(config_dict.get('http_cache_max_mb', 500) * 1024 * 1024)
+            try:
+                _cache = HttpCache(directory, max_bytes)
+            except OSError:
+                _unusable.add(directory)
+                logger.warning('Cannot use %s for the HTTP cache; responses will not be cached',
+                               directory, exc_info=True)
+                return None
+        return _cache
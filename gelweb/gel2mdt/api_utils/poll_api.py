@@ -24,7 +24,45 @@ import getpass
 import requests
 import json
 
-import labkey as lk
+from ..database_utils.ingest_timing import record_http_call
+from ..config import load_config
+from .retry_policy import RetryPolicy, PollAPIError, RETRY_STATUSES, \
+    get_circuit_breaker, retry_stats
+from .http_cache import get_http_cache, get_cache_ttl
+
+# live URL of each API, which can be replaced by setting <api>_base_url in
+# config.txt, e.g. to point at a server from perf_utils.fake_servers
+DEFAULT_BASE_URLS = {
+    "cip_api": "https://cipapi.genomicsengland.nhs.uk",
+    "panelapp": "https://panelapp.genomicsengland.co.uk",
+    "ensembl": "https://rest.ensembl.org",
+    "mutalyzer": "https://mutalyzer.nl",
+    "genenames": "https://rest.genenames.org",
+}
+
+
+def get_base_url(api):
+    """
+    :param api: key of DEFAULT_BASE_URLS
+    :return: base URL of the API, without a trailing slash
+    """
+    base_url = load_config.get_config().get(api + "_base_url") or DEFAULT_BASE_URLS[api]
+    return base_url.rstrip("/")
+
+
+def get_labkey_server_context(container_path):
+    """
+    Create a LabKey server context for the GMC LabKey, or for the server set
+    with labkey_domain and labkey_use_ssl in config.txt.
+    :param container_path: LabKey project, e.g. labkey_server_request
+    :return: labkey server context for lk.query.select_rows
+    """
+    import labkey as lk
+    config_dict = load_config.get_config()
+    return lk.utils.create_server_context(
+        config_dict.get("labkey_domain") or "gmc.genomicsengland.nhs.uk",
+        container_path,
+        '/labkey', use_ssl=config_dict.get("labkey_use_ssl", True))
 
 
 class PollAPI(object):
@@ -39,7 +77,8 @@ class PollAPI(object):
             a key value within server_list.
         endpoint (str): the desired endpoint of the API.
         server_list (dict): a k-v pairing of api names and a tuple which holds:
-            [0]: format strings of the api's URL which can be formatted with
+            [0]: format strings of the api's URL, starting with the base URL
+            from get_base_url(), which can be formatted with
             str.format(endpoint='') to give the URL
             [1]: a boolean which indiciates whether the API requires auth. At
             the moment, this is only CIP-API.
@@ -85,24 +124,25 @@ class PollAPI(object):
         self.api = api
         self.endpoint = endpoint
 
+        cip_api = get_base_url("cip_api")
         self.server_list = {
             "cip_api": (
-                "https://cipapi.genomicsengland.nhs.uk/api/2/{endpoint}",
+                cip_api + "/api/2/{endpoint}",
                 True),
             "cip_api_for_report": (
-                "https://cipapi.genomicsengland.nhs.uk/api/{endpoint}",
+                cip_api + "/api/{endpoint}",
                 True),
             "panelapp": (
-                "https://panelapp.genomicsengland.co.uk/WebServices/{endpoint}",
+                get_base_url("panelapp") + "/WebServices/{endpoint}",
                 False),
             "ensembl": (
-                "https://rest.ensembl.org/{endpoint}",
+                get_base_url("ensembl") + "/{endpoint}",
                 False),
             "mutalyzer": (
-                "https://mutalyzer.nl/json/{endpoint}",
+                get_base_url("mutalyzer") + "/json/{endpoint}",
                 False),
             "genenames": (
-                "https://rest.genenames.org/{endpoint}",
+                get_base_url("genenames") + "/{endpoint}",
                 True)
         }
 
@@ -119,67 +159,150 @@ class PollAPI(object):
         """
         Creates a request session which polls the desired API for JSON.
 
-        Request will be tried 20 times (MAX_RETRIES) in the case of failure to
-        fetch a proper JSON. This covers connection/retrieval failures, but not
-        improper JSON objects which return despite a 200 code. This is instead
-        covered by a bool json_poll_sucess. At the end of each response, the
-        json library is used to attempt to decode the JSON into a dict. Upon a
-        failure, json_poll_sucess remains false and another request Session is
-        attempted.
-        """
-        json_poll_success = False
-        while not json_poll_success:
-            MAX_RETRIES = 20
-            session = requests.Session()
-            adapter = requests.adapters.HTTPAdapter(max_retries=MAX_RETRIES)
-            session.mount("https://", adapter)
-
-            # IF/ELIF/ELSE tree used to check several conditions. If headers
-            # are required (self.headers_required) and they have not yet been
-            # set (self.headers = None), then we must set the self.headers
-            # value. In the case of CIP-API, we need to fetch auth headers
-            # (first if statement), which is handled by the class method
-            # get_auth_headers(). If not, then standard headers can be set
-            # using get_headers() method instead. If headers are required and
-            # they HAVE been set, we can now use a GET method via the request
-            # Session to fetch the JSON API response, passing in the
-            # server/endpoint and the set headers. Finally, if headers are not
-            # required, we can call the GET response immediately without
-            # setting headers first.
-            if (self.headers_required) and (self.headers is None) and (self.api.startswith('cip_api')):
-                # get auth headers if we need them and they're not yet set
-                self.get_auth_headers()
-                continue
-            elif (self.headers_required) and (self.headers is None) and (self.api == 'genenames'):
+        Connection failures and retryable status codes (RETRY_STATUSES) are
+        retried by the session's adapter, following the RetryPolicy of the
+        API: at most max_attempts requests, with jittered exponential backoff
+        between them. Improper JSON objects which return despite a 200 code
+        are retried the same way. Once the attempts run out PollAPIError is
+        raised, and the failure counts towards the API's CircuitBreaker, as
+        does any other error while polling (such as a CIP-API token which
+        cannot be fetched); while the circuit is open, CircuitOpenError is
+        raised without polling the API.
+
+        Responses of APIs with a cache TTL are kept in the HttpCache. Within
+        the TTL a cached response is returned without polling; after it, the
+        API is asked whether the response has changed, and a 304 reuses it.
+        """
+        # cip_api_for_report is the same service as cip_api
+        service = 'cip_api' if self.api.startswith('cip_api') else self.api
+        cache = get_http_cache()
+        ttl = get_cache_ttl(service) if cache is not None else None
+        entry = cache.get(self.url) if ttl is not None else None
+        if entry is not None and entry.is_fresh(ttl):
+            result = self.decode(entry.content, content)
+            if result is not None:
+                cache.count(service, 'hits')
+                self.response_status = 200
+                return result
+
+        policy = RetryPolicy.for_api(service)
+        breaker = get_circuit_breaker(service)
+        breaker.before_call()
+        retry_stats.add(service, 'calls')
+
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(max_retries=policy.adapter_retry())
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        # every way out of the poll is recorded, so a half-open circuit's
+        # trial always finishes
+        succeeded = False
+        try:
+            result = self.poll(session, policy, content, service,
+                               cache if ttl is not None else None, entry, ttl)
+            succeeded = True
+        except requests.exceptions.RequestException as e:
+            raise PollAPIError('Failed to poll {}: {}'.format(self.url, e)) from e
+        finally:
+            session.close()
+            if succeeded:
+                breaker.record_success()
+            else:
+                self.record_failure(service, breaker)
+        return result
+
+    def poll(self, session, policy, content, service, cache=None, entry=None, ttl=None):
+        """
+        Makes up to policy.max_attempts GET requests until one gives a
+        decodable response, fetching headers first if they are needed. If
+        there is a cached entry for the URL the request is conditional.
+        """
+        # If headers are required and they have not yet been set, then we
+        # must set self.headers. In the case of CIP-API, we need to fetch
+        # auth headers, which is handled by get_auth_headers(). If not, then
+        # standard headers can be set using get_headers() instead.
+        if self.headers_required and self.headers is None:
+            if self.api.startswith('cip_api'):
+                self.get_auth_headers(session, policy.timeout)
+            elif self.api == 'genenames':
                 self.get_headers()
-                continue
-            elif (self.headers_required) and (self.headers is not None):
-                # auth headers required; have been set
-                response = session.get(
-                    url=self.url,
-                    headers=self.headers)
-            elif not self.headers_required:
-                # no headers required
-                response = session.get(
-                    url=self.url)
-
-            if content:
-                return response.content  # return the content, which is a JSON
+
+        for attempt in range(1, policy.max_attempts + 1):
+            if attempt > 1:
+                policy.wait(attempt - 1)
+            headers = dict(self.headers) if self.headers_required else {}
+            if entry is not None:
+                headers.update(entry.conditional_headers())
+            response = session.get(
+                url=self.url,
+                headers=headers or None,
+                timeout=policy.timeout)
+            record_http_call(len(response.content))
+            self.response_status = response.status_code
+            if response.status_code in RETRY_STATUSES:
+                # the adapter has already retried these up to max_attempts
+                raise PollAPIError('{} returned {} after {} attempts'.format(
+                    self.url, response.status_code, policy.max_attempts))
+
+            if response.status_code == 304 and entry is not None:
+                cache.count(service, 'revalidated')
+                body = entry.content
+                self.response_status = 200
+                cache.touch(entry)
             else:
-                # The response may not have a content section, particularly in
-                # the case of errors. In this case, the whole response can be
-                # treated as a JSON, and will contain error information. We can
-                # extract this for debugging purposes - if it is decodable.
-                try:
-                    self.response_json = response.json()
-                    self.response_status = response.status_code
-                    json_poll_success = True
-                except json.JSONDecodeError as e:
-                    continue
+                body = response.content
+                if cache is not None:
+                    cache.count(service, 'misses')
+                    if self.cacheable(response, ttl):
+                        cache.put(self.url, body,
+                                  etag=response.headers.get('ETag'),
+                                  last_modified=response.headers.get('Last-Modified'))
+                        cache.count(service, 'stored')
+
+            result = self.decode(body, content)
+            if result is not None:
+                return result
+            # a corrupt cached response is fetched again in full
+            entry = None
+
+        raise PollAPIError('{} did not return JSON after {} attempts'.format(
+            self.url, policy.max_attempts))
+
+    def decode(self, body, content):
+        """
+        :return: body if content is True, otherwise the JSON it holds, or
+            None if it is not decodable
+        """
+        if content:
+            return body  # return the content, which is a JSON
+        # The response may not have a content section, particularly in
+        # the case of errors. In this case, the whole response can be
+        # treated as a JSON, and will contain error information. We can
+        # extract this for debugging purposes - if it is decodable.
+        try:
+            self.response_json = json.loads(body)
+        except ValueError:
+            return None
+        return self.response_json
 
-                return response.json()
+    @staticmethod
+    def cacheable(response, ttl):
+        """
+        Only successful responses are cached, and only if they can be used
+        without asking again (ttl > 0) or revalidated with ETag or
+        Last-Modified.
+        """
+        if response.status_code != 200:
+            return False
+        if 'no-store' in response.headers.get('Cache-Control', ''):
+            return False
+        return ttl > 0 or 'ETag' in response.headers or 'Last-Modified' in response.headers
+
+    def record_failure(self, service, breaker):
+        retry_stats.add(service, 'failures')
+        breaker.record_failure()
 
-    def get_auth_headers(self):
+    def get_auth_headers(self, session=None, timeout=None):
         """
         Creates a CIP-API token, then creates Accept/Auth header accordingly.
 
@@ -188,10 +311,15 @@ class PollAPI(object):
         Once executed, headers will be set as a class instance attribute.
 
         Args:
-            None
+            session: requests.Session to post with, so the request is
+                retried like the rest of the poll. Defaults to requests.
+            timeout: seconds to wait for the token
 
         Returns:
             None
+
+        Raises:
+            PollAPIError: if the token cannot be fetched
         """
         token_endpoint_list = {
             "cip_api": "get-token/",
@@ -200,15 +328,22 @@ class PollAPI(object):
 
         self.token_url = self.server.format(endpoint=token_endpoint)
         self.get_credentials()
-        token_response = requests.post(
+        token_response = (session or requests).post(
             url=self.token_url,
             json=dict(
                 username=os.environ["cip_api_username"],
                 password=os.environ["cip_api_password"]
             ),
+            timeout=timeout,
         )
 
-        token_json = token_response.json()
+        if token_response.status_code != 200:
+            raise PollAPIError('{} returned {} when asked for a token'.format(
+                self.token_url, token_response.status_code))
+        try:
+            token_json = token_response.json()
+        except ValueError as e:
+            raise PollAPIError('{} did not return a JSON token'.format(self.token_url)) from e
 
         self.headers = {
             "Accept": "application/json",
@@ -0,0 +1,300 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+
+from requests.packages.urllib3.util.retry import Retry
+
+from ..config import load_config
+from ..database_utils.ingest_timing import record_http_retry
+
+logger = logging.getLogger(__name__)
+
+# statuses worth retrying: rate limiting, and server or gateway errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# attempts and backoff factor of each API, unless set in config.txt with
+# <api>_max_attempts and <api>_backoff_factor
+DEFAULT_POLICIES = {
+    'cip_api': (5, 1.0),
+    'panelapp': (5, 1.0),
+    'genenames': (5, 0.5),
+    'ensembl': (3, 0.5),
+    'mutalyzer': (3, 0.5),
+}
+
+
+class PollAPIError(Exception):
+    """
+    An API could not be polled successfully within its retry policy.
+    """
+
+
+class CircuitOpenError(PollAPIError):
+    """
+    An API has failed repeatedly, so it is not being polled until its
+    circuit breaker resets.
+    """
+
+
+class RetryStats(object):
+    """
+    Retry counts and time spent waiting for each API in this process, for
+    the /metrics endpoint and the end of database update logs.
+
+    Attributes:
+        calls (defaultdict): API name to number of polls.
+        failures (defaultdict): API name to polls which failed after retrying.
+        retries (defaultdict): API name to number of retried requests.
+        wait_seconds (defaultdict): API name to total backoff time.
+        circuit_opens (defaultdict): API name to times its circuit opened.
+        rejected (defaultdict): API name to polls refused while its circuit
+            was open.
+    """
+    counters = ('calls', 'failures', 'retries', 'wait_seconds', 'circuit_opens', 'rejected')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        for counter in self.counters:
+            setattr(self, counter, defaultdict(float if counter == 'wait_seconds' else int))
+
+    def add(self, api, counter, amount=1):
+        with self.lock:
+            getattr(self, counter)[api] += amount
+
+    def as_dict(self):
+        with self.lock:
+            apis = sorted(set().union(*[getattr(self, counter) for counter in self.counters]))
+            return {api: {counter: getattr(self, counter)[api] for counter in self.counters}
+                    for api in apis}
+
+    def metrics(self):
+        """
+        :return: Prometheus text format counters for each API
+        """
+        lines = ['# TYPE gel2mdt_api_{}_total counter'.format(counter) for counter in self.counters]
+        for api, counters in self.as_dict().items():
+            for counter, value in counters.items():
+                lines.append('gel2mdt_api_{}_total{{api="{}"}} {}'.format(counter, api, value))
+        return '\n'.join(lines) + '\n'
+
+
+retry_stats = RetryStats()
+
+
+class RetryPolicy(object):
+    """
+    How often and how patiently one API is retried.
+
+    Attributes:
+        api (str): name of the API, used for metrics.
+        max_attempts (int): most requests made for one poll, including the
+            first.
+        backoff_factor (float): the wait before retry n is drawn uniformly
+            between 0 and backoff_factor * 2 ** (n - 1) seconds ("full
+            jitter"), so workers do not retry in step.
+        max_backoff (float): upper bound of any one wait, in seconds.
+        timeout (float): connect and read timeout of each request, in seconds.
+    """
+    def __init__(self, api, max_attempts=5, backoff_factor=1.0, max_backoff=60.0, timeout=60.0):
+        self.api = api
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+    @classmethod
+    def for_api(cls, api):
+        """
+        :return: the RetryPolicy of an API, from DEFAULT_POLICIES and
+            config.txt
+        """
+        config_dict = load_config.get_config()
+        max_attempts, backoff_factor = DEFAULT_POLICIES[api]
+        return cls(api,
+                   max_attempts=config_dict.get(api + '_max_attempts', max_attempts),
+                   backoff_factor=config_dict.get(api + '_backoff_factor', backoff_factor),
+                   max_backoff=config_dict.get('retry_max_backoff', 60.0),
+                   timeout=config_dict.get('http_timeout', 60.0))
+
+    def backoff(self, retry_number):
+        """
+        :return: seconds to wait before the given retry (1 for the first)
+        """
+        ceiling = min(self.max_backoff, self.backoff_factor * 2 ** (retry_number - 1))
+        return random.uniform(0, ceiling)
+
+    def wait(self, retry_number):
+        """
+        Sleep before a retry, recording the retry and the time waited.
+        """
+        seconds = self.backoff(retry_number)
+        record_retry(self.api, seconds)
+        time.sleep(seconds)
+
+    def adapter_retry(self):
+        """
+        :return: urllib3 Retry for the requests adapter, retrying connection
+            errors and RETRY_STATUSES with this policy's backoff
+        """
+        return JitteredRetry(
+            policy=self,
+            total=self.max_attempts - 1,
+            status_forcelist=RETRY_STATUSES,
+            method_whitelist=False,
+            raise_on_status=False,
+        )
+
+
+def record_retry(api, seconds):
+    retry_stats.add(api, 'retries')
+    retry_stats.add(api, 'wait_seconds', seconds)
+    record_http_retry(seconds)
+
+
+class JitteredRetry(Retry):
+    """
+    urllib3 Retry which waits with the full jitter backoff of a RetryPolicy
+    (honouring any Retry-After header) and records each retry.
+    """
+    def __init__(self, policy=None, **kwargs):
+        self.policy = policy
+        super().__init__(**kwargs)
+
+    def new(self, **kwargs):
+        retry = super().new(**kwargs)
+        retry.policy = self.policy
+        return retry
+
+    def get_backoff_time(self):
+        retries = len(self.history)
+        if self.policy is None or retries == 0:
+            return 0
+        return self.policy.backoff(retries)
+
+    def sleep(self, response=None):
+        started = time.perf_counter()
+        super().sleep(response)
+        if self.policy is not None:
+            record_retry(self.policy.api, time.perf_counter() - started)
+
+
+class CircuitBreaker(object):
+    """
+    Shared by every PollAPI for one API, so that once the API has failed
+    failure_threshold polls in a row, further polls fail immediately for
+    reset_seconds instead of each retrying against an API which is down.
+    After that one poll is let through; if it succeeds the circuit closes,
+    otherwise it opens again.
+
+    Attributes:
+        api (str): name of the API.
+        failure_threshold (int): consecutive failed polls which open the
+            circuit.
+        reset_seconds (float): how long the circuit stays open.
+        failures (int): consecutive failed polls so far.
+        opened_at (float): time.monotonic() when the circuit opened, or None
+            if it is closed.
+        trial_running (bool): a poll has been let through after the circuit
+            opened and has not finished yet.
+    """
+    def __init__(self, api, failure_threshold=5, reset_seconds=60.0):
+        self.api = api
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError if polls of the API should fail fast.
+        """
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return
+        retry_stats.add(self.api, 'rejected')
+        raise CircuitOpenError('{} has failed {} times in a row; not polling it for up to {:.0f}s'.format(
+            self.api, self.failures, self.reset_seconds))
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            was_trial = self.trial_running
+            self.trial_running = False
+            if was_trial or (self.opened_at is None and self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                opened = True
+            else:
+                opened = False
+        if opened:
+            retry_stats.add(self.api, 'circuit_opens')
+            logger.warning('Circuit opened for %s after %s failed polls', self.api, self.failures)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(api):
+    """
+    :return: the CircuitBreaker shared by every poll of an API in this
+        process
+    """
+    with _breakers_lock:
+        if api not in _breakers:
+            config_dict = load_config.get_config()
+            _breakers[api] = CircuitBreaker(
+                api,
+                failure_threshold=config_dict.get('circuit_breaker_failures', 5),
+                reset_seconds=config_dict.get('circuit_breaker_reset_seconds', 60.0))
+        return _breakers[api]
+
+
+def reset_circuit_breakers():
+    """
+    Forget every CircuitBreaker, so they are created again from config.txt.
+    """
+    with _breakers_lock:
+        _breakers.clear()
@@ -24,3 +24,7 @@ from django.apps import AppConfig
 
 class Gel2MdtConfig(AppConfig):
     name = 'gel2mdt'
+
+    def ready(self):
+        from .build_info import get_build_info
+        get_build_info()
@@ -0,0 +1,87 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import os
+import subprocess
+import threading
+
+from .config import load_config
+
+# written at deploy time by the write_build_info management command
+BUILD_INFO_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'build_info.json')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_build_info = None
+_build_info_lock = threading.Lock()
+
+
+def git_output(*args):
+    """
+    Run a git command in the repository and return its output, or None if
+    this is not a git checkout or git is not installed.
+    """
+    try:
+        output = subprocess.check_output(
+            ('git',) + args, cwd=REPO_DIR, stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return str(output, 'utf-8').strip()
+
+
+def resolve_build_info():
+    """
+    Work out the version and build of this checkout, from build_info.json if
+    it was written at deploy time, otherwise from git, falling back to
+    VERSION_NUMBER in config.txt.
+    :return: dict with version and build (empty string if unknown)
+    """
+    if os.path.isfile(BUILD_INFO_PATH):
+        with open(BUILD_INFO_PATH) as build_file:
+            return json.load(build_file)
+
+    tags = git_output('tag')
+    build = git_output('log', '-1', '--format=%h')
+    if tags is None or build is None:
+        return {'version': load_config.get_config().get('VERSION_NUMBER', ''),
+                'build': ''}
+    versions = sorted(tags.split(), key=version_key)
+    return {'version': versions[-1] if versions else load_config.get_config().get('VERSION_NUMBER', ''),
+            'build': build[:6]}
+
+
+def version_key(tag):
+    """Sort key matching sort -V for tags like v0.4.2."""
+    return [(0, int(part), '') if part.isdigit() else (1, 0, part)
+            for part in tag.lstrip('v').replace('-', '.').split('.')]
+
+
+def get_build_info():
+    """
+    Return the version and build of the running code, resolved once per
+    process.
+    """
+    global _build_info
+    if _build_info is None:
+        with _build_info_lock:
+            if _build_info is None:
+                _build_info = resolve_build_info()
+    return _build_info
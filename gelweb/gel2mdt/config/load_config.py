@@ -20,30 +20,182 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import os
-import inspect
+import threading
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.txt')
+
+# environment variables starting with this override the matching option in
+# config.txt, e.g. GEL2MDT_BYPASS_VEP=True
+ENV_PREFIX = 'GEL2MDT_'
+
+# APIs polled by PollAPI, each of which can have its own base URL and
+# retry policy
+API_NAMES = ('cip_api', 'panelapp', 'ensembl', 'mutalyzer', 'genenames')
+
+BOOLEAN_OPTIONS = (
+    'labkey_use_ssl',
+    'pull_T3',
+    'cip_as_id',
+    'mergedVEP',
+    'bypass_VEP',
+    'remoteVEP',
+    'show_clinical_report',
+    'plot_pilot_and_main_status_breakdown',
+)
+INTEGER_OPTIONS = (
+    'cache_version',
+    'circuit_breaker_failures',
+    'vep_worker_max_variants',
+) + tuple(api + '_max_attempts' for api in API_NAMES)
+FLOAT_OPTIONS = (
+    'http_timeout',
+    'retry_max_backoff',
+    'circuit_breaker_reset_seconds',
+    'http_cache_max_mb',
+    'vep_worker_timeout',
+) + tuple(api + option for api in API_NAMES
+          for option in ('_backoff_factor', '_cache_ttl'))
+# comma separated, or None
+LIST_OPTIONS = (
+    'GMC',
+)
+
+# options which may be left out of config.txt but can still be set from the
+# environment; each is read with a default
+OPTIONAL_OPTIONS = (
+    'labkey_domain',
+    'labkey_use_ssl',
+    'http_timeout',
+    'retry_max_backoff',
+    'circuit_breaker_failures',
+    'circuit_breaker_reset_seconds',
+    'http_cache_dir',
+    'http_cache_max_mb',
+    'vep_worker_address',
+    'vep_worker_max_variants',
+    'vep_worker_timeout',
+    'annotator',
+    'synthetic_annotator_genes',
+) + tuple(api + option for api in API_NAMES
+          for option in ('_base_url', '_max_attempts', '_backoff_factor', '_cache_ttl'))
+
+_config = None
+_config_lock = threading.Lock()
+
+
+class Config(object):
+    """
+    Typed, read-only view of the options in config.txt.
+
+    Options can be read as attributes or by key. Boolean options are real
+    bools, integer and float options are ints and floats, and list options
+    are lists (or None if set to None in config.txt); everything else is the
+    string from the file.
+
+    Attributes:
+        raw (dict): option name to the unparsed string value.
+    """
+    def __init__(self, raw):
+        self.raw = dict(raw)
+        self._values = {key: self.parse_value(key, value) for key, value in self.raw.items()}
+
+    @staticmethod
+    def parse_value(key, value):
+        """
+        Convert the string value of an option to its type, raising a
+        ValueError if it is not valid.
+        """
+        if key in BOOLEAN_OPTIONS:
+            if value not in ('True', 'False'):
+                raise ValueError('{} in config.txt must be True or False, not "{}"'.format(key, value))
+            return value == 'True'
+        if key in INTEGER_OPTIONS:
+            try:
+                return int(value)
+            except ValueError:
+                raise ValueError('{} in config.txt must be a whole number, not "{}"'.format(key, value))
+        if key in FLOAT_OPTIONS:
+            try:
+                return float(value)
+            except ValueError:
+                raise ValueError('{} in config.txt must be a number, not "{}"'.format(key, value))
+        if key in LIST_OPTIONS:
+            if value == 'None':
+                return None
+            return [item.strip(' ') for item in value.split(',')]
+        return value
+
+    def __getattr__(self, key):
+        try:
+            return self.__dict__['_values'][key]
+        except KeyError:
+            raise AttributeError('{} is not set in config.txt'.format(key))
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+
+def read_config_file(path=CONFIG_PATH, environ=None):
+    """
+    Read the options in config.txt, then apply any environment overrides.
+    :return: dict containing key:configuration option value:configuration value
+    """
+    if environ is None:
+        environ = os.environ
+    config_dict = {}
+    with open(path, 'r') as config_file:
+        for line in config_file:
+            if not line.startswith('#'):
+                line = line.strip().split('=', 1)
+                if len(line) == 2:
+                    config_dict[line[0]] = line[1]
+
+    options = {key.upper(): key for key in OPTIONAL_OPTIONS}
+    options.update({key.upper(): key for key in config_dict})
+    for name, value in environ.items():
+        if name.startswith(ENV_PREFIX):
+            option = name[len(ENV_PREFIX):]
+            config_dict[options.get(option.upper(), option)] = value
+    return config_dict
+
+
+def get_config():
+    """
+    Return the Config for this process, reading config.txt the first time
+    it is called.
+    """
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = Config(read_config_file())
+    return _config
+
+
+def reload_config():
+    """
+    Re-read config.txt and the environment, e.g. after config.txt has been
+    edited, and return the new Config.
+    """
+    global _config
+    with _config_lock:
+        _config = Config(read_config_file())
+    return _config
 
 
 class LoadConfig():
     """
-     Representation of an instance when loading the config file
+     Representation of an instance when loading the config file. Kept for
+     scripts which expect the unparsed strings; use get_config() instead.
     """
     def load(self):
         """
-        Loads config data from config.txt
         :return: dict containing key:configuration option value:configuration value
         """
-        config_dict = {}
-        with open(
-            os.path.join(
-                os.path.dirname(
-                    os.path.abspath(
-                        inspect.stack()[0][1]
-                    )
-                ),
-                "config.txt"), 'r') as config_file:
-            for line in config_file:
-                if not line.startswith('#'):
-                    line = line.strip().split('=', 1)
-                    if len(line) == 2:
-                        config_dict[line[0]] = line[1]
-        return config_dict
+        return dict(get_config().raw)
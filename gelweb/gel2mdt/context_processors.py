@@ -19,9 +19,13 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from .config.load_config import LoadConfig
+from .build_info import get_build_info
+from .config.load_config import get_config
 
 
 def config_access(request):
-    config = LoadConfig().load()
-    return {'config_dict': config}
+    return {'config_dict': get_config()}
+
+
+def build_info(request):
+    return {'build_info': get_build_info()}
@@ -22,12 +22,11 @@ SOFTWARE.
 import os
 import json
 import hashlib
-import labkey as lk
 from datetime import datetime
 from django.utils.dateparse import parse_date
 import time
 from ..models import *
-from ..api_utils.poll_api import PollAPI
+from ..api_utils.poll_api import PollAPI, get_labkey_server_context
 from ..vep_utils.run_vep_batch import CaseVariant, CaseTranscript
 from ..config import load_config
 import re
@@ -432,9 +431,10 @@ class CaseAttributeManager(object):
         """
         Create a case model to handle adding/getting the clinician for case.
         """
+        import labkey as lk
         # family ID used to search for clinician details in labkey
         family_id = None
-        config_dict = load_config.LoadConfig().load()
+        config_dict = load_config.get_config()
         if self.case.json['sample_type']=='raredisease':
             family_id = self.case.json["family_id"]
             labkey_server_request = config_dict['labkey_server_request']
@@ -449,10 +449,7 @@ class CaseAttributeManager(object):
             clinician_details = {"name": "unknown", "hospital": "unknown"}
         elif not self.case.skip_demographics:
             # poll labkey
-            server_context = lk.utils.create_server_context(
-                'gmc.genomicsengland.nhs.uk',
-                labkey_server_request,
-                '/labkey', use_ssl=True)
+            server_context = get_labkey_server_context(labkey_server_request)
 
             if self.case.json['sample_type']=='raredisease':
                 search_results = lk.query.select_rows(
@@ -505,8 +502,9 @@ class CaseAttributeManager(object):
         :param participant_id: GEL participant ID
         :return: dict containing participant demographics
         '''
+        import labkey as lk
         # load in site specific details from config file
-        config_dict = load_config.LoadConfig().load()
+        config_dict = load_config.get_config()
 
         if self.case.skip_demographics:
             # don't poll labkey
@@ -532,10 +530,7 @@ class CaseAttributeManager(object):
                 labkey_server_request = config_dict['labkey_cancer_server_request']
                 schema_name = 'gel_cancer'
 
-            server_context = lk.utils.create_server_context(
-                'gmc.genomicsengland.nhs.uk',
-                labkey_server_request,
-                '/labkey', use_ssl=True)
+            server_context = get_labkey_server_context(labkey_server_request)
 
 
             search_results = lk.query.select_rows(
@@ -580,6 +575,7 @@ class CaseAttributeManager(object):
         """
         Create a case model to handle adding/getting the proband for case.
         """
+        import labkey as lk
         participant_id = self.case.json["proband"]
 
         demographics = self.get_paricipant_demographics(participant_id)
@@ -600,7 +596,7 @@ class CaseAttributeManager(object):
                 pass
         else:
             # set up LabKey to get recruited disease
-            config_dict = load_config.LoadConfig().load()
+            config_dict = load_config.get_config()
             if self.case.json['sample_type'] == 'raredisease':
                 labkey_server_request = config_dict['labkey_server_request']
                 schema_name = 'gel_rare_diseases'
@@ -610,10 +606,7 @@ class CaseAttributeManager(object):
                 schema_name = 'gel_cancer'
                 queryname = 'cancer_diagnosis'
 
-            server_context = lk.utils.create_server_context(
-                'gmc.genomicsengland.nhs.uk',
-                labkey_server_request,
-                '/labkey', use_ssl=True)
+            server_context = get_labkey_server_context(labkey_server_request)
 
             # search in LabKey for recruited disease
             search_results = lk.query.select_rows(
@@ -817,7 +810,7 @@ class CaseAttributeManager(object):
         Poll panelApp to fetch information about a panel, then create a
         ManyCaseModel with this information.
         """
-        config_dict = load_config.LoadConfig().load()
+        config_dict = load_config.get_config()
         panelapp_storage = config_dict['panelapp_storage']
         if self.case.panels:
             for panel in self.case.panels:
@@ -1487,7 +1480,6 @@ class CaseAttributeManager(object):
         MCM with this information.
         """
         # get gene and panel entries
-        config_dict = load_config.LoadConfig().load()
         genes = [gene.entry for gene
                  in self.case.attribute_managers[Gene].case_model.case_models]
         panel_versions = [panel_version.entry for panel_version
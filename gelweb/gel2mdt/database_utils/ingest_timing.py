@@ -0,0 +1,190 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# timers which have a span open in this thread; spans started through
+# span() are recorded against the innermost
+_local = threading.local()
+
+# objects told when any span starts or finishes, e.g. a profiler
+_listeners = []
+
+
+class Span(object):
+    """
+    Timing of a single stage of a database update.
+
+    Attributes:
+        name (str): name of the stage, e.g. "fetch" or "add:Proband".
+        position (int): order in which the span was started within the run.
+        depth (int): number of spans which were open when this one started.
+        started_at (datetime): when the span started.
+        duration (float): wall time in seconds.
+        query_count (int): SQL queries run during the span.
+        http_calls (int): API requests made through PollAPI during the span.
+        http_bytes (int): size of the API responses received.
+        http_retries (int): API requests retried during the span.
+        http_retry_wait (float): seconds spent backing off before retries.
+        rows_created (int): database rows created during the span, as
+            reported by the code being timed.
+    """
+    def __init__(self, name, position, depth):
+        self.name = name
+        self.position = position
+        self.depth = depth
+        self.started_at = timezone.now()
+        self.duration = 0.0
+        self.query_count = 0
+        self.http_calls = 0
+        self.http_bytes = 0
+        self.http_retries = 0
+        self.http_retry_wait = 0.0
+        self.rows_created = 0
+
+    def add_rows(self, count):
+        self.rows_created += count
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'position': self.position,
+            'depth': self.depth,
+            'started_at': self.started_at,
+            'duration': round(self.duration, 6),
+            'query_count': self.query_count,
+            'http_calls': self.http_calls,
+            'http_bytes': self.http_bytes,
+            'http_retries': self.http_retries,
+            'http_retry_wait': round(self.http_retry_wait, 6),
+            'rows_created': self.rows_created,
+        }
+
+
+class IngestTimer(object):
+    """
+    Collects timing spans for one MultipleCaseAdder run. Each span is logged
+    as JSON when it finishes and kept in spans so it can be saved against
+    the ListUpdate for the run.
+
+    Attributes:
+        spans (list): finished and open Spans, in the order they started.
+        open_spans (list): Spans which have not finished yet, outermost first.
+    """
+    def __init__(self):
+        self.spans = []
+        self.open_spans = []
+
+    @contextmanager
+    def span(self, name):
+        """
+        Time the block inside the with statement, counting the SQL queries
+        and API calls it makes.
+        """
+        span = Span(name, len(self.spans), len(self.open_spans))
+        self.spans.append(span)
+        self.open_spans.append(span)
+        timers = getattr(_local, 'timers', [])
+        _local.timers = timers + [self]
+
+        def count_query(execute, sql, params, many, context):
+            span.query_count += 1
+            return execute(sql, params, many, context)
+
+        for listener in list(_listeners):
+            listener.span_started(span)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_query):
+                yield span
+        finally:
+            span.duration = time.perf_counter() - start
+            self.open_spans.pop()
+            _local.timers = timers
+            for listener in list(_listeners):
+                listener.span_finished(span)
+            logger.info(json.dumps(dict(span.as_dict(), event='ingest_span'), default=str))
+
+
+def add_span_listener(listener):
+    """
+    Call listener.span_started(span) and listener.span_finished(span) as
+    each span of any IngestTimer starts and finishes.
+    """
+    _listeners.append(listener)
+
+
+def remove_span_listener(listener):
+    _listeners.remove(listener)
+
+
+def current_timer():
+    """
+    Return the IngestTimer with a span open in this thread, or None.
+    """
+    timers = getattr(_local, 'timers', None)
+    return timers[-1] if timers else None
+
+
+@contextmanager
+def span(name):
+    """
+    Time a block as a span of the current IngestTimer, if there is one,
+    so code called by the MultipleCaseAdder can add its own stages.
+    """
+    timer = current_timer()
+    if timer is None:
+        yield None
+    else:
+        with timer.span(name) as new_span:
+            yield new_span
+
+
+def record_http_call(response_bytes):
+    """
+    Count an API response against every open span in this thread.
+    """
+    timer = current_timer()
+    if timer is not None:
+        for open_span in timer.open_spans:
+            open_span.http_calls += 1
+            open_span.http_bytes += response_bytes
+
+
+def record_http_retry(wait):
+    """
+    Count a retried API request, and the seconds waited before it, against
+    every open span in this thread.
+    """
+    timer = current_timer()
+    if timer is not None:
+        for open_span in timer.open_spans:
+            open_span.http_retries += 1
+            open_span.http_retry_wait += wait
@@ -25,9 +25,11 @@ import json
 
 from ..models import *
 from ..api_utils.poll_api import PollAPI
+from ..api_utils.retry_policy import retry_stats
 from ..api_utils.cip_utils import InterpretationList
 from ..vep_utils.run_vep_batch import generate_transcripts
 from .case_handler import Case, CaseAttributeManager
+from .ingest_timing import IngestTimer
 from ..config import load_config
 import pprint
 import logging
@@ -44,13 +46,16 @@ class MultipleCaseAdder(object):
     required related instances to the database and reporting status and
     errors during the process.
     """
-    def __init__(self, sample_type, head=None, test_data=False, skip_demographics=False, sample=None, pullt3=True):
+    def __init__(self, sample_type, head=None, test_data=False, skip_demographics=False, sample=None, pullt3=True,
+                 test_data_dir=None):
         """
         Initiliase an instance of a MultipleCaseAdder to start managing
         a database update. This will get the list of cases available to
         us, hash them all, check which need to be added/updated and then
         manage the updating of the database.
         :param test_data: Boolean. Use test data or not. Default = False
+        :param test_data_dir: Directory of case jsons to use as test data.
+            Default = gel2mdt/tests/test_files
         :param sample: If you want to add a single sample, set this the GELID
         :param pullt3: Boolean to pull t3 variants
         """
@@ -61,17 +66,22 @@ class MultipleCaseAdder(object):
         else:
             raise ValueError('{sample_type} is not a valid entry for "sample_type"; please enter either "raredisease" or "cancer".'.format(sample_type=sample_type))
 
+        self.sample_type = sample_type
+
         # fetch and identify cases to add or update
         # -----------------------------------------
         # are we using test data files? defaults False (no)
         self.test_data = test_data
+        self.test_data_dir = test_data_dir or os.path.join(os.getcwd(), "gel2mdt/tests/test_files")
         # are we polling labkey? defaults False (yes)
         self.skip_demographics = skip_demographics
         # are we only getting a certain number of cases? defaults None (no)
         self.head = head
         self.pullt3 = pullt3
         # get the config file for datadumps
-        self.config = load_config.LoadConfig().load()
+        self.config = load_config.get_config()
+        # time each stage of the update, saved with the ListUpdate
+        self.timer = IngestTimer()
 
         # instantiate a PanelManager for the Case classes to use
         self.panel_manager = PanelManager()
@@ -82,18 +92,22 @@ class MultipleCaseAdder(object):
         if self.test_data:
             logger.info("Fetching test data.")
             # set list_of_cases to test zoo
-            self.list_of_cases = self.fetch_test_data()
+            with self.timer.span('fetch'):
+                self.list_of_cases = self.fetch_test_data()
             self.cases_to_poll = None
             logger.info("Fetched test data.")
-            self.cases_to_add = self.check_cases_to_add()
-            self.cases_to_update = self.check_cases_to_update()  #
+            with self.timer.span('plan'):
+                self.cases_to_add = self.check_cases_to_add()
+            with self.timer.span('hash'):
+                self.cases_to_update = self.check_cases_to_update()  #
             self.cases_to_skip = set(self.list_of_cases) - \
                                  set(self.cases_to_add) - \
                                  set(self.cases_to_update)
         elif sample:
-            interpretation_list_poll = InterpretationList(sample_type=sample_type, sample=sample)
-            self.cases_to_poll = interpretation_list_poll.cases_to_poll
-            self.list_of_cases = self.fetch_api_data()
+            with self.timer.span('fetch'):
+                interpretation_list_poll = InterpretationList(sample_type=sample_type, sample=sample)
+                self.cases_to_poll = interpretation_list_poll.cases_to_poll
+                self.list_of_cases = self.fetch_api_data()
             self.cases_to_update = self.list_of_cases
             self.cases_to_add = []
             self.cases_to_skip = []
@@ -101,26 +115,29 @@ class MultipleCaseAdder(object):
             # set list_of_cases to cases of interest from API
             logger.info("Fetching live API data.")
             logger.info("Polling for list of available cases...")
-            interpretation_list_poll = InterpretationList(sample_type=sample_type)
-            logger.info("Fetched available cases")
+            with self.timer.span('fetch'):
+                interpretation_list_poll = InterpretationList(sample_type=sample_type)
+                logger.info("Fetched available cases")
 
-            logger.info("Determining which cases to poll...")
-            self.cases_to_poll = interpretation_list_poll.cases_to_poll
-            if head:
-                self.cases_to_poll = self.cases_to_poll[:head]
+                logger.info("Determining which cases to poll...")
+                self.cases_to_poll = interpretation_list_poll.cases_to_poll
+                if head:
+                    self.cases_to_poll = self.cases_to_poll[:head]
 
-            logger.info("Fetching API JSON data for cases to poll...")
-            self.list_of_cases = self.fetch_api_data()
-            if head:
-                # take a certain number of cases off the top
-                self.list_of_cases = self.list_of_cases[:head]
+                logger.info("Fetching API JSON data for cases to poll...")
+                self.list_of_cases = self.fetch_api_data()
+                if head:
+                    # take a certain number of cases off the top
+                    self.list_of_cases = self.list_of_cases[:head]
 
             logger.info("Fetched all required CIP API data.")
 
             logger.info("Checking which cases to add.")
-            self.cases_to_add = self.check_cases_to_add()
+            with self.timer.span('plan'):
+                self.cases_to_add = self.check_cases_to_add()
             logger.info("Checking which cases require updating.")
-            self.cases_to_update = self.check_cases_to_update()#
+            with self.timer.span('hash'):
+                self.cases_to_update = self.check_cases_to_update()#
             self.cases_to_skip = set(self.list_of_cases) - \
                 set(self.cases_to_add) - \
                 set(self.cases_to_update)
@@ -132,9 +149,11 @@ class MultipleCaseAdder(object):
         try:
             logger.info("Adding cases from cases_to_add.")
             print("Adding cases")
-            self.add_cases()
+            with self.timer.span('add'):
+                self.add_cases()
             print("Updating cases")
-            self.add_cases(update=True)
+            with self.timer.span('update'):
+                self.add_cases(update=True)
             success = True
         except Exception as e:
             print("Encountered error:", e)
@@ -144,13 +163,19 @@ class MultipleCaseAdder(object):
         finally:
             print("Recording update")
             # record the update in ListUpdate
-            ListUpdate.objects.create(
+            list_update = ListUpdate.objects.create(
                 update_time=timezone.now(),
                 success=success,
                 cases_added=len(self.cases_to_add),
                 cases_updated=len(self.cases_to_update),
                 error=error
             )
+            ListUpdateSpan.objects.bulk_create([
+                ListUpdateSpan(list_update=list_update, **span.as_dict())
+                for span in self.timer.spans])
+            # invalidate cached case lists even if the run failed part way
+            CaseListVersion.bump([self.sample_type])
+            logger.info(json.dumps(dict(retry_stats.as_dict(), event='api_retries')))
 
     def fetch_test_data(self):
         """
@@ -158,13 +183,9 @@ class MultipleCaseAdder(object):
         self.test_data is set to True.
         """
         list_of_cases = []
-        for filename in os.listdir(
-            # get list of test files then open and load to json
-            os.path.join(
-                os.getcwd(), "gel2mdt/tests/test_files")):
-            file_path = os.path.join(
-                os.getcwd(), "gel2mdt/tests/test_files/{filename}".format(
-                    filename=filename))
+        # get list of test files then open and load to json
+        for filename in sorted(os.listdir(self.test_data_dir)):
+            file_path = os.path.join(self.test_data_dir, filename)
             if filename.endswith('.json'):
                 logger.info("Found case json at " + file_path + " for testing.")
                 with open(file_path) as json_file:
@@ -288,8 +309,10 @@ class MultipleCaseAdder(object):
 
         if update:
             cases = self.cases_to_update
+            stage = 'update'
         elif not update:
             cases = self.cases_to_add
+            stage = 'add'
         if cases:
             # we need vep results for all cases, which needs to be done in batch
             variants = []
@@ -300,7 +323,8 @@ class MultipleCaseAdder(object):
                 variants += case.variants
 
             # fetch the transcripts and put them into TranscriptManager
-            transcripts = generate_transcripts(variants)
+            with self.timer.span(stage + ':vep'):
+                transcripts = generate_transcripts(variants)
             for transcript in transcripts:
                 case_id = transcript.case_id
                 case = case_id_map[case_id]
@@ -323,66 +347,81 @@ class MultipleCaseAdder(object):
         # BULK UPDATE PROCESS #
         # ------------------- #
         for model_type, many in update_order:
+            with self.timer.span('{}:{}'.format(stage, model_type.__name__)) as model_span:
 
-            # prefetch database entries for check_found_in_db()
-            lookups = self.get_prefetch_lookups(model_type)
-            if lookups:
-                model_objects = model_type.objects.all().prefetch_related(*lookups)
-            elif not lookups:
-                model_objects = model_type.objects.all()
+                # prefetch database entries for check_found_in_db()
+                lookups = self.get_prefetch_lookups(model_type)
+                if lookups:
+                    model_objects = model_type.objects.all().prefetch_related(*lookups)
+                elif not lookups:
+                    model_objects = model_type.objects.all()
 
-            for case in cases:
-                # create a CaseAttributeManager for the case
-                case.attribute_managers[model_type] = CaseAttributeManager(
-                    case, model_type, model_objects)
-                # use thea attribute manager to set the case models
-                attribute_manager = case.attribute_managers[model_type]
-                attribute_manager.get_case_model()
-            if not many:
-                # get a list of CaseModels
-                model_list = [
-                    case.attribute_managers[model_type].case_model
-                    for case in cases
-                ]
-            elif many:
-                model_list = []
                 for case in cases:
+                    # create a CaseAttributeManager for the case
+                    case.attribute_managers[model_type] = CaseAttributeManager(
+                        case, model_type, model_objects)
+                    # use thea attribute manager to set the case models
                     attribute_manager = case.attribute_managers[model_type]
-                    many_case_model = attribute_manager.case_model
-                    for case_model in many_case_model.case_models:
-                        model_list.append(case_model)
-            # now create the required new Model instances from CaseModel lists
-            if model_type == GELInterpretationReport:
-                # GEL_IR is a special case, preprocessing version no. means
-                # Model.objects.bulk_create() is not available
-                self.save_new(model_type, model_list)
-            else:
-                print("attempting to bulk create", model_type)
-                self.bulk_create_new(model_type, model_list)
-
-            # refresh CaseAttributeManagers with new CaseModels
-            lookups = self.get_prefetch_lookups(model_type)
-            if lookups:
-                model_objects = model_type.objects.all().prefetch_related(*lookups)
-            elif not lookups:
-                model_objects = model_type.objects.all()
-
-            for model in model_list:
-                if model.entry is False:
-                    model.check_found_in_db(model_objects)
-
+                    attribute_manager.get_case_model()
+                if not many:
+                    # get a list of CaseModels
+                    model_list = [
+                        case.attribute_managers[model_type].case_model
+                        for case in cases
+                    ]
+                elif many:
+                    model_list = []
+                    for case in cases:
+                        attribute_manager = case.attribute_managers[model_type]
+                        many_case_model = attribute_manager.case_model
+                        for case_model in many_case_model.case_models:
+                            model_list.append(case_model)
+                # now create the required new Model instances from CaseModel lists
+                if model_type == GELInterpretationReport:
+                    # GEL_IR is a special case, preprocessing version no. means
+                    # Model.objects.bulk_create() is not available
+                    model_span.add_rows(self.save_new(model_type, model_list))
+                else:
+                    print("attempting to bulk create", model_type)
+                    model_span.add_rows(self.bulk_create_new(model_type, model_list))
+
+                # refresh CaseAttributeManagers with new CaseModels
+                lookups = self.get_prefetch_lookups(model_type)
+                if lookups:
+                    model_objects = model_type.objects.all().prefetch_related(*lookups)
+                elif not lookups:
+                    model_objects = model_type.objects.all()
+
+                for model in model_list:
+                    if model.entry is False:
+                        model.check_found_in_db(model_objects)
+
+
+        # point each ProbandVariant at its selected transcript
+        with self.timer.span(stage + ':selected_transcripts'):
+            ProbandVariant.update_selected_transcripts(
+                ProbandVariant.objects.filter(interpretation_report__in=[
+                    case.attribute_managers[GELInterpretationReport].case_model.entry
+                    for case in cases]))
+
+        # rebuild the case list summaries for the reports just saved
+        with self.timer.span(stage + ':case_summaries'):
+            CaseSummary.refresh([
+                case.attribute_managers[GELInterpretationReport].case_model.entry
+                for case in cases])
 
         # finally, save jsons to disk storage
         cip_api_storage = self.config['cip_api_storage']
-        for case in cases:
-            with open(
-                os.path.join(
-                    cip_api_storage,
-                    '{}.json'.format(
-                        case.request_id + "-" + str(case.attribute_managers[GELInterpretationReport].case_model.entry.archived_version))
-                ),
-                'w') as f:
-                    json.dump(case.raw_json, f)
+        with self.timer.span(stage + ':save_json'):
+            for case in cases:
+                with open(
+                    os.path.join(
+                        cip_api_storage,
+                        '{}.json'.format(
+                            case.request_id + "-" + str(case.attribute_managers[GELInterpretationReport].case_model.entry.archived_version))
+                    ),
+                    'w') as f:
+                        json.dump(case.raw_json, f)
 
 
     def save_new(self, model_type, model_list):
@@ -411,6 +450,7 @@ class MultipleCaseAdder(object):
         for attributes in new_attributes:
             obj = model_type(**attributes)
             obj.save()
+        return len(new_attributes)
 
     def bulk_create_new(self, model_type, model_list):
         """
@@ -438,6 +478,7 @@ class MultipleCaseAdder(object):
         model_type.objects.bulk_create([
             model_type(**attributes)
             for attributes in new_attributes])
+        return len(new_attributes)
 
     def get_prefetch_lookups(self, model_type):
         """
@@ -501,7 +542,7 @@ class GeneManager(object):
     def __init__(self):
         self.fetched_genes = {}
         self.searched_genes = {}
-        self.config_dict = load_config.LoadConfig().load()
+        self.config_dict = load_config.get_config()
 
     def add_gene(self, gene):
         if gene['HGNC_ID'] not in self.fetched_genes:
@@ -0,0 +1,128 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from django.db.models import Count, Q
+
+from ..models import *
+
+
+class ProbandPageLoader(object):
+    """
+    Loads everything shown on a proband page with a fixed number of queries,
+    however many variants the case has.
+
+    The report is fetched with its family, proband, clinician and assigned
+    user in one query. Relatives, MDT reports, panels and ProbandVariants take
+    one query each, with each ProbandVariant joined to its variant, reports
+    and selected transcript, gene and TranscriptVariant, so get_transcript()
+    and get_transcript_variant() do not hit the database when called from
+    templates.
+
+    Attributes:
+        report (GELInterpretationReport): the report for the page.
+        proband (Proband): the proband of the report's family.
+        relatives (list): Relatives of the proband.
+        proband_mdt (list): MDTReports for the report, with MDT and creator.
+        panels (list): InterpretationReportFamilyPanels for the report's
+            family, with the panel version and panel.
+        proband_variants (list): ProbandVariants for the report.
+    """
+    def __init__(self, report_id):
+        self.report = GELInterpretationReport.objects.select_related(
+            'assembly',
+            'assigned_user',
+            'ir_family__participant_family__clinician',
+            'ir_family__participant_family__proband').get(id=report_id)
+        self.proband = self.report.ir_family.participant_family.proband
+        self.relatives = list(Relative.objects.filter(proband=self.proband))
+        self.proband_mdt = list(MDTReport.objects.filter(
+            interpretation_report=self.report).select_related('MDT__creator'))
+        self.panels = list(InterpretationReportFamilyPanel.objects.filter(
+            ir_family=self.report.ir_family).select_related('panel__panel'))
+        self.proband_variants = self.get_proband_variants()
+
+    def get_proband_variants(self):
+        """
+        Fetch the report's ProbandVariants with their selected transcripts.
+        """
+        return list(ProbandVariant.objects.filter(
+            interpretation_report=self.report).select_related(
+                'variant',
+                'validation_responsible_user',
+                'rarediseasereport',
+                'cancerreport',
+                'selected_ptv__transcript__gene',
+                'selected_transcript_variant'))
+
+
+class MDTPageLoader(object):
+    """
+    Loads the reports in an MDT with their tier 1/2 and tier 3 variant counts
+    in a single annotated query, so the MDT page costs the same number of
+    queries however many cases are added to it.
+
+    Attributes:
+        reports (list): GELInterpretationReports in the MDT, with their family
+            and proband.
+        proband_variant_count (dict): number of tier 1 and 2 ProbandVariants
+            for each report ID.
+        t3_proband_variant_count (dict): number of tier 3 ProbandVariants for
+            each report ID.
+    """
+    def __init__(self, mdt_id):
+        self.reports = list(GELInterpretationReport.objects.filter(
+            id__in=MDTReport.objects.filter(MDT=mdt_id).values('interpretation_report')
+        ).select_related(
+            'ir_family__participant_family__proband'
+        ).annotate(
+            tier_count=Count('probandvariant', filter=Q(probandvariant__max_tier__lte=2)),
+            t3_count=Count('probandvariant', filter=Q(probandvariant__max_tier=3))))
+        self.proband_variant_count = {
+            report.id: report.tier_count for report in self.reports}
+        self.t3_proband_variant_count = {
+            report.id: report.t3_count for report in self.reports}
+
+
+def create_variant_reports(proband_variants, sample_type):
+    """
+    Create the RareDiseaseReport or CancerReport for any of the given
+    ProbandVariants which do not have one yet, in a single bulk insert.
+
+    Returns:
+        queryset (django.db.models.QuerySet): the variant reports for all of
+            the given ProbandVariants, with the variant and selected
+            transcript of each.
+    """
+    if sample_type == 'raredisease':
+        report_model = RareDiseaseReport
+    elif sample_type == 'cancer':
+        report_model = CancerReport
+    existing = set(report_model.objects.filter(
+        proband_variant__in=proband_variants).values_list('proband_variant_id', flat=True))
+    report_model.objects.bulk_create([
+        report_model(proband_variant=proband_variant)
+        for proband_variant in proband_variants
+        if proband_variant.id not in existing])
+    return report_model.objects.filter(
+        proband_variant__in=proband_variants).select_related(
+            'proband_variant__variant',
+            'proband_variant__selected_ptv__transcript__gene',
+            'proband_variant__selected_transcript_variant')
@@ -20,11 +20,82 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 from .models import *
+from .database_utils.page_loader import create_variant_reports
 import csv
-from docx import Document
+import hashlib
+import json
 from django.conf import settings
 import os
-from docx.shared import Pt
+
+
+MDT_EXPORT_HEADER = ['CIP_ID', 'Forename', 'Surname', 'DOB', 'Hospital_ID',
+                     'Variant/Zygosity', 'Panel']
+
+
+class Echo(object):
+    """
+    Pseudo-buffer for a CSV writer which returns each row instead of storing
+    it, so the rows can be passed straight to a StreamingHttpResponse.
+    """
+    def write(self, value):
+        return value
+
+
+def mdt_export_rows(mdt_reports):
+    '''
+    Generates the rows of the summary of the cases which are being brought to
+    MDT. The header is yielded straight away, then the reports, variants and
+    panels for every case are loaded with one query each
+    :param mdt_reports: List of reports which are present in MDT
+    :return: Generator of CSV rows
+    '''
+    yield MDT_EXPORT_HEADER
+
+    report_ids = [mdt_report.interpretation_report_id for mdt_report in mdt_reports]
+    reports = GELInterpretationReport.objects.select_related(
+        'ir_family__participant_family__proband').in_bulk(report_ids)
+
+    pv_output = {report_id: [] for report_id in report_ids}
+    proband_variants = ProbandVariant.objects.filter(
+        interpretation_report__in=report_ids).select_related(
+            'selected_ptv__transcript__gene', 'selected_transcript_variant').order_by('id')
+    for proband_variant in proband_variants.iterator():
+        transcript = proband_variant.get_transcript()
+        transcript_variant = proband_variant.get_transcript_variant()
+        if transcript and transcript_variant:
+            hgvs_c = None
+            hgvs_p = None
+            hgvs_c_split = transcript_variant.hgvs_c.split(':')
+            hgvs_p_split = transcript_variant.hgvs_p.split(':')
+            if len(hgvs_c_split) > 1:
+                hgvs_c = hgvs_c_split[1]
+            if len(hgvs_p_split) > 1:
+                hgvs_p = hgvs_p_split[1]
+            pv_output[proband_variant.interpretation_report_id].append(
+                f'{transcript.gene}, '
+                f'{hgvs_c}, '
+                f'{hgvs_p}, '
+                f'{proband_variant.zygosity}')
+
+    panel_names = {}
+    panels = InterpretationReportFamilyPanel.objects.filter(
+        ir_family__in={report.ir_family_id for report in reports.values()}).select_related(
+            'panel__panel').order_by('id')
+    for panel in panels:
+        panel_names.setdefault(panel.ir_family_id, []).append(
+            f'{panel.panel.panel.panel_name}_'
+            f'{panel.panel.version_number}')
+
+    for report_id in report_ids:
+        report = reports[report_id]
+        proband = report.ir_family.participant_family.proband
+        yield [report.ir_family.ir_family_id,
+               proband.forename,
+               proband.surname,
+               proband.date_of_birth.date(),
+               proband.local_id,
+               '\n'.join(pv_output[report_id]),
+               '\n'.join(panel_names.get(report.ir_family_id, []))]
 
 
 def write_mdt_export(writer, mdt_instance, mdt_reports):
@@ -35,48 +106,80 @@ def write_mdt_export(writer, mdt_instance, mdt_reports):
     :param mdt_reports: List of reports which are present in MDT
     :return: CSV file Writer
     '''
-    writer.writerow(['CIP_ID', 'Forename', 'Surname', 'DOB', 'Hospital_ID',
-                     'Variant/Zygosity', 'Panel'])
-
-    for report in mdt_reports:
-        proband_variants = ProbandVariant.objects.filter(interpretation_report=report.interpretation_report)
-        panels = InterpretationReportFamilyPanel.objects.filter(ir_family=report.interpretation_report.ir_family)
-        pv_output = []
-        for proband_variant in proband_variants:
-            transcript = proband_variant.get_transcript()
-            transcript_variant = proband_variant.get_transcript_variant()
-            if transcript and transcript_variant:
-                hgvs_c = None
-                hgvs_p = None
-                hgvs_c_split = transcript_variant.hgvs_c.split(':')
-                hgvs_p_split = transcript_variant.hgvs_p.split(':')
-                if len(hgvs_c_split) > 1:
-                    hgvs_c = hgvs_c_split[1]
-                if len(hgvs_p_split) > 1:
-                    hgvs_p = hgvs_p_split[1]
-                pv_output.append(f'{transcript.gene}, '
-                                 f'{hgvs_c}, '
-                                 f'{hgvs_p}, '
-                                 f'{proband_variant.zygosity}')
-        panel_names = []
-        for panel in panels:
-            panel_names.append(f'{panel.panel.panel.panel_name}_'
-                               f'{panel.panel.version_number}')
-        writer.writerow([report.interpretation_report.ir_family.ir_family_id,
-                         report.interpretation_report.ir_family.participant_family.proband.forename,
-                         report.interpretation_report.ir_family.participant_family.proband.surname,
-                         report.interpretation_report.ir_family.participant_family.proband.date_of_birth.date(),
-                         report.interpretation_report.ir_family.participant_family.proband.local_id,
-                         '\n'.join(pv_output),
-                         '\n'.join(panel_names)])
+    for row in mdt_export_rows(mdt_reports):
+        writer.writerow(row)
     return writer
 
 
-def write_mdt_outcome_template(report):
+def mdt_outcome_content(report, mdt=None):
     """
-    :param pk: GEL Interpretationreport instance
-    :return: Writes a docx template file for summarising proband MDT outcomes
+    Collects everything shown in the MDT outcome document for a report. The
+    variant reports are created in bulk if they do not exist yet.
+    :param report: GEL Interpretationreport instance
+    :param mdt: MDT instance, defaults to the latest MDT the report was in
+    :return: Dict of the document content
+    """
+    if mdt is None:
+        mdt_linkage_list = MDTReport.objects.filter(interpretation_report=report).values('MDT')
+        mdt = MDT.objects.filter(id__in=mdt_linkage_list).order_by('-date_of_mdt').first()
+    proband = report.ir_family.participant_family.proband
+
+    proband_variants = list(ProbandVariant.objects.filter(interpretation_report=report).order_by('id'))
+    variant_reports = create_variant_reports(proband_variants, 'raredisease').order_by('proband_variant_id')
+    variants = []
+    for rdr in variant_reports:
+        proband_variant = rdr.proband_variant
+        transcript = proband_variant.get_transcript()
+        transcript_variant = proband_variant.get_transcript_variant()
+        variants.append({
+            'gene': str(transcript.gene) if transcript else '',
+            'hgvs_g': str(transcript_variant.hgvs_g) if transcript_variant else '',
+            'hgvs_c': str(transcript_variant.hgvs_c) if transcript_variant else '',
+            'hgvs_p': str(transcript_variant.hgvs_p) if transcript_variant else '',
+            'zygosity': str(proband_variant.zygosity),
+            'contribution_to_phenotype': str(rdr.get_contribution_to_phenotype_display()),
+            'classification': str(rdr.classification),
+        })
+
+    clinicians = Clinician.objects.filter(mdt=mdt.id).values_list('name', flat=True)
+    clinical_scientists = ClinicalScientist.objects.filter(mdt=mdt.id).values_list('name', flat=True)
+    other_staff = OtherStaff.objects.filter(mdt=mdt.id).values_list('name', flat=True)
+
+    return {
+        'forename': str(proband.forename),
+        'surname': str(proband.surname),
+        'date_of_birth': str(proband.date_of_birth.date()),
+        'nhs_number': proband.nhs_number,
+        'local_id': proband.local_id,
+        'clinician': str(report.ir_family.participant_family.clinician),
+        'gmc': str(proband.gmc),
+        'cip_id': report.ir_family.ir_family_id,
+        'family_id': report.ir_family.participant_family.gel_family_id,
+        'assembly': str(report.assembly),
+        'variants': variants,
+        'mdt_date': str(mdt.date_of_mdt.date()),
+        'attendees': list(clinicians) + list(clinical_scientists) + list(other_staff),
+        'discussion': proband.discussion.rstrip(),
+        'action': proband.action.rstrip(),
+    }
+
+
+def mdt_outcome_version(content):
+    """
+    :param content: Dict returned by mdt_outcome_content
+    :return: MD5 hash of the document content, which changes whenever the
+        document would change
+    """
+    return hashlib.md5(json.dumps(content, sort_keys=True).encode()).hexdigest()
+
+
+def render_mdt_outcome(content):
+    """
+    :param content: Dict returned by mdt_outcome_content
+    :return: docx Document summarising proband MDT outcomes
     """
+    from docx import Document
+    from docx.shared import Pt
     document = Document()
     document.add_picture(os.path.join(settings.STATIC_DIR, 'nhs_image.png'))
     document.add_heading('Genomics MDM record', 0)
@@ -89,41 +192,33 @@ def write_mdt_outcome_template(report):
     heading_cells[3].paragraphs[0].add_run('Local ID').bold=True
 
     row = table.rows[1].cells
-    row[0].text = str(report.ir_family.participant_family.proband.forename) \
-                  + ' ' \
-                  + str(report.ir_family.participant_family.proband.surname)
-    row[1].text = str(report.ir_family.participant_family.proband.date_of_birth.date())
-    row[2].text = report.ir_family.participant_family.proband.nhs_number
-    if report.ir_family.participant_family.proband.local_id:
-        row[3].text = report.ir_family.participant_family.proband.local_id
+    row[0].text = content['forename'] + ' ' + content['surname']
+    row[1].text = content['date_of_birth']
+    row[2].text = content['nhs_number']
+    if content['local_id']:
+        row[3].text = content['local_id']
 
     paragraph = document.add_paragraph()
     paragraph.add_run()
     paragraph.add_run('Referring Clinician: ').bold=True
-    paragraph.add_run('{}\n'.format(report.ir_family.participant_family.clinician))
+    paragraph.add_run('{}\n'.format(content['clinician']))
     paragraph.add_run('Department/Hospital: ').bold=True
-    paragraph.add_run('{}\n'.format(report.ir_family.participant_family.proband.gmc))
+    paragraph.add_run('{}\n'.format(content['gmc']))
     paragraph.add_run('Study: ').bold=True
     paragraph.add_run('100,000 genomes (whole genome sequencing)\n')
     paragraph.add_run('OPA ID: ').bold = True
-    paragraph.add_run('{}\n'.format(report.ir_family.ir_family_id))
+    paragraph.add_run('{}\n'.format(content['cip_id']))
     paragraph.add_run('Family ID: ').bold=True
-    paragraph.add_run('{}\n'.format(report.ir_family.participant_family.gel_family_id))
+    paragraph.add_run('{}\n'.format(content['family_id']))
     paragraph.add_run('Genome Build: ').bold=True
-    paragraph.add_run('{}\n\n'.format(report.assembly))
-
-    # paragraph.add_run('Phenotype summary: ').bold=True
-    # if sample_info.hpo_terms:
-    #    paragraph.add_run('{}\n'.format(', '.join(list(json.loads(sample_info.hpo_terms)))))
-
-    proband_variants = list(ProbandVariant.objects.filter(interpretation_report=report))
+    paragraph.add_run('{}\n\n'.format(content['assembly']))
 
     run = paragraph.add_run('MDT:\n')
     run.font.size = Pt(16)
     run.underline = True
     run.bold = True
 
-    if proband_variants:
+    if content['variants']:
         run = paragraph.add_run('Variant Outcome Summary:\n')
         run.font.size = Pt(13)
         run.underline = True
@@ -131,71 +226,56 @@ def write_mdt_outcome_template(report):
 
         table = document.add_table(rows=1, cols=7, style='Table Grid')
         heading_cells = table.rows[0].cells
-        run = heading_cells[0].paragraphs[0].add_run('Gene')
-        run.bold=True
-        run.font.size = Pt(9)
-        run = heading_cells[1].paragraphs[0].add_run('HGVSg')
-        run.bold = True
-        run.font.size = Pt(9)
-        run = heading_cells[2].paragraphs[0].add_run('HGVSc')
-        run.bold = True
-        run.font.size = Pt(9)
-        run = heading_cells[3].paragraphs[0].add_run('HGVSp')
-        run.bold = True
-        run.font.size = Pt(9)
-        run = heading_cells[4].paragraphs[0].add_run('Zygosity')
-        run.bold = True
-        run.font.size = Pt(9)
-        run = heading_cells[5].paragraphs[0].add_run('Phenotype Contribution')
-        run.bold = True
-        run.font.size = Pt(9)
-        run = heading_cells[6].paragraphs[0].add_run('Class')
-        run.bold = True
-        run.font.size = Pt(9)
+        for cell, heading in zip(heading_cells, ['Gene', 'HGVSg', 'HGVSc', 'HGVSp', 'Zygosity',
+                                                 'Phenotype Contribution', 'Class']):
+            run = cell.paragraphs[0].add_run(heading)
+            run.bold = True
+            run.font.size = Pt(9)
 
-    for proband_variant in proband_variants:
+    for variant in content['variants']:
         cells = table.add_row().cells
-        transcript = proband_variant.get_transcript()
-        transcript_variant = proband_variant.get_transcript_variant()
-        rdr = proband_variant.create_rare_disease_report()
-        run = cells[0].paragraphs[0].add_run(str(transcript.gene))
-        run.font.size = Pt(7)
-        run = cells[1].paragraphs[0].add_run(str(transcript_variant.hgvs_g))
-        run.font.size = Pt(7)
-        run = cells[2].paragraphs[0].add_run(str(transcript_variant.hgvs_c))
-        run.font.size = Pt(7)
-        run = cells[3].paragraphs[0].add_run(str(transcript_variant.hgvs_p))
-        run.font.size = Pt(7)
-        run = cells[4].paragraphs[0].add_run(str(proband_variant.zygosity))
-        run.font.size = Pt(7)
-        run = cells[5].paragraphs[0].add_run(str(rdr.get_contribution_to_phenotype_display()))
-        run.font.size = Pt(7)
-        run = cells[6].paragraphs[0].add_run(str(rdr.classification))
-        run.font.size = Pt(7)
-
-    mdt_linkage_list = MDTReport.objects.filter(interpretation_report=report).values('MDT')
-    mdt = MDT.objects.filter(id__in=mdt_linkage_list).order_by('-date_of_mdt').first()
+        for cell, key in zip(cells, ['gene', 'hgvs_g', 'hgvs_c', 'hgvs_p', 'zygosity',
+                                     'contribution_to_phenotype', 'classification']):
+            run = cell.paragraphs[0].add_run(variant[key])
+            run.font.size = Pt(7)
 
     paragraph = document.add_paragraph()
 
     paragraph.add_run('MDT Date: ').bold = True
-    paragraph.add_run('{}\n'.format(mdt.date_of_mdt.date()))
+    paragraph.add_run('{}\n'.format(content['mdt_date']))
     paragraph.add_run('MDT Attendees: ').bold = True
-    clinicians = Clinician.objects.filter(mdt=mdt.id).values_list('name', flat=True)
-    clinical_scientists = ClinicalScientist.objects.filter(mdt=mdt.id).values_list('name', flat=True)
-    other_staff = OtherStaff.objects.filter(mdt=mdt.id).values_list('name', flat=True)
-
-    attendees = list(clinicians) + list(clinical_scientists) + list(other_staff)
-    paragraph.add_run('{}\n\n'.format(','.join(attendees)))
+    paragraph.add_run('{}\n\n'.format(','.join(content['attendees'])))
     paragraph.add_run()
     run = paragraph.add_run('Discussion:\n')
     run.font.size = Pt(13)
     run.underline = True
     run.bold = True
-    paragraph.add_run('{}\n\n'.format(report.ir_family.participant_family.proband.discussion.rstrip()))
+    paragraph.add_run('{}\n\n'.format(content['discussion']))
     run = paragraph.add_run('Action:\n')
     run.font.size = Pt(13)
     run.underline = True
     run.bold = True
-    paragraph.add_run('{}\n'.format(report.ir_family.participant_family.proband.action.rstrip()))
+    paragraph.add_run('{}\n'.format(content['action']))
+    return document
+
+
+def mdt_outcome_filename(content):
+    """
+    :param content: Dict returned by mdt_outcome_content
+    :return: File name for the outcome document
+    """
+    return '{}_{}_{}_{}.docx'.format(content['surname'],
+                                     content['forename'],
+                                     content['cip_id'],
+                                     content['mdt_date'])
+
+
+def write_mdt_outcome_template(report):
+    """
+    :param pk: GEL Interpretationreport instance
+    :return: Writes a docx template file for summarising proband MDT outcomes
+    """
+    mdt_linkage_list = MDTReport.objects.filter(interpretation_report=report).values('MDT')
+    mdt = MDT.objects.filter(id__in=mdt_linkage_list).order_by('-date_of_mdt').first()
+    document = render_mdt_outcome(mdt_outcome_content(report, mdt))
     return document, mdt
@@ -1,4 +1,5 @@
 from .models import *
+from django import forms
 import django_filters
 
 
@@ -20,4 +21,19 @@ class ReportFilter(django_filters.FilterSet):
         super(ReportFilter, self).__init__(*args, **kwargs)
         # at sturtup user doen't push Submit button, and QueryDict (in data) is empty
         if self.data == {}:
-            self.queryset = self.queryset.none()
\ No newline at end of file
+            self.queryset = self.queryset.none()
+
+class MDTFilter(django_filters.FilterSet):
+    """
+    Optional date range filter for the recent MDTs list.
+    """
+    date_from = django_filters.DateFilter(
+        name='date_of_mdt', lookup_expr='date__gte',
+        widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = django_filters.DateFilter(
+        name='date_of_mdt', lookup_expr='date__lte',
+        widget=forms.DateInput(attrs={'type': 'date'}))
+
+    class Meta:
+        model = MDT
+        fields = []
@@ -38,13 +38,9 @@ class UserForm(forms.ModelForm):
                     ('Clinical Scientist', 'Clinical Scientist'),
                     ('Other Staff', 'Other Staff'))
     role = forms.ChoiceField(choices=role_choices)
-    config_dict = load_config.LoadConfig().load()
-    if config_dict['GMC'] != 'None':
-        choices = config_dict['GMC'].split(',')
-        gmc_choices = []
-        for choice in choices:
-            choice = choice.strip(' ')
-            gmc_choices.append((choice, choice))
+    config_dict = load_config.get_config()
+    if config_dict.GMC is not None:
+        gmc_choices = [(choice, choice) for choice in config_dict.GMC]
         hospital = forms.ChoiceField(choices=gmc_choices)
     else:
         hospital = forms.CharField()
@@ -64,13 +60,9 @@ class ProfileForm(forms.Form):
                     ('Other Staff', 'Other Staff'),
                     ('Unknown', 'Unknown'),)
     role = forms.ChoiceField(choices=role_choices, required=False)
-    config_dict = load_config.LoadConfig().load()
-    if config_dict['GMC'] != 'None':
-        choices = config_dict['GMC'].split(',')
-        gmc_choices = []
-        for choice in choices:
-            choice = choice.strip(' ')
-            gmc_choices.append((choice, choice))
+    config_dict = load_config.get_config()
+    if config_dict.GMC is not None:
+        gmc_choices = [(choice, choice) for choice in config_dict.GMC]
         hospital = forms.ChoiceField(choices=gmc_choices)
     else:
         hospital = forms.CharField()
@@ -88,10 +80,16 @@ class ProbandForm(forms.ModelForm):
 class VariantValidationForm(forms.ModelForm):
     """
     Form used to change values used for variant validation tracking.
+
+    user_choices can be given to reuse a list of user choices across many
+    forms on one page, rather than each form querying the users when it
+    is rendered.
     """
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, user_choices=None, **kwargs):
         super(VariantValidationForm, self).__init__(*args, **kwargs)
         self.fields['validation_responsible_user'].required=False
+        if user_choices is not None:
+            self.fields['validation_responsible_user'].choices = user_choices
 
     class Meta:
         model = ProbandVariant
@@ -157,13 +155,9 @@ class AddClinicianForm(forms.ModelForm):
     '''
     Form used in Proband View to allow users add a new Clinician
     '''
-    config_dict = load_config.LoadConfig().load()
-    if config_dict['GMC'] != 'None':
-        choices = config_dict['GMC'].split(',')
-        gmc_choices = []
-        for choice in choices:
-            choice = choice.strip(' ')
-            gmc_choices.append((choice, choice))
+    config_dict = load_config.get_config()
+    if config_dict.GMC is not None:
+        gmc_choices = [(choice, choice) for choice in config_dict.GMC]
         hospital = forms.ChoiceField(choices=gmc_choices)
     else:
         hospital = forms.CharField()
@@ -297,13 +291,9 @@ class AddNewAttendee(forms.Form):
     Form for allowing users to add new attendee which would then  be inserted into CS, Clinician or OtherStaff table
     '''
     name = forms.CharField()
-    config_dict = load_config.LoadConfig().load()
-    if config_dict['GMC'] != 'None':
-        choices = config_dict['GMC'].split(',')
-        gmc_choices = []
-        for choice in choices:
-            choice = choice.strip(' ')
-            gmc_choices.append((choice, choice))
+    config_dict = load_config.get_config()
+    if config_dict.GMC is not None:
+        gmc_choices = [(choice, choice) for choice in config_dict.GMC]
         hospital = forms.ChoiceField(choices=gmc_choices)
     else:
         hospital = forms.CharField()
@@ -0,0 +1,205 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from .api_utils.poll_api import PollAPI
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+import json
+import os
+import tempfile
+
+# concurrent PanelApp requests made while rendering one report
+PANEL_LOOKUP_WORKERS = 8
+
+
+def latest_cip_version(interp_json):
+    '''
+    Finds the most recent interpreted genome of an interpretation request, which is the one the clinical report is for
+    :param interp_json: interpretation request JSON from the CIP-API
+    :return: highest cip_version, 1 if there are no interpreted genomes, or None if the key is missing
+    '''
+    if 'interpreted_genome' not in interp_json:
+        return None
+    analysis_versions = [cip_version['cip_version'] for cip_version in interp_json['interpreted_genome']]
+    return max(analysis_versions) if analysis_versions else 1
+
+
+def analysis_panels(interp_json):
+    '''
+    :param interp_json: interpretation request JSON from the CIP-API
+    :return: list of (panel name, panel version) used in the analysis of the case
+    '''
+    json_request = interp_json['interpretation_request_data']['json_request']
+    if 'pedigree' not in json_request:
+        return []
+    return [(panel_section['panelName'], panel_section['panelVersion'])
+            for panel_section in json_request['pedigree']['analysisPanels'] or []]
+
+
+def panel_genes(panel_name, version):
+    '''
+    Looks up a panel version in PanelApp
+    :param panel_name: PanelApp panel ID or name
+    :param version: panel version
+    :return: (specific disease name, list of gene symbols)
+    '''
+    panel_details = PollAPI("panelapp", f"get_panel/{panel_name}/?version={version}").get_json_response()
+    return (panel_details['result']['SpecificDiseaseName'],
+            [gene['GeneSymbol'] for gene in panel_details['result']['Genes']])
+
+
+def fetch_gene_panels(panels):
+    '''
+    Looks up every panel in PanelApp at the same time
+    :param panels: list of (panel name, panel version)
+    :return: dict of specific disease name to list of gene symbols, in the order of panels
+    '''
+    if not panels:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(PANEL_LOOKUP_WORKERS, len(panels))) as executor:
+        return dict(executor.map(lambda panel: panel_genes(*panel), panels))
+
+
+def add_panel_annex(report_html, gene_panels):
+    '''
+    Removes warning signs from the GeL clinical report and inserts a table of the genes in each panel after the annex
+    header, with the report's own formatting
+    :param report_html: clinical report HTML from the CIP-API
+    :param gene_panels: dict of panel name to list of gene symbols
+    :return: the report as utf-8 encoded HTML
+    '''
+    from bs4 import BeautifulSoup
+    gel_content = BeautifulSoup(report_html)
+    # remove any warning signs if they appear in the report
+    disclaimer = gel_content.find("div", {"class": "content-div error-panel"})
+    if disclaimer:
+        disclaimer.extract()
+    # Find the annex header
+    annex = gel_content.find("div", {"class": "annex-banner content-div"})
+
+    # Add a div for the panels  Table tag to be inserted after the report annex
+    div_tag = gel_content.new_tag("div")
+    div_tag['class'] = "content-div"
+    if annex:
+        annex.insert_after(div_tag)
+
+    table_tag = gel_content.new_tag("table")
+
+    h3_tag = gel_content.new_tag("h3")
+    h3_tag.string = 'Gene Panel Specification'
+
+    # Table headers and table rows to be inserted after the table tag
+    # tags created to shamelessly rip off the GeL formatting
+    thead_tag = gel_content.new_tag("thead")
+    tr_tag = gel_content.new_tag("tr")
+    th1_tag = gel_content.new_tag("th")
+    th2_tag = gel_content.new_tag("th")
+
+    th1_tag.string = 'Genepanel'
+    th2_tag.string = 'Genes'
+    tr_tag.insert(1, th1_tag)
+    tr_tag.insert(2, th2_tag)
+    thead_tag.insert(1, tr_tag)
+    table_tag.insert(1, thead_tag)
+
+    tbody_tag = gel_content.new_tag("tbody")
+
+    for position, (panel_name, genes) in enumerate(gene_panels.items()):
+        tr_tag = gel_content.new_tag("tr")
+        td_panel = gel_content.new_tag("td")
+        td_panel['width'] = '20%'
+        td_genes = gel_content.new_tag("td")
+        td_panel.string = panel_name
+        td_genes.string = ', '.join(genes)
+        tr_tag.insert(1, td_panel)
+        tr_tag.insert(2, td_genes)
+        tbody_tag.insert(position, tr_tag)
+
+    table_tag.insert(2, tbody_tag)
+
+    div_tag.insert(1, h3_tag)
+    div_tag.insert(2, table_tag)
+
+    return gel_content.prettify('utf-8')
+
+
+def gel_report_path(ir, ir_version, cip_version):
+    '''
+    :return: where the rendered clinical report of an interpretation request version and cip version is kept
+    '''
+    return os.path.join(settings.GEL_REPORT_STORAGE, f'{ir}-{ir_version}-{cip_version}.html')
+
+
+def cached_gel_report(ir, ir_version, not_before=None):
+    '''
+    Finds the rendering of the latest clinical report of an interpretation request version without polling the CIP-API
+    :param not_before: datetime; renderings made before it (e.g. before the case last changed) are ignored
+    :return: path of the rendered report, or None
+    '''
+    prefix = f'{ir}-{ir_version}-'
+    try:
+        names = [name for name in os.listdir(settings.GEL_REPORT_STORAGE)
+                 if name.startswith(prefix) and name.endswith('.html')]
+    except FileNotFoundError:
+        return None
+    cip_versions = [name[len(prefix):-len('.html')] for name in names]
+    cip_versions = [int(version) for version in cip_versions if version.isdigit()]
+    if not cip_versions:
+        return None
+    path = gel_report_path(ir, ir_version, max(cip_versions))
+    if not_before is not None and os.path.getmtime(path) < not_before.timestamp():
+        return None
+    return path
+
+
+def render_gel_report(ir, ir_version):
+    '''
+    Downloads the GeL clinical report for the latest cip version of an interpretation request and adds the genes of
+    its analysis panels. Each rendering is kept under (ir, ir_version, cip_version), so a report is only rendered once
+    :param ir: Interpretation report ID or CIP id
+    :param ir_version: Version of CIP id
+    :return: path of the rendered report, or None if the CIP-API has no report
+    '''
+    interp_json = PollAPI("cip_api_for_report", f'interpretationRequests/{ir}/{ir_version}/').get_json_response()
+    cip_version = latest_cip_version(interp_json)
+    path = gel_report_path(ir, ir_version, cip_version)
+    if os.path.exists(path):
+        # the cip version is still the latest, so mark the rendering as current for cached_gel_report
+        os.utime(path)
+        return path
+
+    report_html = PollAPI(
+        "cip_api_for_report", f"ClinicalReport/{ir}/{ir_version}/{cip_version}/"
+    ).get_json_response(content=True)
+    try:
+        if json.loads(report_html)['detail'].startswith('Not found'):
+            return None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+
+    gene_panels = fetch_gene_panels(analysis_panels(interp_json))
+    os.makedirs(settings.GEL_REPORT_STORAGE, exist_ok=True)
+    # render under a unique name so tasks rendering the same report at once do not clobber each other
+    handle, temp_path = tempfile.mkstemp(dir=settings.GEL_REPORT_STORAGE, suffix='.tmp')
+    with os.fdopen(handle, 'wb') as report_file:
+        report_file.write(add_panel_annex(report_html, gene_panels))
+    os.replace(temp_path, path)
+    return path
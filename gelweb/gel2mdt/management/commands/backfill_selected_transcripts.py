@@ -0,0 +1,42 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand
+from gel2mdt.models import ProbandVariant
+
+
+class Command(BaseCommand):
+    help = """Set the selected transcript of every ProbandVariant from its
+    selected ProbandTranscriptVariants. Run once after adding the
+    selected_ptv and selected_transcript_variant columns."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        """Update the ProbandVariants in batches ordered by ID."""
+        batch_size = options['batch_size']
+        pv_ids = list(ProbandVariant.objects.order_by('id').values_list('id', flat=True))
+        for i in range(0, len(pv_ids), batch_size):
+            ProbandVariant.update_selected_transcripts(
+                ProbandVariant.objects.filter(id__in=pv_ids[i:i + batch_size]))
+        self.stdout.write('Updated {} proband variants.'.format(len(pv_ids)))
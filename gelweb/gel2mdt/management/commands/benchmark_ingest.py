@@ -0,0 +1,85 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from gel2mdt.perf_utils.cohort import CohortGenerator
+from gel2mdt.perf_utils.ingest_benchmark import run_benchmark, append_result
+
+
+class Command(BaseCommand):
+    help = """Time adding a synthetic cohort to an empty, throwaway database
+    and append the result to a JSONL file, so that runs on different commits
+    can be compared. VEP, LabKey and the APIs are not called; transcripts
+    are made up by the synthetic annotator."""
+
+    def add_arguments(self, parser):
+        """Gather options for the benchmark."""
+        parser.add_argument('--cohort', default=None,
+                            help='Directory written by generate_cohort. If not'
+                            ' supplied a cohort is generated with --cases and'
+                            ' --seed.')
+        parser.add_argument('--cases', default=100, type=int,
+                            help='Number of cases to generate. Default: 100')
+        parser.add_argument('--sample-type', default='raredisease',
+                            choices=['raredisease', 'cancer'],
+                            help='Type of cases to generate. Default:'
+                            ' raredisease')
+        parser.add_argument('--seed', default=0, type=int,
+                            help='Random seed for the cohort. Default: 0')
+        parser.add_argument('--annotator', default='synthetic',
+                            choices=['synthetic', 'bypass'],
+                            help='synthetic makes up transcripts for every'
+                            ' variant, bypass adds cases without any.'
+                            ' Default: synthetic')
+        parser.add_argument('--output', default='ingest_benchmark.jsonl',
+                            help='JSONL file to append the result to.'
+                            ' Default: ingest_benchmark.jsonl')
+
+    def handle(self, *args, **options):
+        """Run the benchmark, print a summary and save the result."""
+        cohort_dir = options['cohort']
+        if cohort_dir is None:
+            cohort_dir = tempfile.mkdtemp(prefix='gel2mdt_cohort_')
+            CohortGenerator(case_count=options['cases'],
+                            sample_type=options['sample_type'],
+                            seed=options['seed']).write(cohort_dir)
+        elif not os.path.isfile(os.path.join(cohort_dir, 'cohort.json')):
+            raise CommandError('{} is not a cohort from generate_cohort'.format(cohort_dir))
+
+        result = run_benchmark(cohort_dir, annotator=options['annotator'])
+        append_result(result, options['output'])
+
+        self.stdout.write('{} cases in {:.1f}s: {} cases/s, {} queries ({} per case),'
+                          ' peak RSS {} MB{}'.format(
+                              result['cases'], result['seconds'],
+                              result['cases_per_second'], result['queries'],
+                              result['queries_per_case'], result['peak_rss_mb'],
+                              '' if result['success'] else ', FAILED'))
+        for span in result['spans']:
+            self.stdout.write('  {:<40} {:>8.2f}s {:>8} queries'.format(
+                ('  ' * span['depth'] + span['name'])[:40],
+                span['duration'], span['query_count']))
+        if not result['success']:
+            self.stderr.write(result['error'])
+        self.stdout.write('Result appended to {}'.format(options['output']))
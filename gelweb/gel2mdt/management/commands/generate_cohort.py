@@ -0,0 +1,95 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from gel2mdt.perf_utils.cohort import CohortGenerator
+
+
+class Command(BaseCommand):
+    help = """Write CIP-API jsons for a synthetic cohort, with the PanelApp
+    and gene files needed to add it offline, e.g. for benchmark_ingest or
+    run_batch_update --test-data --test-data-dir <directory>/cases."""
+
+    def add_arguments(self, parser):
+        """Gather options describing the cohort."""
+        parser.add_argument('directory',
+                            help='Directory to write the cohort to.')
+        parser.add_argument('--cases', default=100, type=int,
+                            help='Number of cases. Default: 100')
+        parser.add_argument('--sample-type', default='raredisease',
+                            choices=['raredisease', 'cancer'],
+                            help='Type of cases. Default: raredisease')
+        parser.add_argument('--seed', default=0, type=int,
+                            help='Random seed; the same seed and options'
+                            ' always give the same cohort. Default: 0')
+        parser.add_argument('--trio-fraction', default=0.6, type=float,
+                            help='Proportion of rare disease cases with both'
+                            ' parents. Default: 0.6')
+        parser.add_argument('--variants-per-case', default=30, type=int,
+                            help='Mean number of tiered variants per case.'
+                            ' Default: 30')
+        parser.add_argument('--tier-weights', default='2,8,90',
+                            help='Relative frequency of tiers 1, 2 and 3.'
+                            ' Default: 2,8,90')
+        parser.add_argument('--cip-flagged-fraction', default=0.3, type=float,
+                            help='Proportion of cases with CIP flagged'
+                            ' variants. Default: 0.3')
+        parser.add_argument('--clinical-report-fraction', default=0.2, type=float,
+                            help='Proportion of cases with a clinical report.'
+                            ' Default: 0.2')
+        parser.add_argument('--recurrent-fraction', default=0.2, type=float,
+                            help='Proportion of variants shared between'
+                            ' cases. Default: 0.2')
+        parser.add_argument('--panels', default=20, type=int,
+                            help='Number of PanelApp panels. Default: 20')
+        parser.add_argument('--genes-per-panel', default=50, type=int,
+                            help='Number of genes in each panel. Default: 50')
+        parser.add_argument('--assembly', default='GRCh37',
+                            choices=['GRCh37', 'GRCh38'],
+                            help='Genome build. Default: GRCh37')
+
+    def handle(self, *args, **options):
+        """Generate the cohort and write it to the directory."""
+        try:
+            tier_weights = tuple(int(weight) for weight in options['tier_weights'].split(','))
+        except ValueError:
+            raise CommandError('--tier-weights must be three whole numbers, e.g. 2,8,90')
+        if len(tier_weights) != 3:
+            raise CommandError('--tier-weights must be three whole numbers, e.g. 2,8,90')
+
+        generator = CohortGenerator(
+            case_count=options['cases'],
+            sample_type=options['sample_type'],
+            seed=options['seed'],
+            trio_fraction=options['trio_fraction'],
+            variants_per_case=options['variants_per_case'],
+            tier_weights=tier_weights,
+            cip_flagged_fraction=options['cip_flagged_fraction'],
+            clinical_report_fraction=options['clinical_report_fraction'],
+            recurrent_fraction=options['recurrent_fraction'],
+            panel_count=options['panels'],
+            genes_per_panel=options['genes_per_panel'],
+            assembly=options['assembly'])
+        manifest = generator.write(options['directory'])
+        self.stdout.write('Wrote {} {} cases with {} tiered variants to {}'.format(
+            manifest['case_count'], manifest['sample_type'],
+            manifest['variant_count'], options['directory']))
@@ -0,0 +1,72 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from gel2mdt.models import ListUpdate
+
+
+class Command(BaseCommand):
+    help = """Print the time spent in each stage of recent database updates."""
+
+    def add_arguments(self, parser):
+        """Gather options for choosing which updates to show."""
+        parser.add_argument('--run', default=None, type=int,
+                            help='ID of the ListUpdate to show.')
+        parser.add_argument('--last', default=1, type=int,
+                            help='Number of most recent updates to show.'
+                            ' Default: 1')
+
+    def handle(self, *args, **options):
+        """Print a table of spans for each chosen ListUpdate."""
+        if options['run'] is not None:
+            list_updates = ListUpdate.objects.filter(id=options['run'])
+            if not list_updates:
+                raise CommandError('No ListUpdate with id {}'.format(options['run']))
+        else:
+            list_updates = ListUpdate.objects.order_by('-update_time')[:options['last']]
+
+        for list_update in list_updates.prefetch_related('spans'):
+            self.write_breakdown(list_update)
+
+    def write_breakdown(self, list_update):
+        """Print the spans of one ListUpdate, indented by nesting depth."""
+        spans = list(list_update.spans.all())
+        total = sum(span.duration for span in spans if span.depth == 0)
+        self.stdout.write('ListUpdate {} at {}: {}, {} added, {} updated, {:.1f}s'.format(
+            list_update.id, list_update.update_time,
+            'success' if list_update.success else 'failed',
+            list_update.cases_added, list_update.cases_updated, total))
+        if not spans:
+            self.stdout.write('  no timings recorded\n')
+            return
+        row = '{:<40} {:>10} {:>6} {:>8} {:>6} {:>12} {:>8} {:>10} {:>8}'
+        self.stdout.write(row.format('stage', 'seconds', '%', 'queries',
+                                     'http', 'http bytes', 'retries',
+                                     'retry wait', 'rows'))
+        for span in spans:
+            self.stdout.write(row.format(
+                ('  ' * span.depth + span.name)[:40],
+                '{:.2f}'.format(span.duration),
+                '{:.1f}'.format(100 * span.duration / total) if total else '-',
+                span.query_count, span.http_calls, span.http_bytes,
+                span.http_retries, '{:.1f}'.format(span.http_retry_wait),
+                span.rows_created))
+        self.stdout.write('')
@@ -0,0 +1,98 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import getpass
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from gel2mdt.models import GELInterpretationReport, MDT
+from gel2mdt.perf_utils.load_test import LoadTest
+
+
+class Command(BaseCommand):
+    help = """Replay the main page, case list API, proband, MDT and MDT
+    export requests against a running server from several sessions at once
+    and print latency percentiles for each. Cases and MDTs are picked from
+    the database, e.g. one filled with seed_perf_db."""
+
+    def add_arguments(self, parser):
+        """Gather options for the load test."""
+        parser.add_argument('--url', default='http://localhost:8000',
+                            help='URL of the server. Default:'
+                            ' http://localhost:8000')
+        parser.add_argument('--username', required=True,
+                            help='Staff user to log in as. The password is'
+                            ' read from LOAD_TEST_PASSWORD or prompted for.')
+        parser.add_argument('--sample-type', default='raredisease',
+                            choices=['raredisease', 'cancer'],
+                            help='Type of cases to open. Default: raredisease')
+        parser.add_argument('--requests', default=1000, type=int,
+                            help='Total number of requests. Default: 1000')
+        parser.add_argument('--concurrency', default=10, type=int,
+                            help='Number of sessions making requests at once.'
+                            ' Default: 10')
+        parser.add_argument('--seed', default=0, type=int,
+                            help='Random seed. Default: 0')
+        parser.add_argument('--output', default=None,
+                            help='JSONL file to append the results to.')
+
+    def handle(self, *args, **options):
+        """Run the load test and print the latency of each flow."""
+        report_ids = list(GELInterpretationReport.objects.filter(
+            sample_type=options['sample_type']).values_list('id', flat=True))
+        if not report_ids:
+            raise CommandError('There are no {} cases in the database'.format(options['sample_type']))
+        mdt_ids = list(MDT.objects.filter(
+            sample_type=options['sample_type']).values_list('id', flat=True))
+        password = os.environ.get('LOAD_TEST_PASSWORD') or getpass.getpass('Password: ')
+
+        load_test = LoadTest(options['url'], options['username'], password,
+                             options['sample_type'], report_ids, mdt_ids,
+                             case_count=len(report_ids),
+                             concurrency=options['concurrency'],
+                             seed=options['seed'])
+        try:
+            summary = load_test.run(options['requests'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        row = '{:<16} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}  {}'
+        self.stdout.write(row.format('flow', 'count', 'p50 ms', 'p90 ms', 'p95 ms', 'p99 ms',
+                                     'max ms', 'statuses'))
+        for name, stats in sorted(summary.items(), key=lambda item: item[0] == 'all'):
+            self.stdout.write(row.format(
+                name, stats['count'], stats['p50'], stats['p90'], stats['p95'],
+                stats['p99'], stats['max'],
+                ', '.join('{} x{}'.format(status, count) for status, count in sorted(stats['statuses'].items()))))
+        self.stdout.write('{} requests/s with {} sessions'.format(
+            summary['all']['requests_per_second'], options['concurrency']))
+
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                output.write(json.dumps({
+                    'url': options['url'],
+                    'sample_type': options['sample_type'],
+                    'concurrency': options['concurrency'],
+                    'cases': len(report_ids),
+                    'mdts': len(mdt_ids),
+                    'summary': summary,
+                }) + '\n')
@@ -22,6 +22,7 @@ SOFTWARE.
 
 from django.core.management.base import BaseCommand, CommandError
 from gel2mdt.database_utils.multiple_case_adder import MultipleCaseAdder
+from gel2mdt.perf_utils.profiling import RunProfiler, sampling_available
 
 
 class Command(BaseCommand):
@@ -32,6 +33,10 @@ class Command(BaseCommand):
         parser.add_argument('--test-data', action='store_true',
                             help='Use the test data jsons instead of polling'
                                  ' the GeL API.')
+        parser.add_argument('--test-data-dir', default=None,
+                            help='Directory of case jsons to use with'
+                                 ' --test-data, e.g. from generate_cohort.'
+                                 ' Default: gel2mdt/tests/test_files')
         parser.add_argument('--sample', default=None,
                             help='Specify a GeL ID to update a single sample.')
         parser.add_argument('--sample-type', default='raredisease',
@@ -45,13 +50,50 @@ class Command(BaseCommand):
         parser.add_argument('--pullt3', action='store_true',
                             help='Include the Tier 3 variants (this is time'
                             ' consuming!)')
+        parser.add_argument('--profile', default=None,
+                            choices=['cprofile', 'sampling'],
+                            help='Profile the run with cProfile, or with'
+                            ' pyinstrument (sampling) if it is installed,'
+                            ' giving each stage its own profile.')
+        parser.add_argument('--profile-dir', default='profiles',
+                            help='Directory for the .pstats files and text'
+                            ' summary. Default: profiles')
+        parser.add_argument('--profile-top', default=25, type=int,
+                            help='Number of functions and allocation sites'
+                            ' listed for each stage. Default: 25')
+        parser.add_argument('--profile-depth', default=1, type=int,
+                            help='Deepest stage given its own profile; 0 for'
+                            ' fetch/plan/hash/add/update only. Default: 1')
+        parser.add_argument('--no-profile-memory', action='store_true',
+                            help='Do not take tracemalloc snapshots at the'
+                            ' start and end of each stage.')
 
     def handle(self, *args, **options):
         """Run the MultipleCaseAdder with the supplied options."""
+        if not options['profile']:
+            self.update_database(options)
+            return
+
+        mode = options['profile']
+        if mode == 'sampling' and not sampling_available():
+            self.stderr.write('pyinstrument is not installed, profiling with cProfile instead')
+            mode = 'cprofile'
+        profiler = RunProfiler(mode=mode,
+                               output_dir=options['profile_dir'],
+                               top=options['profile_top'],
+                               max_depth=options['profile_depth'],
+                               memory=not options['no_profile_memory'])
+        with profiler:
+            self.update_database(options)
+        for path in profiler.paths:
+            self.stdout.write('Wrote {}'.format(path))
+
+    def update_database(self, options):
         mca = MultipleCaseAdder(sample_type=options['sample_type'],
                                 sample=options['sample'],
                                 head=options['case_count'],
                                 test_data=options['test_data'],
+                                test_data_dir=options['test_data_dir'],
                                 skip_demographics=options['skip_demographics'],
                                 pullt3=options['pullt3'])
         mca.update_database()
@@ -0,0 +1,103 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+from gel2mdt.perf_utils.fake_servers import APIS, ApiBehaviour, FakeApiServer
+
+
+def api_value(value):
+    """Parse an API=NUMBER option value."""
+    try:
+        api, number = value.split('=')
+        return api, float(number)
+    except ValueError:
+        raise CommandError('{} should be API=NUMBER, e.g. panelapp=200'.format(value))
+
+
+class Command(BaseCommand):
+    help = """Serve a cohort from generate_cohort as stand-ins for the CIP-API,
+    PanelApp, genenames and LabKey, with configurable latency, errors and
+    paging. Prints the environment variables which point gel2mdt at it."""
+
+    def add_arguments(self, parser):
+        """Gather options for the fake servers."""
+        parser.add_argument('cohort',
+                            help='Directory written by generate_cohort.')
+        parser.add_argument('--host', default='127.0.0.1',
+                            help='Address to listen on. Default: 127.0.0.1')
+        parser.add_argument('--port', default=8100, type=int,
+                            help='Port to listen on. Default: 8100')
+        parser.add_argument('--latency-ms', default=0, type=float,
+                            help='Mean response time of every API. Default: 0')
+        parser.add_argument('--jitter-ms', default=0, type=float,
+                            help='Response times vary by up to this much.'
+                            ' Default: 0')
+        parser.add_argument('--error-rate', default=0, type=float,
+                            help='Proportion of requests to every API which'
+                            ' fail. Default: 0')
+        parser.add_argument('--error-status', default=503, type=int,
+                            help='HTTP status of failed requests. Default: 503')
+        parser.add_argument('--api-latency-ms', default=[], action='append',
+                            help='Mean response time of one API, e.g.'
+                            ' panelapp=200. May be repeated.')
+        parser.add_argument('--api-error-rate', default=[], action='append',
+                            help='Proportion of failed requests for one API,'
+                            ' e.g. cip_api=0.05. May be repeated.')
+        parser.add_argument('--page-size', default=100, type=int,
+                            help='Cases per page of the interpretation request'
+                            ' list. Default: 100')
+        parser.add_argument('--seed', default=0, type=int,
+                            help='Random seed for latency and errors.'
+                            ' Default: 0')
+        parser.add_argument('--verbose', action='store_true',
+                            help='Log every request.')
+
+    def handle(self, *args, **options):
+        """Start the server and serve until interrupted."""
+        behaviours = {api: ApiBehaviour(latency_ms=options['latency_ms'],
+                                        jitter_ms=options['jitter_ms'],
+                                        error_rate=options['error_rate'],
+                                        error_status=options['error_status'],
+                                        seed=options['seed'])
+                      for api in APIS}
+        for option, attribute in (('api_latency_ms', 'latency_ms'), ('api_error_rate', 'error_rate')):
+            for value in options[option]:
+                api, number = api_value(value)
+                if api not in behaviours:
+                    raise CommandError('{} is not one of {}'.format(api, ', '.join(APIS)))
+                setattr(behaviours[api], attribute, number)
+
+        server = FakeApiServer(options['cohort'], host=options['host'], port=options['port'],
+                               behaviours=behaviours, page_size=options['page_size'],
+                               seed=options['seed'], verbose=options['verbose'])
+        self.stdout.write('Serving {} cases on {}:{}. Point gel2mdt at the fake servers with:'.format(
+            len(server.data.case_list), *server.server_address[:2]))
+        for name, value in server.environ().items():
+            self.stdout.write('    export {}={}'.format(name, value))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write('Requests served: {}'.format(
+                ', '.join('{} {}'.format(name, count) for name, count in sorted(server.request_counts.items()))))
@@ -0,0 +1,64 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from gel2mdt.config import load_config
+from gel2mdt.vep_utils.worker import create_server
+
+
+class Command(BaseCommand):
+    help = """Keep VEP running with its cache loaded and annotate small
+    requests, such as variants added from the proband page, sent to
+    vep_worker_address. Run it on the host where VEP is installed."""
+
+    def add_arguments(self, parser):
+        """Gather options for the worker."""
+        parser.add_argument('--address', default=None,
+                            help='Unix socket path or host:port to listen on.'
+                            ' Default: vep_worker_address from config.txt')
+        parser.add_argument('--assemblies', default='GRCh37,GRCh38',
+                            help='Assemblies to start VEP for straight away;'
+                            ' others start on their first request.'
+                            ' Default: GRCh37,GRCh38')
+        parser.add_argument('--timeout', default=None, type=float,
+                            help='Seconds to wait for VEP to annotate one'
+                            ' request. Default: vep_worker_timeout, or 120')
+
+    def handle(self, *args, **options):
+        """Start VEP for each assembly and serve until interrupted."""
+        config_dict = load_config.get_config()
+        address = options['address'] or config_dict.get('vep_worker_address')
+        if not address:
+            raise CommandError('Set vep_worker_address in config.txt or pass --address')
+        timeout = options['timeout'] or config_dict.get('vep_worker_timeout', 120.0)
+
+        server = create_server(address, config_dict, timeout)
+        try:
+            assemblies = [assembly for assembly in options['assemblies'].split(',') if assembly]
+            self.stdout.write('Starting VEP for {}...'.format(', '.join(assemblies)))
+            server.warm(assemblies)
+            self.stdout.write('VEP worker listening on {}'.format(address))
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop_processes()
+            server.server_close()
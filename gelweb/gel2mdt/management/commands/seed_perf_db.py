@@ -0,0 +1,71 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from gel2mdt.perf_utils.seed import DatabaseSeeder
+
+
+class Command(BaseCommand):
+    help = """Fill the database with synthetic cases, variants, transcripts,
+    MDTs and reports for load testing. Only run this against a database
+    set up for load testing: the rows are added alongside any real data."""
+
+    def add_arguments(self, parser):
+        """Gather options describing the data to add."""
+        parser.add_argument('--cases', default=1000, type=int,
+                            help='Number of cases to add. Default: 1000')
+        parser.add_argument('--sample-type', default='raredisease',
+                            choices=['raredisease', 'cancer'],
+                            help='Type of cases. Default: raredisease')
+        parser.add_argument('--variants-per-case', default=30, type=int,
+                            help='Mean number of variants per case. Default: 30')
+        parser.add_argument('--transcripts-per-variant', default=3, type=int,
+                            help='Number of transcripts of each variant.'
+                            ' Default: 3')
+        parser.add_argument('--mdts', default=None, type=int,
+                            help='Number of MDTs. Default: one for every'
+                            ' --cases-per-mdt cases')
+        parser.add_argument('--cases-per-mdt', default=10, type=int,
+                            help='Number of cases in each MDT. Default: 10')
+        parser.add_argument('--batch-size', default=200, type=int,
+                            help='Number of cases saved together. Default: 200')
+        parser.add_argument('--seed', default=0, type=int,
+                            help='Random seed. Default: 0')
+
+    def handle(self, *args, **options):
+        """Add the data and print the number of rows added to each table."""
+        seeder = DatabaseSeeder(case_count=options['cases'],
+                                sample_type=options['sample_type'],
+                                variants_per_case=options['variants_per_case'],
+                                transcripts_per_variant=options['transcripts_per_variant'],
+                                mdt_count=options['mdts'],
+                                cases_per_mdt=options['cases_per_mdt'],
+                                batch_size=options['batch_size'],
+                                seed=options['seed'],
+                                stdout=self.stdout)
+        started = time.perf_counter()
+        row_counts = seeder.seed()
+        self.stdout.write('Added {} rows in {:.1f}s:'.format(
+            sum(row_counts.values()), time.perf_counter() - started))
+        for name, count in sorted(row_counts.items()):
+            self.stdout.write('  {:<32} {:>10}'.format(name, count))
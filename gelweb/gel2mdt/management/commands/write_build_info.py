@@ -0,0 +1,42 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from gel2mdt import build_info
+
+
+class Command(BaseCommand):
+    help = """Save the version and build shown in the page footer to
+    build_info.json, so the web server does not need to ask git. Run this
+    after each deploy."""
+
+    def handle(self, *args, **options):
+        """Resolve the build info from git and write it to build_info.json."""
+        if os.path.isfile(build_info.BUILD_INFO_PATH):
+            os.remove(build_info.BUILD_INFO_PATH)
+        info = build_info.resolve_build_info()
+        with open(build_info.BUILD_INFO_PATH, 'w') as build_file:
+            json.dump(info, build_file)
+        self.stdout.write('Wrote {} {} to {}'.format(
+            info['version'], info['build'], build_info.BUILD_INFO_PATH))
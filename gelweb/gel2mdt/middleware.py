@@ -0,0 +1,150 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger('gel2mdt.performance')
+
+
+class RequestStats(object):
+    """
+    Latency and query counts of recent requests to each view in this
+    process, used for the /metrics endpoint.
+
+    Attributes:
+        durations (dict): view name to a deque of the latest request times in
+            seconds, at most PERFORMANCE_SAMPLE_SIZE long.
+        query_counts (dict): view name to a deque of the latest SQL query
+            counts.
+        requests (Counter): total requests for each view.
+        slow_requests (Counter): requests slower than
+            PERFORMANCE_SLOW_REQUEST_MS for each view.
+        duplicate_query_requests (Counter): requests which repeated a query
+            at least PERFORMANCE_DUPLICATE_QUERY_THRESHOLD times.
+    """
+    def __init__(self, sample_size):
+        self.lock = threading.Lock()
+        self.durations = defaultdict(lambda: deque(maxlen=sample_size))
+        self.query_counts = defaultdict(lambda: deque(maxlen=sample_size))
+        self.requests = Counter()
+        self.slow_requests = Counter()
+        self.duplicate_query_requests = Counter()
+
+    def add(self, view_name, duration, query_count, slow, duplicates):
+        with self.lock:
+            self.durations[view_name].append(duration)
+            self.query_counts[view_name].append(query_count)
+            self.requests[view_name] += 1
+            if slow:
+                self.slow_requests[view_name] += 1
+            if duplicates:
+                self.duplicate_query_requests[view_name] += 1
+
+    def metrics(self):
+        """
+        :return: Prometheus text format summary of each view's requests
+        """
+        lines = [
+            '# TYPE gel2mdt_request_seconds summary',
+            '# TYPE gel2mdt_request_queries summary',
+            '# TYPE gel2mdt_slow_requests_total counter',
+            '# TYPE gel2mdt_duplicate_query_requests_total counter',
+        ]
+        with self.lock:
+            for view_name in sorted(self.requests):
+                label = 'view="{}"'.format(view_name)
+                for metric, samples in (('gel2mdt_request_seconds', self.durations[view_name]),
+                                        ('gel2mdt_request_queries', self.query_counts[view_name])):
+                    for quantile in (0.5, 0.9, 0.99):
+                        lines.append('{}{{{},quantile="{}"}} {}'.format(
+                            metric, label, quantile, percentile(samples, quantile)))
+                    lines.append('{}_count{{{}}} {}'.format(metric, label, self.requests[view_name]))
+                lines.append('gel2mdt_slow_requests_total{{{}}} {}'.format(
+                    label, self.slow_requests[view_name]))
+                lines.append('gel2mdt_duplicate_query_requests_total{{{}}} {}'.format(
+                    label, self.duplicate_query_requests[view_name]))
+        return '\n'.join(lines) + '\n'
+
+
+def percentile(samples, quantile):
+    """Nearest rank percentile of samples, or 0 if there are none."""
+    if not samples:
+        return 0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+
+request_stats = RequestStats(getattr(settings, 'PERFORMANCE_SAMPLE_SIZE', 1000))
+
+
+class PerformanceMiddleware(object):
+    """
+    Times every request and counts its SQL queries, grouping queries by
+    their SQL (with parameters left as placeholders) to spot the same query
+    being run once per row. Slow requests and requests which repeat a query
+    are written to the gel2mdt.performance log, and every request is added
+    to request_stats for the /metrics endpoint.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'PERFORMANCE_SLOW_REQUEST_MS', 1000) / 1000
+        self.duplicate_threshold = getattr(settings, 'PERFORMANCE_DUPLICATE_QUERY_THRESHOLD', 10)
+
+    def __call__(self, request):
+        queries = Counter()
+
+        def record_query(execute, sql, params, many, context):
+            queries[sql] += 1
+            return execute(sql, params, many, context)
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(record_query):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        query_count = sum(queries.values())
+        duplicates = {sql: count for sql, count in queries.items()
+                      if count >= self.duplicate_threshold}
+        slow = duration >= self.slow_seconds
+        request_stats.add(view_name, duration, query_count, slow, duplicates)
+
+        if slow or duplicates:
+            logger.warning(json.dumps({
+                'view': view_name,
+                'path': request.path,
+                'method': request.method,
+                'status': response.status_code,
+                'duration': round(duration, 4),
+                'query_count': query_count,
+                'duplicate_queries': [{'sql': sql, 'count': count}
+                                      for sql, count in sorted(duplicates.items(),
+                                                               key=lambda item: -item[1])],
+            }))
+        return response
@@ -19,7 +19,7 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from django.conf import settings
 from .model_utils.choices import ChoiceEnum
@@ -45,6 +45,35 @@ class ListUpdate(models.Model):
         app_label= 'gel2mdt'
 
 
+class ListUpdateSpan(models.Model):
+    """
+    Time spent in one stage of a database update, and the queries, API calls
+    and rows created during it. Spans can be nested; depth is the number of
+    spans which were open when this one started.
+    """
+    list_update = models.ForeignKey(ListUpdate, on_delete=models.CASCADE, related_name='spans')
+    name = models.CharField(max_length=200)
+    position = models.IntegerField()
+    depth = models.IntegerField(default=0)
+    started_at = models.DateTimeField()
+    duration = models.FloatField()
+    query_count = models.IntegerField(default=0)
+    http_calls = models.IntegerField(default=0)
+    http_bytes = models.BigIntegerField(default=0)
+    http_retries = models.IntegerField(default=0)
+    http_retry_wait = models.FloatField(default=0)
+    rows_created = models.IntegerField(default=0)
+
+    def __str__(self):
+        return '{} {:.2f}s'.format(self.name, self.duration)
+
+    class Meta:
+        managed = True
+        db_table = 'ListUpdateSpan'
+        app_label= 'gel2mdt'
+        ordering = ('list_update', 'position')
+
+
 class ToolOrAssemblyVersion(models.Model):
     """
     Represents a tool used or genome build and version used in several use cases
@@ -349,13 +378,9 @@ class ClinicalScientist(models.Model):
 
 class Proband(models.Model):
     # these set to null to allow creation then updating later
-    config_dict = load_config.LoadConfig().load()
-    if config_dict['GMC'] != 'None':
-        choices = config_dict['GMC'].split(',')
-        gmc_choices = []
-        for choice in choices:
-            choice=choice.strip(' ')
-            gmc_choices.append((choice, choice))
+    config_dict = load_config.get_config()
+    if config_dict.GMC is not None:
+        gmc_choices = [(choice, choice) for choice in config_dict.GMC]
 
     gel_id = models.CharField(max_length=200, unique=True)
     family = models.OneToOneField(Family, on_delete=models.CASCADE)
@@ -380,7 +405,7 @@ class Proband(models.Model):
     comment = models.TextField(blank=True)
     discussion = models.TextField(blank=True)
     action = models.TextField(blank=True)
-    if config_dict['GMC'] != 'None':
+    if config_dict.GMC is not None:
         gmc = models.CharField(max_length=255, choices=gmc_choices, default='Unknown', null=True, blank=True)
     else:
         gmc = models.CharField(max_length=255, null=True, blank=True)
@@ -547,38 +572,88 @@ class ProbandVariant(models.Model):
         choices=Inheritance.choices(),
         default=Inheritance.unknown)
 
+    # selected ProbandTranscriptVariant and its TranscriptVariant, kept up to
+    # date by select_transcript() and update_selected_transcripts()
+    selected_ptv = models.ForeignKey(
+        'ProbandTranscriptVariant',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+')
+    selected_transcript_variant = models.ForeignKey(
+        TranscriptVariant,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='+')
+
     def __str__(self):
         return str(self.interpretation_report) + " " + str(self.variant)
 
     # Deselect the old transcript and select the provided one
     def select_transcript(self, selected_transcript):
-        ProbandTranscriptVariant.objects.filter(proband_variant=self.id, selected=True).update(selected=False)
-        ProbandTranscriptVariant.objects.filter(proband_variant=self.id,
-                                                transcript=selected_transcript).update(selected=True)
+        with transaction.atomic():
+            ProbandTranscriptVariant.objects.filter(proband_variant=self.id, selected=True).update(selected=False)
+            ProbandTranscriptVariant.objects.filter(proband_variant=self.id,
+                                                    transcript=selected_transcript).update(selected=True)
+            ProbandVariant.update_selected_transcripts([self])
+
+    @classmethod
+    def update_selected_transcripts(cls, proband_variants):
+        """
+        Point each of the given ProbandVariants at its selected
+        ProbandTranscriptVariant and the matching TranscriptVariant, with one
+        UPDATE per thousand ProbandVariants. If more than one transcript is
+        selected the first one created is used.
+        """
+        proband_variants = list(proband_variants)
+        selected_ptvs = {}
+        for ptv in ProbandTranscriptVariant.objects.filter(
+                proband_variant__in=proband_variants, selected=True).order_by('-id'):
+            selected_ptvs[ptv.proband_variant_id] = ptv
+        transcript_variants = {}
+        if selected_ptvs:
+            for transcript_variant in TranscriptVariant.objects.filter(
+                    transcript__in={ptv.transcript_id for ptv in selected_ptvs.values()},
+                    variant__in={pv.variant_id for pv in proband_variants}):
+                transcript_variants[
+                    (transcript_variant.transcript_id, transcript_variant.variant_id)] = transcript_variant
+
+        for pv in proband_variants:
+            ptv = selected_ptvs.get(pv.id)
+            transcript_variant = None
+            if ptv:
+                transcript_variant = transcript_variants.get((ptv.transcript_id, pv.variant_id))
+            pv.selected_ptv = ptv
+            pv.selected_transcript_variant = transcript_variant
+
+        with transaction.atomic():
+            for start in range(0, len(proband_variants), 1000):
+                batch = proband_variants[start:start + 1000]
+                cls.objects.filter(id__in=[pv.id for pv in batch]).update(
+                    selected_ptv=models.Case(*[
+                        models.When(id=pv.id, then=models.Value(pv.selected_ptv_id))
+                        for pv in batch if pv.selected_ptv_id
+                    ], default=None, output_field=models.IntegerField()),
+                    selected_transcript_variant=models.Case(*[
+                        models.When(id=pv.id, then=models.Value(pv.selected_transcript_variant_id))
+                        for pv in batch if pv.selected_transcript_variant_id
+                    ], default=None, output_field=models.IntegerField()))
 
     def get_ptv(self):
-        # Gets first corresponding PTV - needs assessing!
-        ptv = ProbandTranscriptVariant.objects.filter(selected=True, proband_variant=self.id)[0]
-        return ptv
+        return self.selected_ptv
 
     def get_transcript_variant(self):
-        ptv = ProbandTranscriptVariant.objects.filter(selected=True, proband_variant=self.id).first()
-        if ptv:
-            transcript_variant = TranscriptVariant.objects.get(transcript=ptv.transcript,
-                                                            variant=self.variant)
-            return transcript_variant
+        return self.selected_transcript_variant
 
     def get_transcript(self):
-        ptv = ProbandTranscriptVariant.objects.filter(selected=True, proband_variant=self.id).first()
-        if ptv:
-            return ptv.transcript
+        if self.selected_ptv_id:
+            return self.selected_ptv.transcript
         else:
             return None
 
-
     def get_selected_count(self):
-        ptv = ProbandTranscriptVariant.objects.filter(selected=True, proband_variant=self.id).count()
-        return ptv
+        return int(self.selected_ptv_id is not None)
 
     def create_rare_disease_report(self):
         if not hasattr(self, 'rarediseasereport'):
@@ -820,3 +895,245 @@ class MDTReport(models.Model):
         managed = True
         db_table = 'MDTReport'
         app_label= 'gel2mdt'
+
+
+class MDTOutcomeExport(models.Model):
+    """
+    A request to generate the MDT outcome documents for every case in an MDT
+    as a single zip file, which is built by a celery task.
+    """
+    MDT = models.ForeignKey(MDT, on_delete=models.CASCADE)
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
+    status = models.CharField(max_length=1, choices=(
+        ('Q', 'Queued'),
+        ('R', 'Running'),
+        ('C', 'Complete'),
+        ('F', 'Failed'),), default='Q')
+    # MD5 of the content versions of every document in the zip
+    content_version = models.CharField(max_length=32, null=True, blank=True)
+    zip_file = models.CharField(max_length=255, null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+    requested_at = models.DateTimeField(default=timezone.now)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        managed = True
+        db_table = 'MDTOutcomeExport'
+        app_label = 'gel2mdt'
+
+
+class CaseSummary(models.Model):
+    """
+    Denormalised copy of the columns shown in the case tables, with one row per
+    latest GELInterpretationReport. This lets the case list API read a single
+    flat, indexed table instead of walking ir_family -> participant_family ->
+    proband/clinician for every case.
+
+    Rows are rebuilt by refresh() whenever the MultipleCaseAdder adds or
+    updates cases, and by the views which edit any of the summarised fields.
+    """
+    interpretation_report = models.OneToOneField(
+        GELInterpretationReport, on_delete=models.CASCADE, primary_key=True)
+
+    sample_type = models.CharField(max_length=200)
+    cip_id = models.CharField(max_length=10, db_index=True)
+    archived_version = models.IntegerField()
+    status = models.CharField(max_length=200)
+    updated = models.DateTimeField()
+    max_tier = models.CharField(max_length=1)
+    assembly = models.CharField(max_length=200)
+    user = models.CharField(max_length=200)
+    assigned_user = models.CharField(max_length=150, null=True)
+    case_status = models.CharField(
+        max_length=50,
+        choices=GELInterpretationReport._meta.get_field('case_status').choices,
+        default='N')
+    pilot_case = models.BooleanField(default=False)
+    priority = models.CharField(max_length=200)
+
+    gel_id = models.CharField(max_length=200, null=True, db_index=True)
+    forename = models.CharField(max_length=200, null=True)
+    surname = models.CharField(max_length=200, null=True, db_index=True)
+    date_of_birth = models.DateTimeField(null=True)
+    gmc = models.CharField(max_length=255, null=True)
+    recruiting_disease = models.CharField(max_length=200, null=True)
+    clinician = models.CharField(max_length=200, null=True)
+    trio_sequenced = models.BooleanField(default=False)
+    has_de_novo = models.BooleanField(default=False)
+
+    def __str__(self):
+        return str(self.cip_id + " v" + str(self.archived_version))
+
+    @classmethod
+    def from_report(cls, report):
+        """
+        Build an unsaved CaseSummary from a GELInterpretationReport. The
+        report should have its family, proband, clinician, assembly and
+        assigned user select_related to avoid further queries.
+        """
+        family = report.ir_family.participant_family
+        proband = getattr(family, 'proband', None)
+        clinician = family.clinician if family else None
+        return cls(
+            interpretation_report=report,
+            sample_type=report.sample_type,
+            cip_id=report.ir_family.ir_family_id,
+            archived_version=report.archived_version,
+            status=report.status,
+            updated=report.updated,
+            max_tier=report.max_tier,
+            assembly=str(report.assembly),
+            user=report.user,
+            assigned_user=report.assigned_user.username if report.assigned_user else None,
+            case_status=report.case_status,
+            pilot_case=report.pilot_case,
+            priority=report.ir_family.priority,
+            gel_id=proband.gel_id if proband else None,
+            forename=proband.forename if proband else None,
+            surname=proband.surname if proband else None,
+            date_of_birth=proband.date_of_birth if proband else None,
+            gmc=proband.gmc if proband else None,
+            recruiting_disease=proband.recruiting_disease if proband else None,
+            clinician=clinician.name if clinician else None,
+            trio_sequenced=family.trio_sequenced if family else False,
+            has_de_novo=family.has_de_novo if family else False,
+        )
+
+    @classmethod
+    def refresh(cls, reports, batch_size=500):
+        """
+        Rebuild the summary rows for a list of GELInterpretationReports (or
+        their IDs). Only the latest report of each InterpretationReportFamily
+        keeps a row, so summaries for older versions of the same case are
+        removed.
+        """
+        report_ids = [getattr(report, 'id', report) for report in reports]
+        for i in range(0, len(report_ids), batch_size):
+            batch_ids = report_ids[i:i + batch_size]
+            latest_reports = {}
+            for report in GELInterpretationReport.objects.filter(
+                    id__in=batch_ids).select_related(
+                        'assembly',
+                        'assigned_user',
+                        'ir_family__participant_family__clinician',
+                        'ir_family__participant_family__proband'):
+                cip_id = report.ir_family.ir_family_id
+                if cip_id not in latest_reports or \
+                        report.polled_at_datetime > latest_reports[cip_id].polled_at_datetime:
+                    latest_reports[cip_id] = report
+            with transaction.atomic():
+                cls.objects.filter(
+                    models.Q(interpretation_report__in=batch_ids) |
+                    models.Q(cip_id__in=list(latest_reports))).delete()
+                cls.objects.bulk_create([
+                    cls.from_report(report) for report in latest_reports.values()])
+                CaseListVersion.bump(
+                    report.sample_type for report in latest_reports.values())
+
+    @classmethod
+    def refresh_family(cls, family):
+        """
+        Rebuild the summary rows for every report of a Family, used when the
+        Proband or Clinician shared by all versions of its cases is edited.
+        """
+        cls.refresh(GELInterpretationReport.objects.filter(
+            ir_family__participant_family=family).values_list('id', flat=True))
+
+    @classmethod
+    def refresh_all(cls):
+        """
+        Rebuild every summary row from the reports table.
+        """
+        cls.objects.all().delete()
+        cls.refresh(GELInterpretationReport.objects.values_list('id', flat=True))
+        CaseListVersion.bump(['raredisease', 'cancer'])
+
+    class Meta:
+        managed = True
+        db_table = 'CaseSummary'
+        app_label = 'gel2mdt'
+        verbose_name_plural = "Case summaries"
+        indexes = [
+            models.Index(fields=['sample_type', 'updated']),
+        ]
+
+
+class CaseListVersion(models.Model):
+    """
+    Data version counter for the case list of each sample type. Bumped
+    whenever the CaseSummary rows for that sample type change, so cached
+    API responses keyed on the version are invalidated.
+    """
+    sample_type = models.CharField(max_length=200, unique=True, choices=(('cancer', 'cancer'),
+                                                                         ('raredisease', 'raredisease')))
+    version = models.PositiveIntegerField(default=0)
+
+    @classmethod
+    def current(cls, sample_type):
+        """
+        Return the current version for a sample type, or 0 if it has never
+        been bumped.
+        """
+        version = cls.objects.filter(
+            sample_type=sample_type).values_list('version', flat=True).first()
+        return version or 0
+
+    @classmethod
+    def bump(cls, sample_types):
+        """
+        Increment the version of each of the given sample types.
+        """
+        for sample_type in set(sample_types):
+            updated = cls.objects.filter(sample_type=sample_type).update(
+                version=models.F('version') + 1)
+            if not updated:
+                version, created = cls.objects.get_or_create(
+                    sample_type=sample_type, defaults={'version': 1})
+                if not created:
+                    cls.objects.filter(sample_type=sample_type).update(
+                        version=models.F('version') + 1)
+
+    class Meta:
+        managed = True
+        db_table = 'CaseListVersion'
+        app_label = 'gel2mdt'
+
+
+class CaseStatusSnapshot(models.Model):
+    """
+    Number of cases in each case status on a given day, by sample type and
+    pilot flag. Recorded daily from the CaseSummary table so the audit page
+    can show status breakdowns and trends without counting the reports.
+    """
+    date = models.DateField()
+    sample_type = models.CharField(max_length=200, choices=(('cancer', 'cancer'),
+                                                            ('raredisease', 'raredisease')))
+    pilot_case = models.BooleanField(default=False)
+    case_status = models.CharField(max_length=50, choices=GELInterpretationReport._meta.get_field(
+        'case_status').choices)
+    count = models.PositiveIntegerField(default=0)
+    recorded_at = models.DateTimeField(auto_now=True)
+
+    @classmethod
+    def record(cls, date=None):
+        """
+        Count the cases in each status from the CaseSummary table and store
+        them as the snapshot for date, replacing any earlier snapshot of
+        the same day.
+        """
+        if date is None:
+            date = timezone.localdate()
+        counts = CaseSummary.objects.values(
+            'sample_type', 'pilot_case', 'case_status').annotate(count=models.Count('pk'))
+        with transaction.atomic():
+            cls.objects.filter(date=date).delete()
+            cls.objects.bulk_create([cls(date=date, **row) for row in counts])
+
+    class Meta:
+        managed = True
+        db_table = 'CaseStatusSnapshot'
+        app_label = 'gel2mdt'
+        unique_together = (('date', 'sample_type', 'pilot_case', 'case_status'),)
+        indexes = [
+            models.Index(fields=['sample_type', 'date']),
+        ]
@@ -0,0 +1,470 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+CHROMOSOMES = [str(chromosome) for chromosome in range(1, 23)] + ['X']
+BASES = 'ACGT'
+RARE_DISEASE_STATUSES = ['sent_to_gmcs', 'report_generated', 'report_sent']
+CANCER_STATUSES = ['interpretation_generated', 'sent_to_gmcs', 'report_generated', 'report_sent']
+GENOTYPES = ['heterozygous', 'alternate_homozygous', 'reference_homozygous']
+MODES_OF_INHERITANCE = ['monoallelic', 'biallelic', 'xlinked_monoallelic', 'mitochondrial']
+HPO_TERMS = ['HP:0001249', 'HP:0001250', 'HP:0001263', 'HP:0000252', 'HP:0001511', 'HP:0004322',
+             'HP:0000707', 'HP:0001631', 'HP:0000486', 'HP:0001332']
+CANCER_DISEASES = [('BREAST', 'INVASIVE_CARCINOMA'), ('COLORECTAL', 'ADENOCARCINOMA'),
+                   ('LUNG', 'NON_SMALL_CELL'), ('RENAL', 'CLEAR_CELL'), ('SARCOMA', 'SOFT_TISSUE')]
+
+
+class SyntheticGene(object):
+    """
+    A gene in the synthetic genome, covering a block of one chromosome so
+    that variants can be placed inside it.
+    """
+    def __init__(self, number, chromosome, start):
+        self.symbol = 'SYN{}'.format(number)
+        self.ensembl_id = 'ENSG9{:010d}'.format(number)
+        self.hgnc_id = str(900000 + number)
+        self.chromosome = chromosome
+        self.start = start
+        self.end = start + 50000
+
+
+class CohortGenerator(object):
+    """
+    Generates CIP-API interpretation request JSON for a synthetic cohort, in
+    the shape read by the case handler, along with the PanelApp responses and
+    gene lookups needed to add the cohort without network access.
+
+    The same arguments and seed always produce the same cohort, so benchmark
+    results for different commits can be compared.
+
+    Attributes:
+        case_count (int): number of interpretation requests to generate.
+        sample_type (str): raredisease or cancer.
+        random (random.Random): seeded source of all random choices.
+        trio_fraction (float): proportion of rare disease cases with both
+            parents sequenced; the rest are singletons.
+        variants_per_case (int): mean number of tiered variants per case.
+        tier_weights (tuple): relative frequency of tier 1, 2 and 3 report
+            events.
+        cip_flagged_fraction (float): proportion of cases with an interpreted
+            genome from the CIP, flagging some of the tiered variants.
+        clinical_report_fraction (float): proportion of cases with a clinical
+            report listing candidate variants.
+        recurrent_fraction (float): proportion of variants drawn from a pool
+            shared between cases, so the same Variant row is reused.
+        panels_per_case (tuple): minimum and maximum number of analysis panels
+            for each rare disease case.
+        assembly (str): genome build of the cohort, GRCh37 or GRCh38.
+        first_request_id (int): interpretation request ID of the first case.
+        genes (list): SyntheticGenes of the synthetic genome.
+        panels (list): dicts describing each synthetic PanelApp panel.
+        recurrent_variants (list): variants shared between cases.
+    """
+    def __init__(self, case_count, sample_type='raredisease', seed=0, trio_fraction=0.6,
+                 variants_per_case=30, tier_weights=(2, 8, 90), cip_flagged_fraction=0.3,
+                 clinical_report_fraction=0.2, recurrent_fraction=0.2, panel_count=20,
+                 panels_per_case=(1, 4), genes_per_panel=50, assembly='GRCh37',
+                 first_request_id=100000):
+        if sample_type not in ('raredisease', 'cancer'):
+            raise ValueError('{} is not a valid sample type'.format(sample_type))
+        self.case_count = case_count
+        self.sample_type = sample_type
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.trio_fraction = trio_fraction
+        self.variants_per_case = variants_per_case
+        self.tier_weights = tier_weights
+        self.cip_flagged_fraction = cip_flagged_fraction
+        self.clinical_report_fraction = clinical_report_fraction
+        self.recurrent_fraction = recurrent_fraction
+        self.panels_per_case = panels_per_case
+        self.assembly = assembly
+        self.first_request_id = first_request_id
+
+        gene_count = max(panel_count * genes_per_panel // 2, genes_per_panel)
+        self.genes = [
+            SyntheticGene(number, self.random.choice(CHROMOSOMES), self.random.randint(1000000, 100000000))
+            for number in range(1, gene_count + 1)]
+        self.panels = [{
+            'id': '{:024x}'.format(self.random.getrandbits(96)),
+            'version': '1.{}'.format(self.random.randint(0, 200)),
+            'name': 'Synthetic disease {}'.format(number),
+            'genes': self.random.sample(self.genes, genes_per_panel),
+        } for number in range(1, panel_count + 1)]
+        self.recurrent_variants = [self.new_variant() for _ in range(max(variants_per_case * 5, 10))]
+
+    def parameters(self):
+        """
+        :return: dict of the arguments used to generate the cohort
+        """
+        return {
+            'case_count': self.case_count,
+            'sample_type': self.sample_type,
+            'seed': self.seed,
+            'trio_fraction': self.trio_fraction,
+            'variants_per_case': self.variants_per_case,
+            'tier_weights': list(self.tier_weights),
+            'cip_flagged_fraction': self.cip_flagged_fraction,
+            'clinical_report_fraction': self.clinical_report_fraction,
+            'recurrent_fraction': self.recurrent_fraction,
+            'panel_count': len(self.panels),
+            'panels_per_case': list(self.panels_per_case),
+            'genes_per_panel': len(self.panels[0]['genes']),
+            'assembly': self.assembly,
+            'first_request_id': self.first_request_id,
+        }
+
+    def new_variant(self, gene=None):
+        """
+        :return: dict with the position and alleles of a new SNV in a gene
+        """
+        gene = gene or self.random.choice(self.genes)
+        reference = self.random.choice(BASES)
+        return {
+            'gene': gene,
+            'chromosome': gene.chromosome,
+            'position': self.random.randint(gene.start, gene.end),
+            'reference': reference,
+            'alternate': self.random.choice(BASES.replace(reference, '')),
+            'dbSNPid': 'rs{}'.format(self.random.randint(1000, 900000000)) if self.random.random() < 0.5 else None,
+        }
+
+    def choose_variant(self, genes):
+        if self.random.random() < self.recurrent_fraction:
+            return self.random.choice(self.recurrent_variants)
+        return self.new_variant(self.random.choice(genes))
+
+    def choose_tier(self):
+        return 'TIER{}'.format(self.random.choices((1, 2, 3), weights=self.tier_weights)[0])
+
+    def variant_count(self):
+        return max(1, int(self.random.gauss(self.variants_per_case, self.variants_per_case / 4)))
+
+    def status_history(self, created_at, statuses):
+        last_status = self.random.choice(statuses)
+        history = ['waiting_payload', 'interpretation_generated', 'dispatched', 'sent_to_gmcs',
+                   'report_generated', 'report_sent']
+        history = history[:history.index(last_status) + 1]
+        return [{
+            'status': status,
+            'created_at': (created_at + timedelta(days=day)).strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+            'user': 'gel',
+        } for day, status in enumerate(history)]
+
+    def cases(self):
+        """
+        Generate each interpretation request in turn.
+        """
+        for index in range(self.case_count):
+            if self.sample_type == 'raredisease':
+                yield self.rare_disease_case(index)
+            else:
+                yield self.cancer_case(index)
+
+    def case_header(self, index, proband_id, family_id, statuses):
+        request_id = self.first_request_id + index
+        created_at = datetime(2017, 1, 1) + timedelta(minutes=self.random.randint(0, 60 * 24 * 365))
+        status = self.status_history(created_at, statuses)
+        return {
+            'interpretation_request_id': request_id,
+            'version': '1',
+            'sample_type': self.sample_type,
+            'proband': proband_id,
+            'family_id': family_id,
+            'cohort_id': '{}_1'.format(family_id),
+            'cip': self.random.choice(['omicia', 'congenica', 'nextcode', 'illumina', 'exomiser']),
+            'case_priority': self.random.choice(['low', 'medium', 'high']),
+            'assembly': self.assembly,
+            'number_of_samples': 1,
+            'created_at': status[0]['created_at'],
+            'status': status,
+            'last_status': status[-1]['status'],
+            'labkey_links': [],
+            'files': [],
+            'tags': [],
+            'gel_tiering_qc_outcome': [],
+            'interpreted_genome': [],
+            'clinical_report': [],
+        }
+
+    def participant(self, gel_id, sample_id, family_id, sex, is_proband, relation=None):
+        participant = {
+            'gelId': gel_id,
+            'gelFamilyId': family_id,
+            'samples': [sample_id],
+            'sex': sex,
+            'isProband': is_proband,
+            'affectionStatus': 'affected' if is_proband else 'unaffected',
+            'hpoTermList': [],
+            'additionalInformation': {'yearOfBirth': str(self.random.randint(1950, 2015))},
+        }
+        if is_proband:
+            participant['hpoTermList'] = [{'term': term, 'termPresence': True}
+                                          for term in self.random.sample(HPO_TERMS, self.random.randint(1, 4))]
+        else:
+            participant['additionalInformation']['relation_to_proband'] = relation
+        return participant
+
+    def rare_disease_variant(self, variant, participants, panels, tier=None):
+        """
+        :return: tiered variant JSON with a report event for one of the panels
+        """
+        panel = self.random.choice(panels)
+        genotypes = [{
+            'gelId': participant['gelId'],
+            'sampleId': participant['samples'][0],
+            'genotype': GENOTYPES[0] if participant['isProband'] else self.random.choice(GENOTYPES),
+            'phaseSet': None,
+            'depthReference': None,
+            'depthAlternate': None,
+            'copyNumber': None,
+        } for participant in participants]
+        return {
+            'chromosome': variant['chromosome'],
+            'position': variant['position'],
+            'reference': variant['reference'],
+            'alternate': variant['alternate'],
+            'dbSNPid': variant['dbSNPid'],
+            'calledGenotypes': genotypes,
+            'additionalTextualVariantAnnotations': {'ConsequenceType': 'missense_variant'},
+            'additionalNumericVariantAnnotations': {},
+            'comments': [],
+            'reportEvents': [{
+                'reportEventId': 'RE{}'.format(self.random.getrandbits(32)),
+                'tier': tier or self.choose_tier(),
+                'panelName': panel['name'],
+                'panelVersion': panel['version'],
+                'genomicFeature': {
+                    'featureType': 'Gene',
+                    'ensemblId': variant['gene'].ensembl_id,
+                    'HGNC': variant['gene'].symbol,
+                    'ids': {'HGNC': variant['gene'].symbol},
+                },
+                'modeOfInheritance': self.random.choice(MODES_OF_INHERITANCE),
+                'penetrance': 'complete',
+                'score': 0,
+                'groupOfVariants': None,
+                'fullyExplainsPhenotype': None,
+                'variantClassification': None,
+                'eventJustification': '',
+                'phenotype': panel['name'],
+                'vendorSpecificScores': None,
+            }],
+        }
+
+    def gene_panels_coverage(self, panels, participants):
+        coverage = {}
+        for panel in panels:
+            panel_coverage = {}
+            for name in [gene.symbol for gene in panel['genes']] + ['SUMMARY']:
+                gene_coverage = {}
+                for participant in participants:
+                    sample = participant['samples'][0]
+                    gene_coverage[sample + '_avg'] = '{:.3f}'.format(self.random.uniform(20, 60))
+                    gene_coverage[sample + '_gte15x'] = '{:.5f}'.format(self.random.uniform(0.9, 1))
+                panel_coverage[name] = gene_coverage
+            coverage[panel['id']] = panel_coverage
+        return coverage
+
+    def rare_disease_case(self, index):
+        family_id = 'FMSYN{:07d}'.format(index)
+        proband_id = str(200000000 + 3 * index)
+        case = self.case_header(index, proband_id, family_id, RARE_DISEASE_STATUSES)
+
+        participants = [self.participant(proband_id, 'LPSYN{:07d}-DNA_A01'.format(index), family_id,
+                                         self.random.choice(['male', 'female']), True)]
+        if self.random.random() < self.trio_fraction:
+            participants.append(self.participant(str(200000001 + 3 * index), 'LPSYN{:07d}-DNA_B01'.format(index),
+                                                 family_id, 'female', False, 'Mother'))
+            participants.append(self.participant(str(200000002 + 3 * index), 'LPSYN{:07d}-DNA_C01'.format(index),
+                                                 family_id, 'male', False, 'Father'))
+        case['number_of_samples'] = len(participants)
+
+        panel_count = min(self.random.randint(*self.panels_per_case), len(self.panels))
+        panels = self.random.sample(self.panels, panel_count)
+        genes = [gene for panel in panels for gene in panel['genes']]
+        tiered_variants = []
+        seen = set()
+        for _ in range(self.variant_count()):
+            variant = self.choose_variant(genes)
+            key = (variant['chromosome'], variant['position'], variant['reference'], variant['alternate'])
+            if key not in seen:
+                seen.add(key)
+                tiered_variants.append(self.rare_disease_variant(variant, participants, panels))
+
+        case['interpretation_request_data'] = {'json_request': {
+            'genomeAssemblyVersion': 'GRCh37.p13' if self.assembly == 'GRCh37' else self.assembly,
+            'InterpretationRequestID': str(case['interpretation_request_id']),
+            'InterpretationRequestVersion': 1,
+            'pedigree': {
+                'gelFamilyId': family_id,
+                'participants': participants,
+                'analysisPanels': [{
+                    'panelName': panel['id'],
+                    'panelVersion': panel['version'],
+                    'specificDisease': panel['name'],
+                    'review_outcome': 'None',
+                    'multiple_genetic_origins': 'None',
+                } for panel in panels],
+            },
+            'TieredVariants': tiered_variants,
+            'genePanelsCoverage': self.gene_panels_coverage(panels, participants),
+        }}
+
+        if tiered_variants and self.random.random() < self.cip_flagged_fraction:
+            flagged = self.random.sample(tiered_variants, min(len(tiered_variants), self.random.randint(1, 3)))
+            case['interpreted_genome'] = [{
+                'cip_version': 1,
+                'created_at': case['created_at'],
+                'status': [],
+                'gel_qc_outcome': [],
+                'interpreted_genome_data': {
+                    'InterpretationRequestID': str(case['interpretation_request_id']),
+                    'companyName': case['cip'],
+                    'reportedVariants': [dict(variant, evidenceIds=None) for variant in flagged],
+                },
+            }]
+        if tiered_variants and self.random.random() < self.clinical_report_fraction:
+            candidates = self.random.sample(tiered_variants, min(len(tiered_variants), self.random.randint(1, 2)))
+            case['clinical_report'] = [{
+                'clinical_report_version': 1,
+                'created_at': case['created_at'],
+                'valid': True,
+                'exit_questionnaire': None,
+                'clinical_report_data': {
+                    'interpretationRequestID': str(case['interpretation_request_id']),
+                    'interpretationRequestVersion': '1',
+                    'reportingDate': case['created_at'][:10],
+                    'candidateVariants': candidates,
+                    'candidateStructuralVariants': [],
+                },
+            }]
+        return case
+
+    def cancer_variant(self, variant):
+        return {
+            'alleleOrigins': [self.random.choice(['somatic_variant', 'germline_variant'])],
+            'reportedVariantCancer': {
+                'chromosome': variant['chromosome'],
+                'position': variant['position'],
+                'reference': variant['reference'],
+                'alternate': variant['alternate'],
+                'dbSnpId': variant['dbSNPid'],
+                'reportEvents': [{
+                    'reportEventId': 'RE{}'.format(self.random.getrandbits(32)),
+                    'tier': self.choose_tier(),
+                    'genomicFeatureCancer': {
+                        'featureType': 'Transcript',
+                        'ensemblId': 'ENST9{:010d}'.format(int(variant['gene'].hgnc_id)),
+                        'geneName': variant['gene'].symbol,
+                    },
+                }],
+            },
+        }
+
+    def cancer_case(self, index):
+        proband_id = str(300000000 + index)
+        case = self.case_header(index, proband_id, proband_id, CANCER_STATUSES)
+        disease, subtype = self.random.choice(CANCER_DISEASES)
+        tiered_variants = []
+        seen = set()
+        for _ in range(self.variant_count()):
+            variant = self.choose_variant(self.genes)
+            key = (variant['chromosome'], variant['position'], variant['reference'], variant['alternate'])
+            if key not in seen:
+                seen.add(key)
+                tiered_variants.append(self.cancer_variant(variant))
+        case['interpretation_request_data'] = {'json_request': {
+            'cancerParticipant': {
+                'gelId': proband_id,
+                'sex': self.random.choice(['male', 'female']),
+                'primaryDiagnosisDisease': disease,
+                'primaryDiagnosisSubDisease': subtype,
+                'matchedSamples': [{'tumourSampleId': 'LPSYN{:07d}-DNA_T01'.format(index),
+                                    'germlineSampleId': 'LPSYN{:07d}-DNA_G01'.format(index)}],
+                'tumourSamples': [{'sampleId': 'LPSYN{:07d}-DNA_T01'.format(index),
+                                   'tumourContent': self.random.choice(['Low', 'Medium', 'High'])}],
+            },
+            'tieredVariants': tiered_variants,
+        }}
+        return case
+
+    def panel_response(self, panel):
+        """
+        :return: the PanelApp get_panel response for a synthetic panel
+        """
+        return {'result': {
+            'SpecificDiseaseName': panel['name'],
+            'DiseaseGroup': 'Synthetic disorders',
+            'DiseaseSubGroup': 'Synthetic disorders',
+            'version': panel['version'],
+            'Genes': [{
+                'GeneSymbol': gene.symbol,
+                'EnsembleGeneIds': [gene.ensembl_id],
+                'LevelOfConfidence': 'HighEvidence',
+                'ModeOfInheritance': 'monoallelic',
+                'Penetrance': 'Complete',
+            } for gene in panel['genes']],
+        }}
+
+    def write(self, directory):
+        """
+        Write the cohort to a directory:
+            cases/ one interpretation request JSON per case
+            panelapp/ PanelApp responses, named as in panelapp_storage
+            genes/saved_genes.tsv Ensembl to HGNC ID lookups, as in gene_storage
+            genes/gene_locations.tsv gene positions, for the synthetic
+                annotator
+            cohort.json the generator arguments and counts
+        :return: dict written to cohort.json
+        """
+        for subdirectory in ('cases', 'panelapp', 'genes'):
+            os.makedirs(os.path.join(directory, subdirectory), exist_ok=True)
+
+        variant_count = 0
+        for case in self.cases():
+            variant_count += len(case['interpretation_request_data']['json_request'].get(
+                'TieredVariants', case['interpretation_request_data']['json_request'].get('tieredVariants')))
+            file_name = '{}-{}.json'.format(case['interpretation_request_id'], case['version'])
+            with open(os.path.join(directory, 'cases', file_name), 'w') as case_file:
+                json.dump(case, case_file)
+
+        for panel in self.panels:
+            file_name = '{}_{}.json'.format(panel['id'], panel['version'])
+            with open(os.path.join(directory, 'panelapp', file_name), 'w') as panel_file:
+                json.dump(self.panel_response(panel), panel_file)
+
+        with open(os.path.join(directory, 'genes', 'saved_genes.tsv'), 'w') as gene_file:
+            for gene in self.genes:
+                gene_file.write('{}\t{}\n'.format(gene.ensembl_id, gene.hgnc_id))
+        with open(os.path.join(directory, 'genes', 'gene_locations.tsv'), 'w') as gene_file:
+            for gene in self.genes:
+                gene_file.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(
+                    gene.symbol, gene.ensembl_id, gene.hgnc_id, gene.chromosome, gene.start, gene.end))
+
+        manifest = dict(self.parameters(), variant_count=variant_count)
+        with open(os.path.join(directory, 'cohort.json'), 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+        return manifest
@@ -0,0 +1,384 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+from ..config import load_config
+
+APIS = ('cip_api', 'panelapp', 'genenames', 'labkey')
+
+FORENAMES = ['Alex', 'Sam', 'Jo', 'Charlie', 'Robin', 'Morgan', 'Jamie', 'Taylor']
+SURNAMES = ['Smith', 'Jones', 'Taylor', 'Brown', 'Williams', 'Wilson', 'Evans', 'Patel']
+HOSPITALS = ['Great Ormond Street Hospital', "Birmingham Women's and Children's Hospital",
+             'Royal London Hospital', 'Guy\'s Hospital']
+
+
+class ApiBehaviour(object):
+    """
+    How one fake API responds. Each behaviour draws its latency and errors
+    from its own seeded random source, so the responses of one API do not
+    depend on requests made to the others.
+
+    Attributes:
+        latency_ms (float): mean time to wait before responding.
+        jitter_ms (float): the wait is drawn uniformly from latency_ms +/-
+            jitter_ms.
+        error_rate (float): proportion of requests answered with error_status
+            and a non-JSON body, as a failing gateway would.
+        error_status (int): HTTP status of error responses.
+        fail_first (int): number of requests answered with error_status
+            before error_rate applies, for repeatable failures.
+        random (random.Random): source of latency and errors.
+    """
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0, error_status=503, fail_first=0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.fail_first = fail_first
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """
+        :return: seconds to wait before responding
+        """
+        with self._lock:
+            delay = self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(delay, 0) / 1000
+
+    def fails(self):
+        """
+        :return: True if the next request should get an error response
+        """
+        with self._lock:
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                return True
+            return self.random.random() < self.error_rate
+
+
+class CohortData(object):
+    """
+    The responses of the fake APIs, read from a directory written by
+    CohortGenerator.write.
+
+    Attributes:
+        cohort_dir (str): the cohort directory.
+        case_files (dict): interpretation request ID-version to case file.
+        case_list (list): interpretation list entries, as the CIP-API lists
+            them, in request ID order.
+        hgnc_ids (dict): Ensembl gene ID to HGNC ID.
+    """
+    def __init__(self, cohort_dir):
+        self.cohort_dir = cohort_dir
+        self.case_files = {}
+        self.case_list = []
+        case_dir = os.path.join(cohort_dir, 'cases')
+        for filename in sorted(os.listdir(case_dir)):
+            if not filename.endswith('.json'):
+                continue
+            with open(os.path.join(case_dir, filename)) as case_file:
+                case = json.load(case_file)
+            request_id = '{}-{}'.format(case['interpretation_request_id'], case['version'])
+            self.case_files[request_id] = os.path.join(case_dir, filename)
+            self.case_list.append({
+                'interpretation_request_id': request_id,
+                'sample_type': case['sample_type'],
+                'last_status': case['last_status'],
+                'proband': case['proband'],
+                'family_id': case['family_id'],
+                'cip': case['cip'],
+                'case_priority': case['case_priority'],
+                'assembly': case['assembly'],
+                'created_at': case['created_at'],
+            })
+
+        self.hgnc_ids = {}
+        with open(os.path.join(cohort_dir, 'genes', 'saved_genes.tsv')) as gene_file:
+            for line in gene_file:
+                fields = line.rstrip().split('\t')
+                if len(fields) > 1:
+                    self.hgnc_ids[fields[0]] = fields[1]
+
+    def case_json(self, request_id):
+        """
+        :return: the case file contents as bytes, or None if not in the cohort
+        """
+        if request_id not in self.case_files:
+            return None
+        with open(self.case_files[request_id], 'rb') as case_file:
+            return case_file.read()
+
+    def panel_json(self, panelapp_id, version):
+        """
+        :return: the PanelApp response as bytes, or None if not in the cohort
+        """
+        panel_file = os.path.join(self.cohort_dir, 'panelapp', '{}_{}.json'.format(
+            os.path.basename(panelapp_id), os.path.basename(version)))
+        if not os.path.isfile(panel_file):
+            return None
+        with open(panel_file, 'rb') as panel_file:
+            return panel_file.read()
+
+
+def labkey_rows(query_name, value):
+    """
+    Make up LabKey rows for a query, the same every time for the same
+    participant or family ID.
+    :param query_name: one of the LabKey queries made by gel2mdt
+    :param value: value of the query filter
+    :return: list of row dicts
+    """
+    fake = random.Random(value)
+    if query_name in ('rare_diseases_registration', 'cancer_registration'):
+        return [{
+            'consultant_details_full_name_of_responsible_consultant': 'Dr {} {}'.format(
+                fake.choice(FORENAMES), fake.choice(SURNAMES)),
+            'consultant_details_hospital_of_responsible_consultant': fake.choice(HOSPITALS),
+        }]
+    if query_name == 'participant_identifier':
+        return [{
+            'surname': fake.choice(SURNAMES),
+            'forenames': fake.choice(FORENAMES),
+            'date_of_birth': '{}/{:02d}/{:02d} 00:00:00'.format(
+                fake.randint(1950, 2015), fake.randint(1, 12), fake.randint(1, 28)),
+            'person_identifier_type': 'NHSNumber',
+            'person_identifier': str(fake.randint(4000000000, 4999999999)),
+        }]
+    if query_name in ('rare_diseases_diagnosis', 'cancer_diagnosis'):
+        return [{
+            'gel_disease_information_specific_disease': 'Synthetic disease {}'.format(fake.randint(1, 20)),
+            'diagnosis_icd_code': 'C{:02d}'.format(fake.randint(0, 97)),
+        }]
+    return []
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    """
+    Answers requests for all of the fake APIs, each under its own path
+    prefix: /cip-api, /panelapp, /genenames and /labkey.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    routes = (
+        ('cip_api', 'POST', re.compile(r'^/cip-api/api/(2/)?get-token/$'), 'token'),
+        ('cip_api', 'GET', re.compile(r'^/cip-api/api/2/interpretation-request/?$'), 'case_list'),
+        ('cip_api', 'GET', re.compile(r'^/cip-api/api/2/interpretation-request/(\d+)/(\d+)/?$'), 'case'),
+        ('cip_api', 'GET', re.compile(r'^/cip-api/api/interpretationRequests/(\d+)/(\d+)/?$'), 'case'),
+        ('cip_api', 'GET', re.compile(r'^/cip-api/api/ClinicalReport/(\d+)/(\d+)/(\w+)/?$'), 'clinical_report'),
+        ('panelapp', 'GET', re.compile(r'^/panelapp/WebServices/get_panel/([^/]+)/?$'), 'panel'),
+        ('genenames', 'GET', re.compile(r'^/genenames/search/([^/]+)/?$'), 'gene_search'),
+        ('labkey', 'GET', re.compile(r'^/labkey/.*(getQuery|selectRows)\.api$'), 'labkey_query'),
+        ('labkey', 'POST', re.compile(r'^/labkey/.*(getQuery|selectRows)\.api$'), 'labkey_query'),
+    )
+
+    def do_GET(self):
+        self.route('GET')
+
+    def do_POST(self):
+        self.route('POST')
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def route(self, method):
+        url = urlparse(self.path)
+        self.query = parse_qs(url.query)
+        self.body = b''
+        if self.headers.get('Content-Length'):
+            self.body = self.rfile.read(int(self.headers['Content-Length']))
+
+        for api, route_method, pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if match and route_method == method:
+                break
+        else:
+            self.send_json({'detail': 'Not found.'}, status=404)
+            return
+
+        self.api = api
+        self.server.count_request(api)
+        behaviour = self.server.behaviours[api]
+        delay = behaviour.delay()
+        if delay:
+            time.sleep(delay)
+        if behaviour.fails():
+            self.server.count_request(api + '_error')
+            self.send_body(b'Service Unavailable', 'text/plain', behaviour.error_status)
+            return
+        if api == 'cip_api' and name != 'token' and not self.headers.get('Authorization'):
+            self.send_json({'detail': 'Authentication credentials were not provided.'}, status=401)
+            return
+        getattr(self, name)(*match.groups())
+
+    def send_body(self, body, content_type, status=200):
+        etag = None
+        if status == 200 and self.command == 'GET':
+            # answer conditional requests like the real APIs' caching proxies
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+            if self.headers.get('If-None-Match') == etag:
+                self.server.count_request(self.api + '_not_modified')
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status=200):
+        if not isinstance(data, bytes):
+            data = json.dumps(data).encode('utf-8')
+        self.send_body(data, 'application/json', status)
+
+    def token(self, version):
+        self.send_json({'token': 'fake-token'})
+
+    def case_list(self):
+        page_size = self.server.page_size
+        page = int(self.query.get('page', ['1'])[0])
+        cases = self.server.data.case_list
+        results = cases[(page - 1) * page_size:page * page_size]
+        if page < 1 or (page > 1 and not results):
+            self.send_json({'detail': 'Invalid page.'}, status=404)
+            return
+        base = 'http://{}:{}{}'.format(self.server.server_address[0], self.server.server_address[1],
+                                       urlparse(self.path).path)
+        self.send_json({
+            'count': len(cases),
+            'next': '{}?page={}'.format(base, page + 1) if page * page_size < len(cases) else None,
+            'previous': '{}?page={}'.format(base, page - 1) if page > 1 else None,
+            'results': results,
+        })
+
+    def case(self, request_id, version):
+        case_json = self.server.data.case_json('{}-{}'.format(request_id, version))
+        if case_json is None:
+            self.send_json({'detail': 'Not found.'}, status=404)
+        else:
+            self.send_json(case_json)
+
+    def clinical_report(self, request_id, version, cip_version):
+        if '{}-{}'.format(request_id, version) not in self.server.data.case_files:
+            self.send_json({'detail': 'Not found.'}, status=404)
+            return
+        html = ('<html><body><div class="content-div">Clinical report for {}-{}</div>'
+                '<div class="annex-banner content-div">Annex</div></body></html>').format(request_id, version)
+        self.send_body(html.encode('utf-8'), 'text/html')
+
+    def panel(self, panelapp_id):
+        panel_json = self.server.data.panel_json(panelapp_id, self.query.get('version', [''])[0])
+        if panel_json is None:
+            self.send_json({'detail': 'Not found.'}, status=404)
+        else:
+            self.send_json(panel_json)
+
+    def gene_search(self, ensembl_id):
+        hgnc_id = self.server.data.hgnc_ids.get(ensembl_id)
+        docs = [{'hgnc_id': 'HGNC:{}'.format(hgnc_id), 'symbol': None, 'score': 1}] if hgnc_id else []
+        self.send_json({'responseHeader': {'status': 0}, 'response': {'numFound': len(docs), 'docs': docs}})
+
+    def labkey_query(self, action):
+        params = dict(self.query)
+        params.update(parse_qs(self.body.decode('utf-8')))
+        query_name = params.get('query.queryName', [''])[0]
+        filters = [values[0] for name, values in params.items() if name.startswith('query.') and '~' in name]
+        rows = labkey_rows(query_name, filters[0] if filters else '')
+        self.send_json({'rows': rows, 'rowCount': len(rows)})
+
+
+class FakeApiServer(ThreadingMixIn, HTTPServer):
+    """
+    A threaded HTTP server standing in for the CIP-API, PanelApp, genenames
+    and LabKey, serving a generated cohort.
+
+    Attributes:
+        data (CohortData): the cohort being served.
+        behaviours (dict): API name to its ApiBehaviour.
+        page_size (int): number of cases in each page of the interpretation
+            request list.
+        request_counts (Counter): requests received for each API, errors
+            returned as <api>_error and 304 responses as <api>_not_modified.
+        verbose (bool): log each request to stderr.
+    """
+    daemon_threads = True
+
+    def __init__(self, cohort_dir, host='127.0.0.1', port=0, behaviours=None, page_size=100,
+                 seed=0, verbose=False):
+        super().__init__((host, port), FakeApiHandler)
+        self.data = CohortData(cohort_dir)
+        self.behaviours = {api: ApiBehaviour(seed=seed) for api in APIS}
+        self.behaviours.update(behaviours or {})
+        self.page_size = page_size
+        self.request_counts = Counter()
+        self.verbose = verbose
+        self._count_lock = threading.Lock()
+
+    def count_request(self, name):
+        with self._count_lock:
+            self.request_counts[name] += 1
+
+    def config_overrides(self):
+        """
+        :return: dict of config.txt options pointing gel2mdt at this server
+        """
+        address = '{}:{}'.format(*self.server_address[:2])
+        return {
+            'cip_api_base_url': 'http://{}/cip-api'.format(address),
+            'panelapp_base_url': 'http://{}/panelapp'.format(address),
+            'genenames_base_url': 'http://{}/genenames'.format(address),
+            'labkey_domain': address,
+            'labkey_use_ssl': 'False',
+        }
+
+    def environ(self):
+        """
+        :return: dict of GEL2MDT_ environment variables pointing gel2mdt at
+            this server; apply them with load_config.reload_config()
+        """
+        return {load_config.ENV_PREFIX + option.upper(): value
+                for option, value in self.config_overrides().items()}
+
+    def start(self):
+        """
+        Serve requests from a daemon thread.
+        :return: the thread
+        """
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
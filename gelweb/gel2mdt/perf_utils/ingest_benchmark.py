@@ -0,0 +1,171 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from django.utils import timezone
+
+from ..build_info import git_output
+from ..config import load_config
+
+
+@contextmanager
+def throwaway_database():
+    """
+    Create an empty test database for the benchmark, and destroy it
+    afterwards, so that the real database is never touched and every run
+    starts from the same state.
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+@contextmanager
+def cohort_config(cohort_dir, annotator='synthetic'):
+    """
+    Point the config at the PanelApp and gene files of a generated cohort,
+    annotate without VEP and send saved case jsons to a temporary directory.
+    :param annotator: synthetic, to make up transcripts in the cohort's
+        genes, or bypass, to add cases without transcripts
+    """
+    storage_dir = tempfile.mkdtemp(prefix='gel2mdt_benchmark_')
+    gene_dir = os.path.join(storage_dir, 'genes')
+    cip_api_dir = os.path.join(storage_dir, 'cip_api')
+    # the gene manager rewrites saved_genes.tsv, so work on a copy
+    shutil.copytree(os.path.join(cohort_dir, 'genes'), gene_dir)
+    os.makedirs(cip_api_dir)
+    # cohorts generated before gene_locations.tsv was written get made up
+    # genes instead
+    gene_locations = os.path.join(cohort_dir, 'genes', 'gene_locations.tsv')
+    overrides = {
+        load_config.ENV_PREFIX + 'ANNOTATOR': annotator,
+        load_config.ENV_PREFIX + 'SYNTHETIC_ANNOTATOR_GENES':
+            gene_locations if os.path.isfile(gene_locations) else '',
+        load_config.ENV_PREFIX + 'PANELAPP_STORAGE': os.path.join(cohort_dir, 'panelapp'),
+        load_config.ENV_PREFIX + 'GENE_STORAGE': gene_dir,
+        load_config.ENV_PREFIX + 'CIP_API_STORAGE': cip_api_dir,
+    }
+    previous = {name: os.environ.get(name) for name in overrides}
+    os.environ.update(overrides)
+    load_config.reload_config()
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        load_config.reload_config()
+        shutil.rmtree(storage_dir, ignore_errors=True)
+
+
+def peak_rss_mb():
+    """
+    :return: peak resident set size of this process in MB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    if platform.system() == 'Darwin':
+        return peak / 1024 / 1024
+    return peak / 1024
+
+
+def run_benchmark(cohort_dir, sample_type=None, annotator='synthetic'):
+    """
+    Add every case in a generated cohort to an empty database with the
+    MultipleCaseAdder and measure the run.
+    :param cohort_dir: directory written by CohortGenerator.write
+    :param sample_type: raredisease or cancer. Default: from cohort.json
+    :param annotator: synthetic or bypass, see cohort_config
+    :return: dict of results, ready to be appended to a JSONL file
+    """
+    # imported here so the config overrides are in place first
+    from ..database_utils.multiple_case_adder import MultipleCaseAdder
+    from ..models import ListUpdate
+
+    with open(os.path.join(cohort_dir, 'cohort.json')) as manifest_file:
+        cohort = json.load(manifest_file)
+    sample_type = sample_type or cohort['sample_type']
+
+    query_count = [0]
+
+    def count_query(execute, sql, params, many, context):
+        query_count[0] += 1
+        return execute(sql, params, many, context)
+
+    with throwaway_database(), cohort_config(cohort_dir, annotator):
+        with connection.execute_wrapper(count_query):
+            started = time.perf_counter()
+            mca = MultipleCaseAdder(sample_type=sample_type,
+                                    test_data=True,
+                                    test_data_dir=os.path.join(cohort_dir, 'cases'),
+                                    skip_demographics=True)
+            mca.update_database()
+            duration = time.perf_counter() - started
+
+        list_update = ListUpdate.objects.order_by('-id').prefetch_related('spans').first()
+        spans = [{
+            'name': span.name,
+            'depth': span.depth,
+            'duration': span.duration,
+            'query_count': span.query_count,
+            'rows_created': span.rows_created,
+        } for span in list_update.spans.all()]
+        success = list_update.success
+        error = list_update.error
+
+    case_count = len(mca.list_of_cases)
+    return {
+        'run_at': timezone.now().isoformat(),
+        'commit': git_output('rev-parse', '--short', 'HEAD'),
+        'cohort': cohort,
+        'annotator': annotator,
+        'success': success,
+        'error': error,
+        'cases': case_count,
+        'seconds': round(duration, 3),
+        'cases_per_second': round(case_count / duration, 3) if duration else None,
+        'queries': query_count[0],
+        'queries_per_case': round(query_count[0] / case_count, 1) if case_count else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'spans': spans,
+    }
+
+
+def append_result(result, path):
+    """
+    Append a benchmark result to a JSONL file, one run per line.
+    """
+    with open(path, 'a') as results_file:
+        results_file.write(json.dumps(result, default=str) + '\n')
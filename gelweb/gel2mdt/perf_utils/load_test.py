@@ -0,0 +1,195 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from ..middleware import percentile
+
+
+class Flow(object):
+    """
+    One kind of request replayed by the load test.
+
+    Attributes:
+        name (str): name shown in the report.
+        method (str): GET or POST.
+        path (str): format string of the path, formatted with report_id,
+            mdt_id, sample_type and start.
+        weight (int): relative frequency of the flow.
+    """
+    def __init__(self, name, method, path, weight):
+        self.name = name
+        self.method = method
+        self.path = path
+        self.weight = weight
+
+
+FLOWS = (
+    Flow('main_page', 'GET', '/{main_page}', 1),
+    Flow('case_list_api', 'GET', '/api/gelir/{sample_type}/table?draw=1&start={start}&length=50', 4),
+    Flow('proband', 'GET', '/proband/{report_id}', 4),
+    Flow('mdt', 'GET', '/mdt_view/{mdt_id}', 2),
+    Flow('recent_mdts', 'GET', '/{sample_type}/recent_mdts/', 1),
+    Flow('export_mdt', 'POST', '/export_mdt/{mdt_id}', 1),
+)
+
+
+class LoadTest(object):
+    """
+    Replays the main pages of a running gel2mdt against its web server from
+    several logged in sessions at once, and reports latency percentiles for
+    each flow.
+
+    Attributes:
+        base_url (str): URL of the server, e.g. http://localhost:8000
+        username (str): user to log in as; should be staff so that every
+            page can be seen.
+        password (str): password of the user.
+        sample_type (str): raredisease or cancer.
+        report_ids (list): GELInterpretationReport IDs to open.
+        mdt_ids (list): MDT IDs to open and export.
+        case_count (int): number of cases, used to pick case list pages.
+        concurrency (int): number of sessions making requests at once.
+        flows (list): the Flows to replay, without MDT flows if there are no
+            MDTs.
+        latencies (dict): flow name to list of response times in ms.
+        statuses (dict): flow name to Counter of HTTP status codes, or the
+            exception name for failed requests.
+    """
+    def __init__(self, base_url, username, password, sample_type, report_ids, mdt_ids,
+                 case_count, concurrency=10, seed=0):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.sample_type = sample_type
+        self.report_ids = report_ids
+        self.mdt_ids = mdt_ids
+        self.case_count = case_count
+        self.concurrency = concurrency
+        self.seed = seed
+        self.flows = [flow for flow in FLOWS if mdt_ids or '{mdt_id}' not in flow.path]
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.duration = None
+        self._lock = threading.Lock()
+
+    def login(self):
+        """
+        :return: a requests.Session logged in to the server
+        """
+        session = requests.Session()
+        session.get(self.base_url + '/login/')
+        response = session.post(self.base_url + '/login/', data={
+            'username': self.username,
+            'password': self.password,
+            'csrfmiddlewaretoken': session.cookies.get('csrftoken', ''),
+        }, headers={'Referer': self.base_url + '/login/'}, allow_redirects=False)
+        if 'sessionid' not in session.cookies:
+            raise ValueError('Could not log in to {} as {} (status {})'.format(
+                self.base_url, self.username, response.status_code))
+        return session
+
+    def url(self, flow, rng):
+        return self.base_url + flow.path.format(
+            main_page='rare-disease-main' if self.sample_type == 'raredisease' else 'cancer-main',
+            sample_type=self.sample_type,
+            report_id=rng.choice(self.report_ids),
+            mdt_id=rng.choice(self.mdt_ids) if self.mdt_ids else None,
+            start=rng.randrange(0, max(self.case_count, 1), 50))
+
+    def request(self, session, flow, rng):
+        """
+        Make one request and record its latency and status.
+        """
+        url = self.url(flow, rng)
+        started = time.perf_counter()
+        try:
+            if flow.method == 'POST':
+                response = session.post(url, data={'csrfmiddlewaretoken': session.cookies.get('csrftoken', '')},
+                                        headers={'Referer': url}, allow_redirects=False, stream=True)
+            else:
+                response = session.get(url, allow_redirects=False, stream=True)
+            # read the whole body so streamed responses are timed in full
+            for chunk in response.iter_content(65536):
+                pass
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.latencies[flow.name].append(elapsed)
+            self.statuses[flow.name][status] += 1
+
+    def worker(self, worker_number, request_count):
+        rng = random.Random('{}-{}'.format(self.seed, worker_number))
+        session = self.login()
+        weights = [flow.weight for flow in self.flows]
+        for _ in range(request_count):
+            self.request(session, rng.choices(self.flows, weights=weights)[0], rng)
+
+    def run(self, request_count):
+        """
+        Make request_count requests spread over the sessions.
+        :return: the report from summary()
+        """
+        per_worker = [request_count // self.concurrency + (1 if worker < request_count % self.concurrency else 0)
+                      for worker in range(self.concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for future in [executor.submit(self.worker, worker, count)
+                           for worker, count in enumerate(per_worker)]:
+                future.result()
+        self.duration = time.perf_counter() - started
+        return self.summary()
+
+    def summary(self):
+        """
+        :return: dict of flow name to count, statuses and latency percentiles
+            in ms, with the totals under 'all'
+        """
+        summary = {}
+        every_latency = []
+        for name, latencies in self.latencies.items():
+            every_latency += latencies
+            summary[name] = self.describe(latencies, self.statuses[name])
+        all_statuses = sum(self.statuses.values(), Counter())
+        summary['all'] = self.describe(every_latency, all_statuses)
+        summary['all']['requests_per_second'] = round(len(every_latency) / self.duration, 1) \
+            if self.duration else None
+        return summary
+
+    @staticmethod
+    def describe(latencies, statuses):
+        return {
+            'count': len(latencies),
+            'statuses': {str(status): count for status, count in statuses.items()},
+            'p50': round(percentile(latencies, 0.5), 1),
+            'p90': round(percentile(latencies, 0.9), 1),
+            'p95': round(percentile(latencies, 0.95), 1),
+            'p99': round(percentile(latencies, 0.99), 1),
+            'max': round(max(latencies), 1) if latencies else 0,
+        }
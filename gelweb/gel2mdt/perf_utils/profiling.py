@@ -0,0 +1,260 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import tracemalloc
+from datetime import datetime
+
+from ..database_utils import ingest_timing
+
+
+class CProfileBackend(object):
+    """Deterministic profiler, from the standard library."""
+    name = 'cprofile'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.used = False
+
+    def start(self):
+        self.used = True
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def text(self, top):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream)
+        stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+        return stream.getvalue()
+
+
+class SamplingBackend(object):
+    """Sampling profiler from pyinstrument, which has a lower overhead."""
+    name = 'sampling'
+
+    def __init__(self):
+        from pyinstrument import Profiler
+        self.profiler = Profiler()
+        self.used = False
+
+    def start(self):
+        self.used = True
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.stop()
+
+    def text(self, top):
+        return self.profiler.output_text(unicode=False, color=False)
+
+
+def sampling_available():
+    """
+    :return: True if pyinstrument is installed
+    """
+    try:
+        import pyinstrument
+    except ImportError:
+        return False
+    return True
+
+
+class StageProfile(object):
+    """
+    Profile and memory use of one stage of a run.
+
+    Attributes:
+        name (str): span name, or "outside stages" for time spent between
+            the profiled spans.
+        depth (int): depth of the span.
+        backend (CProfileBackend or SamplingBackend): profiler of the time
+            spent in the stage itself, not in profiled stages inside it.
+        wall_time (float): seconds spent in the stage, including inner
+            stages.
+        memory_start (tracemalloc.Snapshot): snapshot when the stage started.
+        memory_diff (list): tracemalloc StatisticDiffs, largest growth first.
+        traced_memory (tuple): traced memory in bytes, and the peak so far,
+            when the stage finished.
+    """
+    def __init__(self, name, depth, backend):
+        self.name = name
+        self.depth = depth
+        self.backend = backend
+        self.wall_time = 0.0
+        self.memory_start = None
+        self.memory_diff = []
+        self.traced_memory = None
+
+
+class RunProfiler(object):
+    """
+    Profiles a MultipleCaseAdder run, with a separate profile for each span
+    of its IngestTimer down to max_depth, and a tracemalloc snapshot at the
+    start and end of each of those spans. Used as a context manager around
+    creating the MultipleCaseAdder and calling update_database().
+
+    Only one profiler can be active at once, so when a profiled span starts
+    the profile of the enclosing span is paused; the profile of each stage
+    is the time spent in it outside of the profiled stages inside it.
+
+    Attributes:
+        mode (str): cprofile, or sampling to use pyinstrument.
+        output_dir (str): directory the results are written to.
+        top (int): number of functions and allocation sites in each summary.
+        max_depth (int): deepest span given its own profile.
+        memory (bool): take tracemalloc snapshots; this slows the run down.
+        stages (list): StageProfiles, in the order the stages started.
+        prefix (str): start of the names of the files written.
+        paths (list): files written.
+    """
+    def __init__(self, mode='cprofile', output_dir='profiles', top=25, max_depth=1, memory=True):
+        if mode not in ('cprofile', 'sampling'):
+            raise ValueError('{} is not a profiling mode'.format(mode))
+        self.mode = mode
+        self.output_dir = output_dir
+        self.top = top
+        self.max_depth = max_depth
+        self.memory = memory
+        self.stages = []
+        self.active = []
+        self.prefix = None
+        self.paths = []
+        self.started_tracemalloc = False
+
+    @staticmethod
+    def take_snapshot():
+        """
+        :return: tracemalloc snapshot, leaving out tracemalloc's own memory
+        """
+        return tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+
+    def new_backend(self):
+        if self.mode == 'sampling':
+            return SamplingBackend()
+        return CProfileBackend()
+
+    def start_stage(self, name, depth):
+        if self.active:
+            self.active[-1].backend.stop()
+        stage = StageProfile(name, depth, self.new_backend())
+        if self.memory:
+            stage.memory_start = self.take_snapshot()
+        self.stages.append(stage)
+        self.active.append(stage)
+        stage.backend.start()
+        return stage
+
+    def finish_stage(self, wall_time=None):
+        stage = self.active.pop()
+        stage.backend.stop()
+        if wall_time is not None:
+            stage.wall_time = wall_time
+        if self.memory:
+            snapshot = self.take_snapshot()
+            stage.memory_diff = snapshot.compare_to(stage.memory_start, 'lineno')[:self.top]
+            stage.memory_start = None
+            stage.traced_memory = tracemalloc.get_traced_memory()
+        if self.active:
+            self.active[-1].backend.start()
+        return stage
+
+    def span_started(self, span):
+        if span.depth <= self.max_depth:
+            self.start_stage(span.name, span.depth)
+
+    def span_finished(self, span):
+        if span.depth <= self.max_depth and self.active and self.active[-1].name == span.name:
+            self.finish_stage(span.duration)
+
+    def __enter__(self):
+        self.prefix = 'run_batch_update-{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S'))
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.started = datetime.now()
+        self.start_stage('outside stages', -1)
+        ingest_timing.add_span_listener(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        ingest_timing.remove_span_listener(self)
+        # close any stages left open by an exception, then the outer one
+        while self.active:
+            self.finish_stage()
+        self.stages[0].wall_time = (datetime.now() - self.started).total_seconds()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+        self.write()
+        return False
+
+    def write(self):
+        """
+        Write the combined .pstats file, a .pstats file for each stage (in
+        cprofile mode) and the text summary of every stage.
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.mode == 'cprofile':
+            profiles = [stage.backend.profile for stage in self.stages if stage.backend.used]
+            combined = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                combined.add(profile)
+            path = os.path.join(self.output_dir, self.prefix + '.pstats')
+            combined.dump_stats(path)
+            self.paths.append(path)
+            for number, stage in enumerate(self.stages):
+                path = os.path.join(self.output_dir, '{}-{:02d}-{}.pstats'.format(
+                    self.prefix, number, re.sub(r'[^\w.-]+', '_', stage.name)))
+                stage.backend.profile.dump_stats(path)
+                self.paths.append(path)
+
+        path = os.path.join(self.output_dir, self.prefix + '.txt')
+        with open(path, 'w') as summary:
+            summary.write(self.summary())
+        self.paths.append(path)
+
+    def summary(self):
+        """
+        :return: text with the top functions and allocation sites of each
+            stage
+        """
+        lines = ['Profile of run_batch_update started {}, mode {}{}'.format(
+            self.started.strftime('%Y-%m-%d %H:%M:%S'), self.mode,
+            ', with tracemalloc' if self.memory else ''), '']
+        for stage in self.stages:
+            lines.append('=' * 79)
+            lines.append('{}{} ({:.2f}s wall, including inner stages)'.format(
+                '  ' * max(stage.depth, 0), stage.name, stage.wall_time))
+            if stage.traced_memory:
+                lines.append('Traced memory at end {:.1f} MB, peak so far {:.1f} MB'.format(
+                    stage.traced_memory[0] / 1024 / 1024, stage.traced_memory[1] / 1024 / 1024))
+            lines.append('')
+            lines.append(stage.backend.text(self.top))
+            if stage.memory_diff:
+                lines.append('Top {} allocation sites by growth during the stage:'.format(self.top))
+                lines += [str(statistic) for statistic in stage.memory_diff]
+                lines.append('')
+        return '\n'.join(lines) + '\n'
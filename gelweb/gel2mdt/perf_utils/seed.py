@@ -0,0 +1,367 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import random
+
+import factory.random
+from django.contrib.auth.models import User
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Max, Value, When
+
+from .. import factories
+from ..models import *
+
+TIER_WEIGHTS = (2, 8, 90)
+# most rows inserted by one bulk_create query, if the database allows it
+MAX_BATCH_SIZE = 1000
+
+
+def bulk_batch_size(instances):
+    """
+    :return: number of a list of instances of one model to insert per
+        query, within the limits of the database backend (SQLite can only
+        insert a few hundred rows at once)
+    """
+    fields = type(instances[0])._meta.concrete_fields
+    return max(min(MAX_BATCH_SIZE, connection.ops.bulk_batch_size(fields, instances)), 1)
+
+
+class IdAllocator(object):
+    """
+    Hands out primary keys above the highest existing key of each model, so
+    that rows can be linked to each other before they are bulk created (some
+    database backends do not return the keys of bulk created rows). Keys
+    must be assigned before building the instances which point at them, as
+    a foreign key ID is copied when the related instance is assigned.
+    """
+    def __init__(self):
+        self.next_ids = {}
+
+    def assign(self, instances):
+        """
+        Set the primary key of each of a list of instances of one model.
+        :return: the instances
+        """
+        if not instances:
+            return instances
+        model = type(instances[0])
+        if model not in self.next_ids:
+            self.next_ids[model] = (model.objects.aggregate(max_id=Max('pk'))['max_id'] or 0) + 1
+        for instance in instances:
+            instance.pk = self.next_ids[model]
+            self.next_ids[model] += 1
+        return instances
+
+    def reset_sequences(self):
+        """
+        Move the database sequences past the keys handed out, for backends
+        which need it.
+        """
+        statements = connection.ops.sequence_reset_sql(no_style(), list(self.next_ids))
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+
+
+class DatabaseSeeder(object):
+    """
+    Fills the database with synthetic cases, built with the factories used in
+    the tests and saved with bulk_create, for load testing the web pages.
+
+    Attributes:
+        case_count (int): number of cases to add.
+        sample_type (str): raredisease or cancer.
+        variants_per_case (int): mean number of ProbandVariants per case.
+        transcripts_per_variant (int): number of transcripts of each gene,
+            each with a TranscriptVariant and ProbandTranscriptVariant.
+        mdt_count (int): number of MDTs to add.
+        cases_per_mdt (int): number of cases added to each MDT.
+        batch_size (int): number of cases built and saved together.
+        random (random.Random): seeded source of the structure of the cases;
+            factory_boy's random values are seeded with the same seed.
+        ids (IdAllocator): primary keys for the new rows.
+        row_counts (dict): model name to number of rows created.
+    """
+    def __init__(self, case_count, sample_type='raredisease', variants_per_case=30,
+                 transcripts_per_variant=3, mdt_count=None, cases_per_mdt=10, batch_size=200,
+                 seed=0, stdout=None):
+        self.case_count = case_count
+        self.sample_type = sample_type
+        self.variants_per_case = variants_per_case
+        self.transcripts_per_variant = transcripts_per_variant
+        self.mdt_count = case_count // cases_per_mdt if mdt_count is None else mdt_count
+        self.cases_per_mdt = cases_per_mdt
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        factory.random.reseed_random(seed)
+        self.ids = IdAllocator()
+        self.row_counts = {}
+        self.stdout = stdout
+
+    def bulk_create(self, instances):
+        """
+        Bulk create a list of instances of one model, assigning keys to those
+        without one.
+        :return: the instances
+        """
+        if not instances:
+            return instances
+        model = type(instances[0])
+        self.ids.assign([instance for instance in instances if instance.pk is None])
+        model.objects.bulk_create(instances, batch_size=bulk_batch_size(instances))
+        name = model.__name__
+        self.row_counts[name] = self.row_counts.get(name, 0) + len(instances)
+        return instances
+
+    def seed(self):
+        """
+        Add the reference data, cases and MDTs.
+        :return: dict of model name to number of rows created
+        """
+        self.create_reference_data()
+        reports = []
+        for start in range(0, self.case_count, self.batch_size):
+            with transaction.atomic():
+                batch = self.create_cases(min(self.batch_size, self.case_count - start))
+            CaseSummary.refresh(batch)
+            reports += batch
+            if self.stdout:
+                self.stdout.write('Added {} of {} cases'.format(len(reports), self.case_count))
+        with transaction.atomic():
+            self.create_mdts(reports)
+        self.ids.reset_sequences()
+        return self.row_counts
+
+    def create_reference_data(self):
+        """
+        Create the genes, transcripts, panels and staff shared by the cases.
+        """
+        self.assembly, created = ToolOrAssemblyVersion.objects.get_or_create(
+            tool_name='genome_build', version_number='GRCh37')
+        self.user, created = User.objects.get_or_create(username='perf_seed')
+
+        gene_count = max(200, self.variants_per_case * 10)
+        self.genes = self.ids.assign([factories.GeneFactory.build() for _ in range(gene_count)])
+        # unique fields are made from the key rather than left to Faker
+        for gene in self.genes:
+            gene.hgnc_id = 'SEED{}'.format(gene.id)
+        self.bulk_create(self.genes)
+
+        self.transcripts = {}
+        transcripts = []
+        for gene in self.genes:
+            gene_transcripts = [factories.TranscriptFactory.build(
+                gene=gene, genome_assembly=self.assembly, canonical_transcript=index == 0)
+                for index in range(self.transcripts_per_variant)]
+            self.transcripts[gene.id] = gene_transcripts
+            transcripts += gene_transcripts
+        for transcript in self.ids.assign(transcripts):
+            transcript.name = 'ENST9{:010d}'.format(transcript.id)
+        self.bulk_create(transcripts)
+
+        panels = self.ids.assign([factories.PanelFactory.build() for _ in range(20)])
+        for panel in panels:
+            panel.panelapp_id = 'seed{:028x}'.format(panel.id)
+        self.bulk_create(panels)
+        self.panel_versions = self.bulk_create([
+            factories.PanelVersionFactory.build(panel=panel) for panel in panels])
+        self.panel_genes = {}
+        panel_version_genes = []
+        for panel_version in self.panel_versions:
+            genes = self.random.sample(self.genes, min(50, len(self.genes)))
+            self.panel_genes[panel_version.id] = genes
+            panel_version_genes += [factories.PanelVersionGene.build(
+                panel_version=panel_version, gene=gene) for gene in genes]
+        self.bulk_create(panel_version_genes)
+
+        self.clinicians = self.bulk_create([factories.ClinicianFactory.build() for _ in range(20)])
+        self.clinical_scientists = self.bulk_create([
+            factories.ClinicianScientistFactory.build() for _ in range(5)])
+        self.other_staff = self.bulk_create([factories.OtherStaffFactory.build() for _ in range(5)])
+        self.recurrent_variants = self.bulk_create([
+            self.build_variant(self.random.choice(self.genes)) for _ in range(self.variants_per_case * 5)])
+        self.recurrent_transcript_variants = self.create_transcript_variants(self.recurrent_variants)
+
+    def create_transcript_variants(self, variants):
+        """
+        Create a TranscriptVariant for each transcript of the gene of each
+        variant.
+        :return: dict of (transcript ID, variant ID) to TranscriptVariant
+        """
+        transcript_variants = {}
+        for variant in variants:
+            for transcript in self.transcripts[variant.gene.id]:
+                transcript_variants[(transcript.id, variant.id)] = factories.TranscriptVariantFactory.build(
+                    transcript=transcript, variant=variant)
+        self.bulk_create(list(transcript_variants.values()))
+        return transcript_variants
+
+    def build_variant(self, gene):
+        variant = factories.VariantFactory.build(genome_assembly=self.assembly)
+        variant.position = self.random.randint(1000000, 100000000)
+        variant.gene = gene
+        return variant
+
+    def create_cases(self, count):
+        """
+        Create a batch of cases, each with a family, proband, relatives,
+        panels, report and variants.
+        :return: list of the GELInterpretationReports created
+        """
+        families = self.ids.assign([factories.FamilyFactory.build(
+            clinician=self.random.choice(self.clinicians),
+            trio_sequenced=self.random.random() < 0.6) for _ in range(count)])
+        for family in families:
+            family.gel_family_id = 'SEEDFAM{}'.format(family.id)
+        self.bulk_create(families)
+        probands = self.ids.assign([factories.ProbandFactory.build(family=family) for family in families])
+        for proband in probands:
+            proband.gel_id = 'SEED{}'.format(proband.id)
+        self.bulk_create(probands)
+
+        relatives = []
+        for proband in probands:
+            if proband.family.trio_sequenced:
+                relatives += [factories.RelativeFactory.build(proband=proband, relation_to_proband=relation)
+                              for relation in ('Mother', 'Father')]
+        self.bulk_create(relatives)
+
+        ir_families = self.ids.assign([factories.InterpretationReportFamilyFactory.build(
+            participant_family=family) for family in families])
+        for ir_family in ir_families:
+            ir_family.ir_family_id = '{}-1'.format(9000000 + ir_family.id)
+        self.bulk_create(ir_families)
+
+        case_panels = {}
+        ir_family_panels = []
+        for ir_family in ir_families:
+            panel_versions = self.random.sample(self.panel_versions, self.random.randint(1, 3))
+            case_panels[ir_family.id] = panel_versions
+            ir_family_panels += [factories.InterpretationReportFamilyPanelFactory.build(
+                ir_family=ir_family, panel=panel_version) for panel_version in panel_versions]
+        self.bulk_create(ir_family_panels)
+
+        reports = self.bulk_create([factories.GELInterpretationReportFactory.build(
+            ir_family=ir_family,
+            sample_type=self.sample_type,
+            assembly=self.assembly,
+            archived_version=1,
+            max_tier=str(self.random.choices((1, 2, 3), weights=TIER_WEIGHTS)[0]),
+            case_status=self.random.choice(['N', 'U', 'M', 'V', 'R', 'P', 'C']),
+            mdt_status=self.random.choice(['U', 'R', 'N', 'I', 'D']),
+        ) for ir_family in ir_families])
+
+        self.create_variants(reports, case_panels)
+        return reports
+
+    def create_variants(self, reports, case_panels):
+        """
+        Create the variants of a batch of reports with their transcripts,
+        report events and variant reports.
+        """
+        new_variants = []
+        case_variants = {}
+        for report in reports:
+            panel_versions = case_panels[report.ir_family_id]
+            genes = [gene for panel_version in panel_versions for gene in self.panel_genes[panel_version.id]]
+            variants = {}
+            for _ in range(max(1, int(self.random.gauss(self.variants_per_case, self.variants_per_case / 4)))):
+                if self.random.random() < 0.2:
+                    variant = self.random.choice(self.recurrent_variants)
+                else:
+                    variant = self.build_variant(self.random.choice(genes))
+                    new_variants.append(variant)
+                variants[id(variant)] = (variant, self.random.choice(panel_versions))
+            case_variants[report.id] = list(variants.values())
+        self.bulk_create(new_variants)
+        transcript_variants = dict(self.recurrent_transcript_variants)
+        transcript_variants.update(self.create_transcript_variants(new_variants))
+
+        proband_variants = []
+        report_events = []
+        proband_transcript_variants = []
+        for report in reports:
+            for variant, panel_version in case_variants[report.id]:
+                tier = self.random.choices((1, 2, 3), weights=TIER_WEIGHTS)[0]
+                proband_variant = factories.ProbandVariantFactory.build(
+                    variant=variant, interpretation_report=report, max_tier=tier,
+                    somatic=self.sample_type == 'cancer')
+                # the key must be set before the rows which point at it are built
+                self.ids.assign([proband_variant])
+                proband_variants.append(proband_variant)
+                report_events.append(factories.ReportEventFactory.build(
+                    proband_variant=proband_variant, panel=panel_version, gene=variant.gene, tier=tier))
+                for transcript in self.transcripts[variant.gene.id]:
+                    proband_transcript_variants.append(factories.ProbandTranscriptVariantFactory.build(
+                        proband_variant=proband_variant, transcript=transcript,
+                        selected=transcript.canonical_transcript))
+        self.bulk_create(proband_variants)
+        self.bulk_create(report_events)
+        self.bulk_create(proband_transcript_variants)
+        self.set_selected_transcripts(proband_transcript_variants, transcript_variants)
+
+        if self.sample_type == 'cancer':
+            self.bulk_create([CancerReport(proband_variant=pv) for pv in proband_variants])
+        else:
+            self.bulk_create([RareDiseaseReport(proband_variant=pv) for pv in proband_variants])
+
+    def set_selected_transcripts(self, proband_transcript_variants, transcript_variants):
+        """
+        Point each ProbandVariant at its selected transcript, with one UPDATE
+        per thousand ProbandVariants.
+        """
+        selected = [ptv for ptv in proband_transcript_variants if ptv.selected]
+        for start in range(0, len(selected), 1000):
+            batch = selected[start:start + 1000]
+            ProbandVariant.objects.filter(id__in=[ptv.proband_variant.id for ptv in batch]).update(
+                selected_ptv=Case(*[When(id=ptv.proband_variant.id, then=Value(ptv.id)) for ptv in batch],
+                                  output_field=IntegerField()),
+                selected_transcript_variant=Case(*[
+                    When(id=ptv.proband_variant.id,
+                         then=Value(transcript_variants[(ptv.transcript.id, ptv.proband_variant.variant.id)].id))
+                    for ptv in batch if (ptv.transcript.id, ptv.proband_variant.variant.id) in transcript_variants
+                ], default=None, output_field=IntegerField()))
+
+    def create_mdts(self, reports):
+        """
+        Create MDTs, each with attendees and a random selection of cases.
+        """
+        if not self.mdt_count or not reports:
+            return
+        mdts = self.bulk_create([factories.MDTFactory.build(
+            creator=self.user, sample_type=self.sample_type) for _ in range(self.mdt_count)])
+        mdt_reports = []
+        clinicians = []
+        clinical_scientists = []
+        other_staff = []
+        for mdt in mdts:
+            mdt_reports += [MDTReport(MDT=mdt, interpretation_report=report)
+                            for report in self.random.sample(reports, min(self.cases_per_mdt, len(reports)))]
+            clinicians += [MDT.clinicians.through(mdt=mdt, clinician=clinician)
+                           for clinician in self.random.sample(self.clinicians, 2)]
+            clinical_scientists += [MDT.clinical_scientists.through(mdt=mdt, clinicalscientist=scientist)
+                                    for scientist in self.random.sample(self.clinical_scientists, 2)]
+            other_staff += [MDT.other_staff.through(mdt=mdt, otherstaff=staff)
+                            for staff in self.random.sample(self.other_staff, 1)]
+        self.bulk_create(mdt_reports)
+        for rows in (clinicians, clinical_scientists, other_staff):
+            type(rows[0]).objects.bulk_create(rows, batch_size=bulk_batch_size(rows))
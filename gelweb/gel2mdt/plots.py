@@ -0,0 +1,59 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from bokeh.models import ColumnDataSource, LabelSet
+from bokeh.palettes import Spectral8
+from bokeh.plotting import figure
+
+
+def create_bokeh_barplot(names, values, title):
+    TOOLS = "pan,wheel_zoom,box_zoom,reset,save"
+
+    source = ColumnDataSource(data=dict(names=names,
+                                        counts=values, color=Spectral8))
+
+    plot = figure(x_range=names, plot_height=350, plot_width=770, title=title,
+                          tools=TOOLS)
+
+    labels = LabelSet(x='names', y='counts', text='counts', level='glyph',
+                      x_offset=-13.5, y_offset=0, source=source, render_mode='canvas')
+    plot.vbar(x='names', top='counts', width=0.9, color='color', source=source)
+    plot.add_layout(labels)
+    plot.xgrid.grid_line_color = None
+    plot.legend.orientation = "horizontal"
+    plot.legend.location = "top_center"
+    return plot
+
+
+def create_bokeh_lineplot(dates, series, title):
+    """
+    Line plot with one line for each entry in series, which maps a legend
+    label to a list of values for each of dates.
+    """
+    TOOLS = "pan,wheel_zoom,box_zoom,reset,save"
+
+    plot = figure(x_axis_type='datetime', plot_height=350, plot_width=1540, title=title,
+                  tools=TOOLS)
+    for (label, values), color in zip(series.items(), Spectral8):
+        plot.line(dates, values, legend=label, line_width=2, color=color)
+    plot.legend.orientation = "horizontal"
+    plot.legend.location = "top_left"
+    return plot
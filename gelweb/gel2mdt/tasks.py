@@ -20,147 +20,46 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import requests
-from bs4 import BeautifulSoup
 import os
-from .api_utils.poll_api import PollAPI
+import hashlib
+import traceback
+import zipfile
+from .api_utils.poll_api import PollAPI, get_labkey_server_context
 from .vep_utils import run_vep_batch
 from .models import *
+from . import exports
+from . import gel_reports
 from .database_utils.multiple_case_adder import GeneManager, MultipleCaseAdder
 from celery import task
 import json
 from json import JSONDecodeError
-import labkey as lk
 from datetime import datetime
 import json
 import time
-from bokeh.models import ColumnDataSource, LabelSet
-from bokeh.palettes import Spectral8
-from bokeh.plotting import figure
 from django.core.mail import EmailMessage
+from django.conf import settings
+from django.utils import timezone
 
 @task
 def get_gel_content(user_email, ir, ir_version):
     '''
-    Downloads and formats the GEL Clinical Report. Removes warning signs and inserts the genes in the panel
+    Renders the GEL Clinical Report, with warning signs removed and the genes in the panels inserted, and emails it.
+    Renderings are kept per cip version, so a report which has been rendered before is sent straight away
     :param user_email: Logged in user email address
     :param ir: Interpretation report ID or CIP id
     :param ir_version: Version of CIP id
-    :return: Beatitful soup version of the report
+    :return: path of the rendered report, or None if there is no report
     '''
-    # otherwise get uname and password from a file
-
-    interpretation_reponse = PollAPI(
-        "cip_api_for_report", f'interpretationRequests/{ir}/{ir_version}/')
-    interp_json = interpretation_reponse.get_json_response()
-
-    analysis_versions = []
-    latest = None
-    if 'interpreted_genome' in interp_json:
-        for cip_version in interp_json['interpreted_genome']:
-            analysis_versions.append(cip_version['cip_version'])
-        try:
-            latest = max(analysis_versions)
-        except ValueError as e:
-            latest = 1
-
-    html_report = PollAPI(
-        "cip_api_for_report", f"ClinicalReport/{ir}/{ir_version}/{latest}/"
-    )
-    gel_content = html_report.get_json_response(content=True)
-    try:
-        gel_json_content = json.loads(gel_content)
-        if gel_json_content['detail'].startswith('Not found'):
-            return None
-    except JSONDecodeError as e:
-        pass
-
-    analysis_panels = {}
-
-    panel_app_panel_query_version = 'https://bioinfo.extge.co.uk/crowdsourcing/WebServices/get_panel/{panelhash}/?version={version}'
-    if 'pedigree' in interp_json['interpretation_request_data']['json_request']:
-        if interp_json['interpretation_request_data']['json_request']['pedigree']['analysisPanels']:
-            for panel_section in interp_json['interpretation_request_data']['json_request']['pedigree']['analysisPanels']:
-                panel_name = panel_section['panelName']
-                version = panel_section['panelVersion']
-                analysis_panels[panel_name] = {}
-                panel_details = requests.get(panel_app_panel_query_version.format(panelhash=panel_name, version=version),
-                                             verify=False).json()
-                analysis_panels[panel_name][panel_details['result']['SpecificDiseaseName']] = []
-                for gene in panel_details['result']['Genes']:
-                    analysis_panels[panel_name][panel_details['result']['SpecificDiseaseName']].append(gene['GeneSymbol'])
-
-    gene_panels = {}
-    for panel, details in analysis_panels.items():
-        gene_panels.update(details)
-
-    gel_content = BeautifulSoup(gel_content)
-    try:
-        # remove any warning signs if they appear in the report
-        disclaimer = gel_content.find("div", {"class": "content-div error-panel"}).extract()
-    except:
-        pass
-    # Find the annex header
-    annex = gel_content.find("div", {"class": "annex-banner content-div"})
-
-    # Add a div for the panels  Table tag to be inserted after the report annex
-    div_tag = gel_content.new_tag("div")
-    div_tag['class'] = "content-div"
-    if annex:
-        annex.insert_after(div_tag)
-
-    # panel_keys = fake_panels.keys()
-    panel_keys = list(gene_panels.keys())
-
-    table_tag = gel_content.new_tag("table")
-
-    h3_tag = gel_content.new_tag("h3")
-    h3_tag.string = 'Gene Panel Specification'
-
-    # Table headers and table rows to be inserted after the table tag
-    # tags created to shamelessly rip off the GeL formatting
-    thead_tag = gel_content.new_tag("thead")
-    tr_tag = gel_content.new_tag("tr")
-    th1_tag = gel_content.new_tag("th")
-    th2_tag = gel_content.new_tag("th")
-
-    th1_tag.string = 'Genepanel'
-    th2_tag.string = 'Genes'
-    tr_tag.insert(1, th1_tag)
-    tr_tag.insert(2, th2_tag)
-    thead_tag.insert(1, tr_tag)
-    table_tag.insert(1, thead_tag)
-
-    tbody_tag = gel_content.new_tag("tbody")
-
-    for panel in range(len(panel_keys)):
-        # get the actual name of the panel
-        panel_name = panel_keys[panel]
-        panel_genes = gene_panels[panel_name]
-
-        tr_tag = gel_content.new_tag("tr")
-        td_panel = gel_content.new_tag("td")
-        td_panel['width'] = '20%'
-        td_genes = gel_content.new_tag("td")
-        td_panel.string = panel_name
-        td_genes.string = ', '.join(panel_genes)
-        tr_tag.insert(1, td_panel)
-        tr_tag.insert(2, td_genes)
-        tbody_tag.insert(panel, tr_tag)
-
-    table_tag.insert(2, tbody_tag)
-
-    div_tag.insert(1, h3_tag)
-    div_tag.insert(2, table_tag)
-
-    gel_content = gel_content.prettify('utf-8')
-    with open("output.html", "wb") as file:
-        file.write(gel_content)
+    report_path = gel_reports.render_gel_report(ir, ir_version)
+    if report_path is None:
+        return None
     subject, from_email, to = 'GEL Report', 'bioinformatics@gosh.nhs.uk', user_email
     text_content = f'Please see attached GEL Report for case {ir}-{ir_version}'
     msg = EmailMessage(subject, text_content, from_email, [to])
-    msg.attach_file("output.html")
+    with open(report_path, 'rb') as report_file:
+        msg.attach(f'GEL_Report_{ir}-{ir_version}.html', report_file.read(), 'text/html')
     msg.send()
-    os.remove('output.html')
+    return report_path
 
 
 def panel_app(gene_panel, gp_version):
@@ -170,13 +69,7 @@ def panel_app(gene_panel, gp_version):
     :param gp_version: PanelVersion
     :return: Dict with gene list and len of gene list
     '''
-    gene_list = []
-    panel_app_panel_query_version = 'https://bioinfo.extge.co.uk/crowdsourcing/WebServices/get_panel/{gene_panel}/?version={gp_version}'
-    panel_details = requests.get(
-        panel_app_panel_query_version.format(gene_panel=gene_panel, gp_version=gp_version), verify=False).json()
-
-    for gene in panel_details['result']['Genes']:
-        gene_list.append(gene['GeneSymbol'])
+    disease_name, gene_list = gel_reports.panel_genes(gene_panel, gp_version)
     gene_panel_info = {'gene_list': gene_list, 'panel_length': len(gene_list)}
     return gene_panel_info
 
@@ -204,6 +97,60 @@ def update_cases():
     mca.update_database()
 
 
+@task
+def export_mdt_outcome_forms(export_id):
+    '''
+    Generates the MDT outcome document for every case in an MDT and zips them. Each document is kept on disk under
+    its report ID and content version, so only documents whose content has changed since the last export are rendered
+    :param export_id: MDTOutcomeExport ID
+    :return: Nothing
+    '''
+    export = MDTOutcomeExport.objects.get(id=export_id)
+    export.status = 'R'
+    export.save()
+    try:
+        document_dir = os.path.join(settings.MDT_OUTCOME_STORAGE, 'documents')
+        os.makedirs(document_dir, exist_ok=True)
+        reports = GELInterpretationReport.objects.filter(mdtreport__MDT=export.MDT).select_related(
+            'assembly',
+            'ir_family__participant_family__clinician',
+            'ir_family__participant_family__proband').distinct()
+        documents = []
+        for report in reports:
+            content = exports.mdt_outcome_content(report, export.MDT)
+            version = exports.mdt_outcome_version(content)
+            document_path = os.path.join(document_dir, f'{report.id}_{version}.docx')
+            if not os.path.exists(document_path):
+                exports.render_mdt_outcome(content).save(document_path + '.tmp')
+                os.replace(document_path + '.tmp', document_path)
+            documents.append((document_path, exports.mdt_outcome_filename(content), version))
+
+        export.content_version = hashlib.md5(
+            ''.join(sorted(version for path, name, version in documents)).encode()).hexdigest()
+        zip_path = os.path.join(settings.MDT_OUTCOME_STORAGE,
+                                f'MDT_{export.MDT.id}_{export.content_version}.zip')
+        if not os.path.exists(zip_path):
+            with zipfile.ZipFile(zip_path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                for document_path, filename, version in documents:
+                    zip_file.write(document_path, filename)
+            os.replace(zip_path + '.tmp', zip_path)
+        export.zip_file = zip_path
+        export.status = 'C'
+    except Exception:
+        export.error = traceback.format_exc()
+        export.status = 'F'
+    export.completed_at = timezone.now()
+    export.save()
+
+@task
+def snapshot_case_status():
+    '''
+    Utility function designed to be run daily with celery beat. Records today's case status counts for the audit page
+    :return:
+    '''
+    CaseStatusSnapshot.record()
+
+
 class VariantAdder(object):
     """
     Class for adding single variants to a case
@@ -224,6 +171,7 @@ class VariantAdder(object):
         self.insert_transcript_variants()
         self.insert_proband_variant()
         self.insert_proband_transcript_variant()
+        ProbandVariant.update_selected_transcripts([self.proband_variant])
 
     def run_vep(self):
         self.transcripts = run_vep_batch.generate_transcripts(self.variants)
@@ -322,22 +270,15 @@ class UpdateDemographics(object):
     def __init__(self, report_id):
         self.report = GELInterpretationReport.objects.get(id=report_id)
         self.clinician = None
-        config_dict = load_config.LoadConfig().load()
+        config_dict = load_config.get_config()
         # poll labkey
         if self.report.sample_type == 'raredisease':
-            labkey_server_request = config_dict['labkey_server_request']
-            self.server_context = lk.utils.create_server_context(
-                'gmc.genomicsengland.nhs.uk',
-                labkey_server_request,
-                '/labkey', use_ssl=True)
+            self.server_context = get_labkey_server_context(config_dict['labkey_server_request'])
         elif self.report.sample_type == 'cancer':
-            labkey_server_request = config_dict['labkey_cancer_server_request']
-            self.server_context = lk.utils.create_server_context(
-                'gmc.genomicsengland.nhs.uk',
-                labkey_server_request,
-                '/labkey', use_ssl=True)
+            self.server_context = get_labkey_server_context(config_dict['labkey_cancer_server_request'])
 
     def update_clinician(self):
+        import labkey as lk
         clinician_details = {}
         if self.report.sample_type=='raredisease':
             search_results = lk.query.select_rows(
@@ -387,6 +328,7 @@ class UpdateDemographics(object):
             return None
 
     def update_demographics(self):
+        import labkey as lk
         participant_demographics = {
             "surname": 'unknown',
             "forename": 'unknown',
@@ -485,7 +427,7 @@ class UpdaterFromStorage(object):
             ]
         )
         print(self.reports.count())
-        config_dict = load_config.LoadConfig().load()
+        config_dict = load_config.get_config()
         self.cip_api_storage = config_dict['cip_api_storage']
         for report in self.reports:
             self.json = self.load_json_data(report)
@@ -535,22 +477,3 @@ class UpdaterFromStorage(object):
         report.sample_id = self.proband_sample
         print(self.proband_sample)
         report.save(overwrite=True)
-
-
-def create_bokeh_barplot(names, values, title):
-    TOOLS = "pan,wheel_zoom,box_zoom,reset,save"
-
-    source = ColumnDataSource(data=dict(names=names,
-                                        counts=values, color=Spectral8))
-
-    plot = figure(x_range=names, plot_height=350, plot_width=770, title=title,
-                          tools=TOOLS)
-
-    labels = LabelSet(x='names', y='counts', text='counts', level='glyph',
-                      x_offset=-13.5, y_offset=0, source=source, render_mode='canvas')
-    plot.vbar(x='names', top='counts', width=0.9, color='color', source=source)
-    plot.add_layout(labels)
-    plot.xgrid.grid_line_color = None
-    plot.legend.orientation = "horizontal"
-    plot.legend.location = "top_center"
-    return plot
\ No newline at end of file
@@ -19,21 +19,11 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-import os
-import subprocess
-
 from django import template
-from gel2mdt.config import load_config
+from gel2mdt.build_info import get_build_info
 
 
 register = template.Library()
-config = load_config.LoadConfig().load()
-
-def is_git_repo():
-    if subprocess.call(["git", "branch"], stderr=subprocess.STDOUT, stdout=open(os.devnull, 'w')) != 0:
-        return False
-    else:
-        return True
 
 @register.filter
 def get_item(dictionary, key):
@@ -45,33 +35,10 @@ def sort_by(queryset, order):
 
 @register.simple_tag
 def version_number():
-    if not is_git_repo():
-        return config["VERSION_NUMBER"]
-    version_fetch_cmd = "git tag | sort -V | tail -1"
-    version_fetch_process = subprocess.Popen(
-            version_fetch_cmd,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-    )
-    version_fetch_out, version_fetch_err = version_fetch_process.communicate()
-    version = str(version_fetch_out, "utf-8")
-
-    return version
+    return get_build_info()['version']
 
 @register.simple_tag
 def build():
-    if not is_git_repo():
+    if not get_build_info()['build']:
         return ''
-    build_fetch_cmd = "git log -1 --stat"
-    build_fetch_process = subprocess.Popen(
-            build_fetch_cmd,
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-    )
-    build_fetch_out, build_fetch_err = build_fetch_process.communicate()
-    build_fetch = str(build_fetch_out, "utf-8").split(' ')
-
-    build_hash = build_fetch[1][:6]
-    return 'build ' + build_hash
+    return 'build ' + get_build_info()['build']
@@ -0,0 +1,82 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import os
+import shutil
+import tempfile
+from django.test import TestCase
+
+from ..perf_utils.cohort import CohortGenerator
+from ..vep_utils import annotators
+
+
+class TestCohortGenerator(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_same_seed_same_cohort(self):
+        first = list(CohortGenerator(5, seed=3).cases())
+        second = list(CohortGenerator(5, seed=3).cases())
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, list(CohortGenerator(5, seed=4).cases()))
+
+    def test_panels_per_case_capped_by_panel_count(self):
+        for case in CohortGenerator(3, seed=1, panel_count=2, panels_per_case=(4, 4)).cases():
+            panels = case['interpretation_request_data']['json_request']['pedigree']['analysisPanels']
+            self.assertEqual(len(panels), 2)
+
+    def test_write_rare_disease(self):
+        manifest = CohortGenerator(4, seed=1, trio_fraction=1).write(self.directory)
+        self.assertEqual(manifest['case_count'], 4)
+        self.assertEqual(len(os.listdir(os.path.join(self.directory, 'cases'))), 4)
+
+        with open(os.path.join(self.directory, 'cases', '100000-1.json')) as case_file:
+            case = json.load(case_file)
+        json_request = case['interpretation_request_data']['json_request']
+        self.assertEqual(len(json_request['pedigree']['participants']), 3)
+        self.assertTrue(json_request['TieredVariants'])
+        # every analysis panel can be found without calling PanelApp
+        for panel in json_request['pedigree']['analysisPanels']:
+            self.assertTrue(os.path.isfile(os.path.join(
+                self.directory, 'panelapp',
+                '{}_{}.json'.format(panel['panelName'], panel['panelVersion']))))
+
+    def test_write_cancer(self):
+        CohortGenerator(2, sample_type='cancer', seed=1).write(self.directory)
+        with open(os.path.join(self.directory, 'cases', '100001-1.json')) as case_file:
+            case = json.load(case_file)
+        json_request = case['interpretation_request_data']['json_request']
+        self.assertEqual(case['sample_type'], 'cancer')
+        self.assertTrue(json_request['tieredVariants'])
+        self.assertIn('tumourSamples', json_request['cancerParticipant'])
+
+    def test_gene_locations_for_synthetic_annotator(self):
+        generator = CohortGenerator(2, seed=1)
+        generator.write(self.directory)
+        genes = annotators.read_gene_locations(os.path.join(self.directory, 'genes', 'gene_locations.tsv'))
+        self.assertEqual([gene.ensembl_id for gene in genes], [gene.ensembl_id for gene in generator.genes])
+        annotator = annotators.SyntheticAnnotator(None, genes=genes)
+        gene = generator.genes[0]
+        self.assertEqual(annotator.gene_at(gene.chromosome, gene.start + 10).ensembl_id, gene.ensembl_id)
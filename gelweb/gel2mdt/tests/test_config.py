@@ -0,0 +1,72 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import tempfile
+from django.test import TestCase
+
+from ..config import load_config
+
+
+class TestConfig(TestCase):
+    def setUp(self):
+        config_file = tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False)
+        config_file.write(
+            "VERSION_NUMBER=v0.4.2\n"
+            "cache_version=91\n"
+            "GMC=Great Ormond Street, Birmingham\n"
+            "#bypass_VEP=True\n"
+            "bypass_VEP=False\n"
+            "cip_as_id=True\n"
+        )
+        config_file.close()
+        self.path = config_file.name
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_typed_values(self):
+        config = load_config.Config(load_config.read_config_file(self.path, environ={}))
+        self.assertIs(config.bypass_VEP, False)
+        self.assertIs(config['cip_as_id'], True)
+        self.assertEqual(config.cache_version, 91)
+        self.assertEqual(config.GMC, ['Great Ormond Street', 'Birmingham'])
+        self.assertEqual(config.raw['bypass_VEP'], 'False')
+        self.assertIsNone(config.get('remoteVEP'))
+
+    def test_environment_override(self):
+        raw = load_config.read_config_file(self.path, environ={'GEL2MDT_BYPASS_VEP': 'True',
+                                                               'GEL2MDT_GMC': 'None'})
+        config = load_config.Config(raw)
+        self.assertIs(config.bypass_VEP, True)
+        self.assertIsNone(config.GMC)
+
+    def test_invalid_boolean(self):
+        raw = load_config.read_config_file(self.path, environ={'GEL2MDT_CIP_AS_ID': 'yes'})
+        with self.assertRaises(ValueError):
+            load_config.Config(raw)
+
+    def test_reload(self):
+        config = load_config.get_config()
+        self.assertIs(load_config.get_config(), config)
+        reloaded = load_config.reload_config()
+        self.assertIsNot(reloaded, config)
+        self.assertIs(load_config.get_config(), reloaded)
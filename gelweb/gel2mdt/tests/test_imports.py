@@ -0,0 +1,63 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import os
+import subprocess
+import sys
+from django.test import SimpleTestCase
+
+# only needed by the pages or tasks which use them, so should not be imported
+# when a web or celery worker starts
+HEAVY_MODULES = ('bokeh', 'bs4', 'labkey', 'pysam', 'paramiko', 'docx')
+# generous upper bound in seconds on setting up Django and importing the
+# URLconf, well above the time taken on a developer machine so that only a
+# real regression fails on a slow CI runner
+STARTUP_BUDGET = 10
+# directory containing manage.py
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def imported_modules(*modules):
+    """
+    Set up Django and import modules in a new interpreter, timing both.
+    :return: tuple of the set of names of every module loaded by then and the
+        seconds taken to set up Django and import the modules
+    """
+    code = ('import sys, time; start = time.perf_counter(); import django; django.setup(); '
+            + '; '.join('import ' + module for module in modules)
+            + "; print(time.perf_counter() - start); print('\\n'.join(sorted(sys.modules)))")
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'gelweb.settings.base')
+    process = subprocess.run([sys.executable, '-c', code],
+                             cwd=PROJECT_DIR, env=env,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    lines = str(process.stdout, 'utf-8').splitlines()
+    return set(lines[1:]), float(lines[0])
+
+
+class TestStartupImports(SimpleTestCase):
+    def test_startup_skips_heavy_modules(self):
+        modules, seconds = imported_modules('gel2mdt.urls', 'gel2mdt.tasks')
+        print('django.setup() and URLconf import took {:.2f}s'.format(seconds))
+        self.assertIn('gel2mdt.views', modules)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, modules)
+        self.assertLess(seconds, STARTUP_BUDGET)
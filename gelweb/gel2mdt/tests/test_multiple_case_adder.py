@@ -20,17 +20,24 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import unittest
+from unittest import mock
 from django.test import TestCase
 
 from ..database_utils.multiple_case_adder import MultipleCaseAdder
 from ..database_utils.case_handler import Case, CaseModel, ManyCaseModel
+from ..database_utils import ingest_timing
 from ..models import *
+from ..perf_utils.profiling import RunProfiler
+from ..perf_utils.cohort import CohortGenerator
+from ..perf_utils.ingest_benchmark import cohort_config
 
 import re
 import os
 import json
 import hashlib
 import pprint
+import shutil
+import tempfile
 from datetime import datetime
 from django.utils import timezone
 
@@ -444,3 +451,76 @@ class TestAddCases(TestCase):
         Test that a new IR has been made and links to the correct IRfamily.
         """
         pass
+
+
+class TestIngestTimer(TestCase):
+    """
+    Test the timing spans recorded for each stage of a database update.
+    """
+    def test_nested_spans(self):
+        timer = ingest_timing.IngestTimer()
+        with timer.span('add') as outer:
+            ListUpdate.objects.count()
+            with ingest_timing.span('add:Clinician') as inner:
+                Clinician.objects.count()
+                ingest_timing.record_http_call(100)
+                inner.add_rows(3)
+        self.assertEqual([span.name for span in timer.spans], ['add', 'add:Clinician'])
+        self.assertEqual((outer.depth, inner.depth), (0, 1))
+        self.assertEqual((outer.query_count, inner.query_count), (2, 1))
+        self.assertEqual((outer.http_calls, outer.http_bytes), (1, 100))
+        self.assertEqual((outer.rows_created, inner.rows_created), (0, 3))
+        self.assertIsNone(ingest_timing.current_timer())
+
+    def add_cohort(self, fail=False):
+        """
+        Add a small synthetic cohort with the MultipleCaseAdder, optionally
+        failing part way through.
+        :return: the ListUpdate recorded for the run
+        """
+        cohort_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cohort_dir)
+        CohortGenerator(2, seed=3, panel_count=3).write(cohort_dir)
+        with cohort_config(cohort_dir):
+            mca = MultipleCaseAdder(sample_type='raredisease', test_data=True,
+                                    test_data_dir=os.path.join(cohort_dir, 'cases'),
+                                    skip_demographics=True)
+            if fail:
+                with mock.patch.object(mca, 'add_cases', side_effect=RuntimeError('failed')):
+                    mca.update_database()
+            else:
+                mca.update_database()
+        return ListUpdate.objects.latest('id')
+
+    def test_spans_saved(self):
+        list_update = self.add_cohort()
+        self.assertTrue(list_update.success)
+        names = list(list_update.spans.values_list('name', flat=True))
+        for name in ('add', 'update'):
+            self.assertIn(name, names)
+        add = list_update.spans.get(name='add')
+        self.assertEqual(add.depth, 0)
+        self.assertGreater(add.query_count, 0)
+        self.assertTrue(list_update.spans.filter(depth=1, name__startswith='add:').exists())
+
+    def test_spans_saved_when_update_fails(self):
+        list_update = self.add_cohort(fail=True)
+        self.assertFalse(list_update.success)
+        self.assertIn('failed', list_update.error)
+        self.assertTrue(list_update.spans.filter(name='add').exists())
+
+    def test_profiled_spans(self):
+        output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, output_dir)
+        with RunProfiler(output_dir=output_dir, top=5) as profiler:
+            timer = ingest_timing.IngestTimer()
+            with timer.span('add'):
+                with timer.span('add:Clinician'):
+                    Clinician.objects.count()
+                    with timer.span('add:Clinician:save'):
+                        pass
+        self.assertEqual([stage.name for stage in profiler.stages],
+                         ['outside stages', 'add', 'add:Clinician'])
+        self.assertEqual(len([path for path in profiler.paths if path.endswith('.pstats')]), 4)
+        with open(profiler.paths[-1]) as summary:
+            self.assertIn('add:Clinician', summary.read())
@@ -19,10 +19,21 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import os
+import shutil
+import tempfile
+import time
 import unittest
+from unittest import mock
 from django.test import TestCase
 from ..api_utils.poll_api import PollAPI
 from ..api_utils.cip_utils import InterpretationList
+from ..api_utils.http_cache import HttpCache, get_http_cache
+from ..api_utils.retry_policy import RetryPolicy, CircuitBreaker, PollAPIError, \
+    CircuitOpenError, get_circuit_breaker, reset_circuit_breakers, retry_stats
+from ..config import load_config
+from ..perf_utils.cohort import CohortGenerator
+from ..perf_utils.fake_servers import ApiBehaviour, FakeApiServer
 
 
 class Poll_CIP_API_TestCase(TestCase):
@@ -52,3 +63,198 @@ class TestInterpretationList(TestCase):
                 "sent_to_gmcs",
                 "report_generated",
                 "report_sent"]
+
+
+class TestFakeServers(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cohort_dir = tempfile.mkdtemp()
+        CohortGenerator(5, seed=2, panel_count=3).write(cls.cohort_dir)
+        cls.cache_dir = tempfile.mkdtemp()
+        cls.server = FakeApiServer(cls.cohort_dir, page_size=2)
+        cls.server.start()
+        environ = dict(cls.server.environ(), cip_api_username='user', cip_api_password='password',
+                       GEL2MDT_GENENAMES_MAX_ATTEMPTS='20',
+                       GEL2MDT_GENENAMES_BACKOFF_FACTOR='0.01',
+                       GEL2MDT_PANELAPP_MAX_ATTEMPTS='2',
+                       GEL2MDT_PANELAPP_BACKOFF_FACTOR='0.01',
+                       GEL2MDT_CIP_API_MAX_ATTEMPTS='2',
+                       GEL2MDT_CIP_API_BACKOFF_FACTOR='0.01',
+                       GEL2MDT_CIRCUIT_BREAKER_FAILURES='2',
+                       GEL2MDT_CIRCUIT_BREAKER_RESET_SECONDS='0.5',
+                       GEL2MDT_HTTP_CACHE_DIR=cls.cache_dir)
+        cls.environ = mock.patch.dict(os.environ, environ)
+        cls.environ.start()
+        load_config.reload_config()
+
+    def setUp(self):
+        reset_circuit_breakers()
+        get_http_cache().clear()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.environ.stop()
+        load_config.reload_config()
+        reset_circuit_breakers()
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.cohort_dir)
+        shutil.rmtree(cls.cache_dir)
+        super().tearDownClass()
+
+    def test_base_url_override(self):
+        poll = PollAPI("panelapp", "get_panel/abc/?version=1.0")
+        self.assertEqual(poll.url, self.server.config_overrides()['panelapp_base_url']
+                         + "/WebServices/get_panel/abc/?version=1.0")
+
+    def test_interpretation_list_pages(self):
+        case_list = InterpretationList(sample_type='raredisease')
+        self.assertEqual(len(case_list.all_cases), 5)
+        self.assertEqual(case_list.all_cases_count, 5)
+
+    def test_case_json(self):
+        case_json = PollAPI("cip_api", "interpretation-request/100003/1").get_json_response()
+        self.assertEqual(case_json['interpretation_request_id'], 100003)
+
+    def test_errors_are_retried(self):
+        self.server.behaviours['genenames'] = ApiBehaviour(fail_first=2)
+        self.server.request_counts.clear()
+        try:
+            for _ in range(4):
+                response = PollAPI("genenames", "search/ENSG90000000001/").get_json_response()
+                self.assertEqual(response['response']['docs'][0]['hgnc_id'], 'HGNC:900001')
+        finally:
+            self.server.behaviours['genenames'] = ApiBehaviour()
+        self.assertEqual(self.server.request_counts['genenames_error'], 2)
+        self.assertEqual(self.server.request_counts['genenames'], 6)
+
+    def test_failing_api_opens_circuit(self):
+        self.server.behaviours['panelapp'] = ApiBehaviour(error_rate=1)
+        self.server.request_counts.clear()
+        poll = PollAPI("panelapp", "get_panel/abc/?version=1.0")
+        try:
+            for _ in range(2):
+                with self.assertRaises(PollAPIError):
+                    poll.get_json_response()
+            # each failed poll made max_attempts requests
+            self.assertEqual(self.server.request_counts['panelapp'], 4)
+            with self.assertRaises(CircuitOpenError):
+                poll.get_json_response()
+            self.assertEqual(self.server.request_counts['panelapp'], 4)
+        finally:
+            self.server.behaviours['panelapp'] = ApiBehaviour()
+        self.assertGreaterEqual(retry_stats.as_dict()['panelapp']['circuit_opens'], 1)
+
+    def test_half_open_trial_always_finishes(self):
+        self.server.behaviours['cip_api'] = ApiBehaviour(error_rate=1, error_status=502)
+        breaker = get_circuit_breaker('cip_api')
+        endpoint = "interpretation-request/100002/1"
+        try:
+            # the token endpoint answers with a 502 page rather than JSON
+            for _ in range(2):
+                with self.assertRaises(PollAPIError):
+                    PollAPI("cip_api", endpoint).get_json_response()
+            self.assertEqual(breaker.state, 'open')
+            time.sleep(0.6)
+            with self.assertRaises(PollAPIError):
+                PollAPI("cip_api", endpoint).get_json_response()
+            self.assertFalse(breaker.trial_running)
+            self.assertEqual(breaker.state, 'open')
+
+            # an unexpected error in the trial poll also reopens the circuit
+            time.sleep(0.6)
+            with mock.patch.object(PollAPI, 'poll', side_effect=KeyError('token')):
+                with self.assertRaises(KeyError):
+                    PollAPI("cip_api", endpoint).get_json_response()
+            self.assertFalse(breaker.trial_running)
+            self.assertEqual(breaker.state, 'open')
+        finally:
+            self.server.behaviours['cip_api'] = ApiBehaviour()
+
+        # once the API has recovered the next trial closes the circuit
+        time.sleep(0.6)
+        case_json = PollAPI("cip_api", endpoint).get_json_response()
+        self.assertEqual(case_json['interpretation_request_id'], 100002)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_case_json_is_revalidated(self):
+        self.server.request_counts.clear()
+        for _ in range(3):
+            case_json = PollAPI("cip_api", "interpretation-request/100001/1").get_json_response()
+            self.assertEqual(case_json['interpretation_request_id'], 100001)
+        self.assertEqual(self.server.request_counts['cip_api_not_modified'], 2)
+
+    def test_panel_is_served_from_cache(self):
+        panel_file = sorted(os.listdir(os.path.join(self.cohort_dir, 'panelapp')))[0]
+        panelapp_id, version = panel_file[:-len('.json')].rsplit('_', 1)
+        self.server.request_counts.clear()
+        endpoint = "get_panel/{}/?version={}".format(panelapp_id, version)
+        first = PollAPI("panelapp", endpoint).get_json_response()
+        second = PollAPI("panelapp", endpoint).get_json_response()
+        self.assertEqual(first, second)
+        self.assertEqual(self.server.request_counts['panelapp'], 1)
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        http_cache = HttpCache(self.directory)
+        http_cache.put('http://api/a', b'{"a": 1}\n', etag='"abc"')
+        entry = http_cache.get('http://api/a')
+        self.assertEqual(entry.content, b'{"a": 1}\n')
+        self.assertEqual(entry.conditional_headers(), {'If-None-Match': '"abc"'})
+        self.assertTrue(entry.is_fresh(60))
+        self.assertFalse(entry.is_fresh(0))
+        self.assertIsNone(http_cache.get('http://api/b'))
+
+    def test_least_recently_used_are_evicted(self):
+        http_cache = HttpCache(self.directory, max_bytes=3500)
+        for name in 'abc':
+            http_cache.put('http://api/' + name, b'x' * 900)
+            time.sleep(0.01)
+        # reading a makes b the least recently used
+        http_cache.get('http://api/a')
+        time.sleep(0.01)
+        http_cache.put('http://api/d', b'x' * 900)
+        self.assertIsNone(http_cache.get('http://api/b'))
+        for name in 'acd':
+            self.assertIsNotNone(http_cache.get('http://api/' + name))
+
+
+class TestRetryPolicy(unittest.TestCase):
+    def test_backoff_is_jittered_and_capped(self):
+        policy = RetryPolicy('ensembl', max_attempts=10, backoff_factor=1.0, max_backoff=4.0)
+        waits = [policy.backoff(retry) for retry in range(1, 10) for _ in range(20)]
+        self.assertTrue(all(0 <= wait <= 4.0 for wait in waits))
+        self.assertGreater(len(set(waits)), 1)
+        self.assertTrue(all(policy.backoff(1) <= 1.0 for _ in range(20)))
+
+    def test_config_overrides(self):
+        with mock.patch.dict(os.environ, {'GEL2MDT_ENSEMBL_MAX_ATTEMPTS': '7', 'GEL2MDT_HTTP_TIMEOUT': '2.5'}):
+            load_config.reload_config()
+            policy = RetryPolicy.for_api('ensembl')
+        load_config.reload_config()
+        self.assertEqual((policy.max_attempts, policy.backoff_factor, policy.timeout), (7, 0.5, 2.5))
+
+    def test_circuit_breaker_half_open(self):
+        breaker = CircuitBreaker('test', failure_threshold=2, reset_seconds=0.05)
+        breaker.before_call()
+        breaker.record_failure()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        time.sleep(0.06)
+        # one trial poll is let through, others still fail fast
+        breaker.before_call()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.before_call()
@@ -0,0 +1,48 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+from django.test import TestCase
+
+from ..models import *
+from ..perf_utils.seed import DatabaseSeeder
+
+
+class TestDatabaseSeeder(TestCase):
+    def test_seed(self):
+        row_counts = DatabaseSeeder(case_count=5, variants_per_case=4, transcripts_per_variant=2,
+                                    cases_per_mdt=2, batch_size=2, seed=1).seed()
+        self.assertEqual(GELInterpretationReport.objects.count(), 5)
+        self.assertEqual(CaseSummary.objects.count(), 5)
+        self.assertEqual(MDT.objects.count(), 2)
+        self.assertEqual(MDTReport.objects.count(), 4)
+        self.assertEqual(row_counts['ProbandVariant'], ProbandVariant.objects.count())
+
+        # every variant has a transcript selected, as after a real update
+        for proband_variant in ProbandVariant.objects.all():
+            self.assertTrue(proband_variant.selected_ptv.selected)
+            self.assertEqual(proband_variant.selected_transcript_variant.variant_id,
+                             proband_variant.variant_id)
+            self.assertTrue(hasattr(proband_variant, 'rarediseasereport'))
+
+    def test_seed_twice(self):
+        DatabaseSeeder(case_count=2, variants_per_case=2, seed=1).seed()
+        DatabaseSeeder(case_count=2, variants_per_case=2, seed=1).seed()
+        self.assertEqual(GELInterpretationReport.objects.count(), 4)
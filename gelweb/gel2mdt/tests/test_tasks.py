@@ -19,10 +19,21 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import os
 import unittest
-from django.test import TestCase
+import shutil
+import tempfile
+import zipfile
+from unittest import mock
+from django.core import mail
+from django.test import TestCase, override_settings
+from django.utils import timezone
 from ..tasks import *
 from ..factories import *
+from ..config import load_config
+from ..gel_reports import cached_gel_report
+from ..perf_utils.cohort import CohortGenerator
+from ..perf_utils.fake_servers import FakeApiServer
 from ..vep_utils.run_vep_batch import CaseVariant
 
 
@@ -48,6 +59,94 @@ class TestVariantAdder(TestCase):
         proband_variant = ProbandVariant.objects.filter(interpretation_report=self.gel_ir).first()
         assert proband_variant.variant == self.variant
 
+class TestExportMDTOutcomeForms(TestCase):
+    def setUp(self):
+        self.storage = tempfile.mkdtemp()
+        self.family = FamilyFactory()
+        self.proband = ProbandFactory(family=self.family)
+        self.ir_family = InterpretationReportFamilyFactory(participant_family=self.family)
+        self.gel_ir = GELInterpretationReportFactory(ir_family=self.ir_family)
+        ProbandVariantFactory(interpretation_report=self.gel_ir)
+        self.mdt = MDTFactory()
+        MDTReport.objects.create(MDT=self.mdt, interpretation_report=self.gel_ir)
+
+    def test_outcome_forms_zipped_and_reused(self):
+        with override_settings(MDT_OUTCOME_STORAGE=self.storage):
+            export = MDTOutcomeExport.objects.create(MDT=self.mdt)
+            export_mdt_outcome_forms(export.id)
+            export.refresh_from_db()
+            assert export.status == 'C', export.error
+            with zipfile.ZipFile(export.zip_file) as zip_file:
+                names = zip_file.namelist()
+            assert len(names) == 1
+            assert self.ir_family.ir_family_id in names[0]
+
+            # nothing has changed, so the same documents and zip are reused
+            second_export = MDTOutcomeExport.objects.create(MDT=self.mdt)
+            export_mdt_outcome_forms(second_export.id)
+            second_export.refresh_from_db()
+            assert second_export.content_version == export.content_version
+            assert second_export.zip_file == export.zip_file
+
+            self.proband.discussion = 'Changed after the MDT'
+            self.proband.save()
+            third_export = MDTOutcomeExport.objects.create(MDT=self.mdt)
+            export_mdt_outcome_forms(third_export.id)
+            third_export.refresh_from_db()
+            assert third_export.content_version != export.content_version
+
+
+class TestGelContent(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.cohort_dir = tempfile.mkdtemp()
+        CohortGenerator(2, seed=3, panel_count=3).write(cls.cohort_dir)
+        cls.server = FakeApiServer(cls.cohort_dir)
+        cls.server.start()
+        environ = dict(cls.server.environ(), cip_api_username='user', cip_api_password='password',
+                       GEL2MDT_HTTP_CACHE_DIR='None')
+        cls.environ = mock.patch.dict(os.environ, environ)
+        cls.environ.start()
+        load_config.reload_config()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.environ.stop()
+        load_config.reload_config()
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.cohort_dir)
+        super().tearDownClass()
+
+    def test_report_rendered_once(self):
+        storage = tempfile.mkdtemp()
+        with override_settings(GEL_REPORT_STORAGE=storage):
+            assert cached_gel_report(100000, 1) is None
+            report_path = get_gel_content('user@example.com', 100000, 1)
+            with open(report_path) as report_file:
+                assert 'Gene Panel Specification' in report_file.read()
+            assert len(mail.outbox) == 1
+            assert mail.outbox[0].attachments[0][2] == 'text/html'
+            assert cached_gel_report(100000, 1) == report_path
+
+            # the clinical report is not downloaded or rendered again
+            self.server.request_counts.clear()
+            assert get_gel_content('user@example.com', 100000, 1) == report_path
+            assert self.server.request_counts['panelapp'] == 0
+            assert len(mail.outbox) == 2
+
+            # a case updated after its rendering is checked against the CIP-API once, then served from the cache
+            updated = timezone.now()
+            rendered = updated.timestamp() - 3600
+            os.utime(report_path, (rendered, rendered))
+            assert cached_gel_report(100000, 1, not_before=updated) is None
+            assert get_gel_content('user@example.com', 100000, 1) == report_path
+            assert self.server.request_counts['panelapp'] == 0
+            assert cached_gel_report(100000, 1, not_before=updated) == report_path
+        shutil.rmtree(storage)
+
+
 class TestUpdateDemographics(TestCase):
     def setUp(self):
         #Need to add a case without demographics and then use this?
@@ -19,11 +19,20 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import subprocess
 import unittest
-from django.test import TestCase, Client
+from unittest import mock
+from django.test import TestCase, Client, RequestFactory, override_settings
+from django.http import HttpResponse
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from ..models import *
 from django.urls import reverse
 from ..factories import *
+from ..database_utils.page_loader import MDTPageLoader
+from ..build_info import get_build_info
+from ..middleware import PerformanceMiddleware
 import factory
 
 # TODO Test validation list, pullt3, variantAdder,
@@ -84,7 +93,12 @@ class ViewTests(TestCase):
                                            variant=self.variant)
         self.reportevent = ReportEventFactory(proband_variant=self.proband_variant,
                                               panel=self.ir_panels.panel)
+        ProbandVariant.update_selected_transcripts([self.proband_variant])
         self.mdt = MDTFactory()
+        # data versions restart with each test's database, so drop any case
+        # lists cached by earlier tests
+        cache.clear()
+        CaseSummary.refresh([self.gel_ir])
 
     def test_index_view(self):
         """
@@ -145,6 +159,69 @@ class ViewTests(TestCase):
         self.assertContains(response, self.proband.gel_id)
         self.assertEquals(response.status_code, 200)
 
+    def test_gelir_api_etag(self):
+        """
+        Test the GELIR API answers a matching If-None-Match with a 304 until
+        a case is edited
+        """
+        url = reverse('gelir-json', args=[self.sample_type])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+
+        self.proband.surname = 'Edited'
+        self.proband.save()
+        CaseSummary.refresh([self.gel_ir])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+        self.assertContains(response, 'Edited')
+
+    def test_gelir_table_api(self):
+        """
+        Test the server-side case table returns a page of cases and applies
+        column searches
+        """
+        params = {'draw': 3,
+                  'start': 0,
+                  'length': 10,
+                  'columns[0][data]': 'gel_id',
+                  'columns[0][search][value]': self.proband.gel_id,
+                  'order[0][column]': 0,
+                  'order[0][dir]': 'asc'}
+        response = self.client.get(reverse('gelir-table', args=[self.sample_type]), params)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['draw'], 3)
+        self.assertEquals(response.json()['recordsFiltered'], 1)
+        self.assertContains(response, self.proband.gel_id)
+        params['columns[0][search][value]'] = 'not-a-gel-id'
+        response = self.client.get(reverse('gelir-table', args=[self.sample_type]), params)
+        self.assertEquals(response.json()['recordsFiltered'], 0)
+        self.assertEquals(response.json()['data'], [])
+
+    def test_gelir_table_api_regex(self):
+        """
+        Test the max tier filter's regex is applied and that a malformed regex
+        from the client is searched as plain text instead of raising an error
+        """
+        self.gel_ir.max_tier = '2'
+        self.gel_ir.save()
+        CaseSummary.refresh([self.gel_ir])
+        params = {'draw': 1,
+                  'start': 0,
+                  'length': 10,
+                  'columns[0][data]': 'max_tier',
+                  'columns[0][search][value]': '[012]',
+                  'columns[0][search][regex]': 'true'}
+        response = self.client.get(reverse('gelir-table', args=[self.sample_type]), params)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['recordsFiltered'], 1)
+        params['columns[0][data]'] = 'gel_id'
+        params['columns[0][search][value]'] = '('
+        response = self.client.get(reverse('gelir-table', args=[self.sample_type]), params)
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response.json()['recordsFiltered'], 0)
+
     def test_proband_view(self):
         """
         Tests the sample page for the factory case and you can see the patient
@@ -157,6 +234,80 @@ class ViewTests(TestCase):
         self.assertContains(response, self.transcript1.name) # Should contain selected transcript
         self.assertEquals(response.status_code, 200)
 
+    def test_proband_view_query_count(self):
+        """
+        Tests the number of queries used to render the proband pages does not
+        grow with the number of variants in the case
+        """
+        urls = [reverse('proband-view', args=[self.gel_ir.id]),
+                reverse('gel2clin:proband-view', args=[self.gel_ir.id])]
+        query_counts = []
+        for url in urls:
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+            query_counts.append(len(queries))
+
+        for i in range(5):
+            variant = VariantFactory()
+            transcript = TranscriptFactory(gene=self.gene)
+            proband_variant = ProbandVariantFactory(interpretation_report=self.gel_ir,
+                                                    variant=variant)
+            proband_variant.create_rare_disease_report()
+            ProbandTranscriptVariantFactory(proband_variant=proband_variant,
+                                            transcript=transcript,
+                                            selected=True)
+            TranscriptVariantFactory(transcript=transcript, variant=variant)
+            ProbandVariant.update_selected_transcripts([proband_variant])
+
+        for url, query_count in zip(urls, query_counts):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEquals(response.status_code, 200)
+            self.assertEquals(len(queries), query_count)
+
+    def test_select_transcript_updates_pointer(self):
+        """
+        Tests selecting a transcript updates the ProbandVariant's selected
+        transcript and transcript variant
+        """
+        self.assertEquals(self.proband_variant.get_transcript(), self.transcript1)
+        self.proband_variant.select_transcript(selected_transcript=self.transcript2)
+        proband_variant = ProbandVariant.objects.get(id=self.proband_variant.id)
+        self.assertEquals(proband_variant.get_transcript(), self.transcript2)
+        self.assertEquals(proband_variant.get_transcript_variant(), self.tv2)
+
+    def test_update_selected_transcripts_batched(self):
+        """
+        Tests the selected transcripts of many ProbandVariants are updated
+        with the same number of queries as for one
+        """
+        proband_variants = []
+        for i in range(6):
+            variant = VariantFactory()
+            transcript = TranscriptFactory(gene=self.gene)
+            proband_variant = ProbandVariantFactory(interpretation_report=self.gel_ir,
+                                                    variant=variant)
+            # the last ProbandVariant has no selected transcript
+            ProbandTranscriptVariantFactory(proband_variant=proband_variant,
+                                            transcript=transcript,
+                                            selected=i < 5)
+            TranscriptVariantFactory(transcript=transcript, variant=variant)
+            proband_variants.append(proband_variant)
+
+        with CaptureQueriesContext(connection) as queries:
+            ProbandVariant.update_selected_transcripts(proband_variants[:1])
+        with CaptureQueriesContext(connection) as many_queries:
+            ProbandVariant.update_selected_transcripts(proband_variants)
+        self.assertEquals(len(many_queries), len(queries))
+
+        for proband_variant in proband_variants:
+            saved = ProbandVariant.objects.get(id=proband_variant.id)
+            self.assertEquals(saved.selected_ptv_id, proband_variant.selected_ptv_id)
+            self.assertEquals(saved.selected_transcript_variant_id,
+                              proband_variant.selected_transcript_variant_id)
+        self.assertIsNotNone(proband_variants[0].selected_transcript_variant_id)
+        self.assertIsNone(proband_variants[-1].selected_ptv_id)
+
     def test_variant_view(self):
         """
         Tests whether the variant page can be accessed
@@ -188,6 +339,39 @@ class ViewTests(TestCase):
         self.assertEqual(proband.comment, 'testcomment')
         self.assertEqual(gelir.pilot_case, True)
 
+    def test_update_sample_refreshes_case_summary(self):
+        """
+        Checks that editing a case updates its row in the case list summary
+        """
+        self.client.post(reverse('update-proband', args=[self.gel_ir.id]),
+                         {'outcome': 'testoutcome',
+                          'comment': 'testcomment',
+                          'case_status': 'M',
+                          'pilot_case': True,
+                          'mdt_status': 'R',
+                          'case_sent': False,
+                          'no_primary_findings': False})
+        summary = CaseSummary.objects.get(interpretation_report=self.gel_ir)
+        self.assertEqual(summary.case_status, 'M')
+        self.assertEqual(summary.pilot_case, True)
+        self.assertEqual(summary.gel_id, self.proband.gel_id)
+
+    def test_edit_demographics_refreshes_other_versions(self):
+        """
+        Checks that editing the shared proband through one report version also
+        updates the case list summary of the family's other versions
+        """
+        ir_family = InterpretationReportFamilyFactory(participant_family=self.family)
+        second_ir = GELInterpretationReportFactory(ir_family=ir_family)
+        CaseSummary.refresh([second_ir])
+        self.client.post(reverse('proband-view', args=[self.gel_ir.id]),
+                         {'forename': self.proband.forename,
+                          'surname': 'Editedsurname',
+                          'date_of_birth': '2000-01-01',
+                          'gmc': 'Unknown'})
+        summary = CaseSummary.objects.get(interpretation_report=second_ir)
+        self.assertEqual(summary.surname, 'Editedsurname')
+
     def test_select_transcript(self):
         """
         View for selecting transcript for variant
@@ -272,6 +456,36 @@ class ViewTests(TestCase):
         self.assertContains(response, 'MDT Updated')
         self.assertEquals(response.status_code, 200)
 
+    def test_mdt_view_query_count(self):
+        """
+        Tests the MDT page tier counts are correct and the number of queries
+        does not grow with the number of cases in the MDT
+        """
+        self.client.post(reverse('add-ir-to-mdt', args=[self.mdt.id, self.gel_ir.id]))
+        ProbandVariantFactory(interpretation_report=self.gel_ir, max_tier=3)
+        mdt_loader = MDTPageLoader(self.mdt.id)
+        self.assertEquals(
+            mdt_loader.proband_variant_count[self.gel_ir.id],
+            ProbandVariant.objects.filter(interpretation_report=self.gel_ir, max_tier__lte=2).count())
+        self.assertEquals(
+            mdt_loader.t3_proband_variant_count[self.gel_ir.id],
+            ProbandVariant.objects.filter(interpretation_report=self.gel_ir, max_tier=3).count())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('mdt-view', args=[self.mdt.id]))
+        query_count = len(queries)
+        for i in range(3):
+            family = FamilyFactory()
+            ProbandFactory(family=family)
+            ir_family = InterpretationReportFamilyFactory(participant_family=family)
+            report = GELInterpretationReportFactory(ir_family=ir_family)
+            ProbandVariantFactory(interpretation_report=report)
+            MDTReport.objects.create(MDT=self.mdt, interpretation_report=report)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('mdt-view', args=[self.mdt.id]))
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(len(queries), query_count)
+
     def test_mdt_proband_view(self):
         """
         See MDT proband view
@@ -308,6 +522,22 @@ class ViewTests(TestCase):
         response = self.client.get(reverse('recent-mdt', args=[self.sample_type]))
         self.assertEquals(response.status_code, 200)
 
+    def test_recent_mdts_date_filter(self):
+        """
+        Recent MDTs can be filtered by date
+        """
+        mdt = MDTFactory(sample_type=self.sample_type)
+        mdt.refresh_from_db()
+        mdt_date = mdt.date_of_mdt.date()
+        response = self.client.get(reverse('recent-mdt', args=[self.sample_type]),
+                                   {'date_from': mdt_date.isoformat(),
+                                    'date_to': mdt_date.isoformat()})
+        self.assertEquals(response.status_code, 200)
+        self.assertIn(mdt, response.context['recent_mdt'])
+        response = self.client.get(reverse('recent-mdt', args=[self.sample_type]),
+                                   {'date_from': (mdt_date + datetime.timedelta(days=1)).isoformat()})
+        self.assertNotIn(mdt, response.context['recent_mdt'])
+
     def test_select_attendees_for_mdt(self):
         """
         Can select and show existing attendees
@@ -343,6 +573,52 @@ class ViewTests(TestCase):
         self.assertContains(response, 'Attendee Added')
         self.assertEquals(response.status_code, 200)
 
+    def test_audit(self):
+        """
+        Audit page is drawn from the case status snapshots
+        """
+        response = self.client.get(reverse('audit', args=[self.sample_type]))
+        self.assertEquals(response.status_code, 200)
+        snapshot = CaseStatusSnapshot.objects.get(sample_type=self.sample_type,
+                                                  pilot_case=self.gel_ir.pilot_case,
+                                                  case_status=self.gel_ir.case_status)
+        self.assertEquals(snapshot.count, 1)
+        self.assertContains(response, 'Status Count Over Time')
+
+    def test_render_without_subprocess(self):
+        """
+        Build info in the page footer is resolved once, not on every render
+        """
+        get_build_info()
+        with mock.patch.object(subprocess, 'Popen', side_effect=AssertionError('subprocess spawned')):
+            response = self.client.get(reverse('rare-disease-main'))
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, get_build_info()['version'])
+
+    @override_settings(INTERNAL_IPS=['127.0.0.1'])
+    def test_metrics(self):
+        """
+        Requests are timed per view and reported at /metrics
+        """
+        self.client.get(reverse('proband-view', args=[self.gel_ir.id]))
+        response = self.client.get(reverse('metrics'))
+        self.assertEquals(response.status_code, 200)
+        self.assertContains(response, 'gel2mdt_request_seconds{view="proband-view",quantile="0.9"}')
+
+    @override_settings(PERFORMANCE_DUPLICATE_QUERY_THRESHOLD=5)
+    def test_duplicate_queries_logged(self):
+        """
+        Requests which run the same query once per row are logged
+        """
+        def view(request):
+            for gene in Gene.objects.all()[:1]:
+                for i in range(5):
+                    Transcript.objects.filter(gene=gene).count()
+            return HttpResponse()
+        with self.assertLogs('gel2mdt.performance', 'WARNING') as logs:
+            PerformanceMiddleware(view)(RequestFactory().get('/'))
+        self.assertIn('"count": 5', logs.output[0])
+
     def test_export_mdt(self):
         """
         Testing the mdt exporting function
@@ -351,10 +627,12 @@ class ViewTests(TestCase):
                                  args=[self.mdt.id, self.gel_ir.id]),
                          follow=True)
         response = self.client.post(reverse('export-mdt', args=[self.mdt.id]), follow=True)
-        self.assertContains(response, self.ir_family.ir_family_id)
-        self.assertContains(response, self.proband.surname)
-        self.assertContains(response, self.transcript1.gene)
         self.assertEquals(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(self.ir_family.ir_family_id, content)
+        self.assertIn(self.proband.surname, content)
+        self.assertIn(str(self.transcript1.gene), content)
 
     def test_export_mdt_outcome_form(self):
         """
@@ -19,11 +19,232 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
+import io
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
 from django.test import TestCase
 from ..vep_utils import run_vep_batch
+from ..vep_utils.remote import GzipCompressor, GunzipWriter, RemoteVepError, RemoteVepRunner, \
+    run_remote_command
+from ..vep_utils import worker
+from ..vep_utils import annotators
+from ..config import load_config
+
+# stands in for VEP: reads one line ahead like VEP's parser and adds a CSQ
+FAKE_VEP = """
+import sys
+header_written = False
+pending = None
+for line in sys.stdin:
+    if pending is not None:
+        if not header_written:
+            print('##INFO=<ID=CSQ,Number=.,Type=String,Description="Format: Allele|Feature">')
+            print('#CHROM\\tPOS\\tID\\tREF\\tALT')
+            header_written = True
+        print(pending.rstrip('\\n') + '\\tCSQ=G|ENST00000001')
+    pending = line
+"""
 # from ..database_utils import multiple_case_adder
 # from ..models import *
 #
 # Family.objects.filter(gel_family_id=100).delete()
 # multiple_case_adder.MultipleCaseAdder(test_data=True)
+
+
+class LocalChannel(object):
+    """
+    Stands in for a paramiko channel, running the command in a local shell.
+    """
+    def exec_command(self, cmd):
+        self.process = subprocess.Popen(['/bin/sh', '-c', cmd], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stderr = b''
+
+    def sendall(self, data):
+        self.process.stdin.write(data)
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv(self, size):
+        data = self.process.stdout.read1(size)
+        if not data:
+            self.stderr = self.process.stderr.read()
+        return data
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr)
+
+    def recv_stderr(self, size):
+        data, self.stderr = self.stderr[:size], self.stderr[size:]
+        return data
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+    def close(self):
+        self.process.stdout.close()
+        self.process.stderr.close()
+
+
+class LocalClient(object):
+    """
+    Stands in for a connected paramiko SSHClient.
+    """
+    def get_transport(self):
+        return self
+
+    def open_session(self):
+        return LocalChannel()
+
+
+class TestRemoteVep(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.remote_directory = os.path.join(self.directory, 'remote')
+        os.mkdir(self.remote_directory)
+        self.config_dict = load_config.Config({'remote_ip': 'localhost', 'remote_directory': self.remote_directory})
+        self.vcf = os.path.join(self.directory, 'input.vcf')
+        with open(self.vcf, 'w') as vcf_file:
+            vcf_file.write('1\t100\t5:1\tA\tG\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_vep(self, vep_command):
+        # one command, as the VEP command line is
+        runner = RemoteVepRunner(self.config_dict, lambda config_dict, assembly, infile, outfile: 'sh -c {}'.format(
+            shlex.quote(vep_command.format(infile=shlex.quote(infile), outfile=shlex.quote(outfile)))))
+        runner.client = LocalClient
+        return runner.run({'hg19_vep': ('GRCh37', self.vcf)})
+
+    def test_run_remote_command(self):
+        stdout = io.BytesIO()
+        run_remote_command(LocalClient(), 'cat', stdin_file=io.BytesIO(b'variants'), stdout_file=stdout)
+        assert stdout.getvalue() == b'variants'
+        with self.assertRaisesRegex(RemoteVepError, 'status 3: failed'):
+            run_remote_command(LocalClient(), 'echo failed >&2; exit 3')
+
+    def test_runner_streams_vcfs_and_cleans_up(self):
+        # VEP prints status messages to stdout, which must not reach the
+        # gzipped output
+        annotated = self.run_vep('echo Starting VEP && cp {infile} {outfile}')
+        with open(annotated['hg19_vep']) as annotated_file:
+            assert annotated_file.read() == '1\t100\t5:1\tA\tG\n'
+        os.remove(annotated['hg19_vep'])
+        assert os.listdir(self.remote_directory) == []
+
+    def test_runner_error_includes_vep_log(self):
+        with self.assertRaisesRegex(RemoteVepError, 'Cache not found'):
+            self.run_vep('echo Cache not found; exit 2')
+        assert os.listdir(self.remote_directory) == []
+
+    def test_gzip_streams_round_trip(self):
+        vcf = b''.join(b'1\t%d\t100:%d\tA\tG\n' % (position, position) for position in range(5000))
+        compressed = io.BytesIO()
+        source = GzipCompressor(io.BytesIO(vcf))
+        for chunk in iter(lambda: source.read(1024), b''):
+            compressed.write(chunk)
+        assert len(compressed.getvalue()) < len(vcf)
+
+        output = io.BytesIO()
+        writer = GunzipWriter(output)
+        data = compressed.getvalue()
+        for start in range(0, len(data), 1000):
+            writer.write(data[start:start + 1000])
+        writer.flush()
+        assert output.getvalue() == vcf
+
+
+class TestVepWorker(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        fake_vep = os.path.join(self.directory, 'fake_vep.py')
+        with open(fake_vep, 'w') as fake_vep_file:
+            fake_vep_file.write(FAKE_VEP)
+        self.config_dict = load_config.Config({
+            'vep': '{} {}'.format(sys.executable, fake_vep), 'cache': self.directory, 'cache_version': '91',
+            'hg19_fasta_loc': 'hg19.fa', 'hg38_fasta_loc': 'hg38.fa', 'mergedVEP': 'False',
+            'vep_worker_address': os.path.join(self.directory, 'vep_worker.sock')})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_process_stays_warm(self):
+        process = worker.VepProcess(self.config_dict, 'GRCh37', timeout=10)
+        try:
+            first = process.annotate(['1\t100\t5:1\tA\tG'])
+            pid = process.process.pid
+            second = process.annotate(['1\t200\t5:2\tA\tG', '2\t300\t5:3\tC\tT'])
+        finally:
+            process.stop()
+        assert first.splitlines()[-1].startswith('1\t100\t5:1')
+        assert [line.split('\t')[2] for line in second.splitlines() if not line.startswith('#')] == ['5:2', '5:3']
+        assert '#CHROM' in second
+        assert process.requests == 2 and pid
+
+    def test_annotate_with_worker(self):
+        server = worker.create_server(self.config_dict['vep_worker_address'], self.config_dict, timeout=10)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        vcf = os.path.join(self.directory, 'hg19.vcf')
+        with open(vcf, 'w') as vcf_file:
+            vcf_file.write('1\t100\t7:1\tA\tG\n')
+        empty = os.path.join(self.directory, 'hg38.vcf')
+        open(empty, 'w').close()
+        try:
+            annotated = worker.annotate_with_worker({'hg19_vcf': vcf, 'hg38_vcf': empty}, self.config_dict)
+        finally:
+            server.shutdown()
+            server.stop_processes()
+            server.server_close()
+        assert list(annotated) == ['hg19_vep']
+        with open(annotated['hg19_vep']) as annotated_file:
+            assert annotated_file.read().splitlines()[-1] == '1\t100\t7:1\tA\tG\tCSQ=G|ENST00000001'
+        os.remove(annotated['hg19_vep'])
+
+    def test_small_requests_use_worker(self):
+        assert run_vep_batch.use_vep_worker([None], self.config_dict)
+        assert not run_vep_batch.use_vep_worker([None] * 51, self.config_dict)
+
+
+class TestAnnotators(unittest.TestCase):
+    def setUp(self):
+        self.variants = [run_vep_batch.CaseVariant('1', 1000 + count * 70000, '12', str(count), 'A', 'G', 'GRCh37')
+                         for count in range(20)]
+
+    def test_annotator_from_config(self):
+        config = {'bypass_VEP': 'False', 'remoteVEP': 'True'}
+        assert isinstance(annotators.get_annotator(load_config.Config(config)), annotators.RemoteVepAnnotator)
+        config['bypass_VEP'] = 'True'
+        assert isinstance(annotators.get_annotator(load_config.Config(config)), annotators.BypassAnnotator)
+        config['annotator'] = 'synthetic'
+        assert isinstance(annotators.get_annotator(load_config.Config(config)), annotators.SyntheticAnnotator)
+        config['annotator'] = 'nonsense'
+        with self.assertRaises(ValueError):
+            annotators.get_annotator(load_config.Config(config))
+
+    def test_synthetic_annotations_are_deterministic(self):
+        first = annotators.SyntheticAnnotator(load_config.Config({})).annotate(self.variants)
+        second = annotators.SyntheticAnnotator(load_config.Config({})).annotate(self.variants)
+        assert [vars(transcript) for transcript in first] == [vars(transcript) for transcript in second]
+        assert {transcript.variant_count for transcript in first} == {str(count) for count in range(20)}
+        for transcript in first:
+            assert transcript.transcript_name.startswith('ENST')
+            assert transcript.transcript_variant_hgvs_c.startswith(transcript.transcript_name + ':c.')
+            assert bool(transcript.variant_polyphen) == (
+                transcript.proband_transcript_variant_effect == 'missense_variant')
+        # one canonical transcript per variant
+        assert sum(transcript.transcript_canonical == 'YES' for transcript in first) == 20
+
+    def test_synthetic_annotator_uses_gene_locations(self):
+        genes = [annotators.SyntheticGeneLocation('SYN1', 'ENSG90000000001', '900001', '1', 500, 50500)]
+        transcripts = annotators.SyntheticAnnotator(load_config.Config({}), genes=genes).annotate(self.variants[:2])
+        assert {transcript.gene_hgnc_name for transcript in transcripts if transcript.variant_count == '0'} == {'SYN1'}
+        assert 'SYN1' not in {transcript.gene_hgnc_name for transcript in transcripts
+                              if transcript.variant_count == '1'}
@@ -68,6 +68,9 @@ urlpatterns = [
     path('delete_mdt/<int:mdt_id>', views.delete_mdt, name='delete-mdt'),
     path('export_mdt/<int:mdt_id>', views.export_mdt, name='export-mdt'),
     path('export_mdt_outcome_form/<int:report_id>', views.export_mdt_outcome_form, name='export-mdt-outcome'),
+    path('export_mdt_outcome_forms/<int:mdt_id>', views.export_mdt_outcome_forms, name='export-mdt-outcomes'),
+    path('download_mdt_outcome_forms/<int:export_id>', views.download_mdt_outcome_forms,
+         name='download-mdt-outcomes'),
 
     path('select_attendees_for_mdt/<int:mdt_id>', views.select_attendees_for_mdt, name='select-attendees-for-mdt'),
     path('add_attendee_to_mdt/<int:mdt_id>/<int:attendee_id>/<str:role>', views.add_attendee_to_mdt,
@@ -78,6 +81,7 @@ urlpatterns = [
 
     path(r'genomics_england_report/<int:report_id>', views.genomics_england_report, name='genomics-england-report'),
     path('<str:sample_type>/audit/', views.audit, name='audit'),
+    path('metrics', views.metrics, name='metrics'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_DIR)
 
 urlpatterns += api_urlpatterns
@@ -0,0 +1,309 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import bisect
+import random
+from collections import defaultdict
+
+from ..config import load_config
+from ..database_utils import ingest_timing
+from . import run_vep_batch
+from .run_vep_batch import CaseTranscript
+
+# (consequence, weight) of each transcript a SyntheticAnnotator annotates,
+# roughly as often as VEP reports them for tiered variants
+SYNTHETIC_CONSEQUENCES = (
+    ('missense_variant', 30),
+    ('synonymous_variant', 15),
+    ('intron_variant', 20),
+    ('splice_region_variant&intron_variant', 5),
+    ('stop_gained', 5),
+    ('frameshift_variant', 5),
+    ('3_prime_UTR_variant', 10),
+    ('upstream_gene_variant', 10),
+)
+AMINO_ACIDS = ('Ala', 'Arg', 'Asn', 'Asp', 'Cys', 'Gln', 'Glu', 'Gly', 'His', 'Ile',
+               'Leu', 'Lys', 'Met', 'Phe', 'Pro', 'Ser', 'Thr', 'Trp', 'Tyr', 'Val')
+# size of the made up genes used for variants outside any known gene
+BLOCK_SIZE = 50000
+# numbered in the IDs of made up genes
+CHROMOSOMES = [str(number) for number in range(1, 23)] + ['X', 'Y', 'MT']
+
+
+class Annotator(object):
+    """
+    Turns CaseVariants into the CaseTranscripts (genes, transcripts and
+    consequences) which the MultipleCaseAdder and VariantAdder store.
+    Subclasses implement annotate(); get_annotator() picks one from
+    config.txt.
+
+    Attributes:
+        config_dict (Config): options from config.txt.
+    """
+    name = None
+
+    def __init__(self, config_dict):
+        self.config_dict = config_dict
+
+    def annotate(self, variant_list):
+        """
+        :param variant_list: list of CaseVariant objects
+        :return: list of CaseTranscript objects for the variants
+        """
+        raise NotImplementedError
+
+
+class VepAnnotator(Annotator):
+    """
+    Annotates with Ensembl VEP: small requests go to the VEP worker if one
+    is configured, everything else to a batch run from run_vep().
+    """
+    def run(self, variant_vcf_dict):
+        """
+        :return: dict of annotated VCFs for each build, from a batch run
+        """
+        raise NotImplementedError
+
+    def annotate(self, variant_list):
+        print("Running VEP")
+        with ingest_timing.span('vep_generate'):
+            variant_vcf_dict = run_vep_batch.generate_vcf(variant_list)
+        with ingest_timing.span('vep_run'):
+            annotated_files_dict = None
+            if run_vep_batch.use_vep_worker(variant_list, self.config_dict):
+                annotated_files_dict = run_vep_batch.run_vep_with_worker(variant_vcf_dict, self.config_dict)
+            if annotated_files_dict is None:
+                annotated_files_dict = self.run(variant_vcf_dict)
+        with ingest_timing.span('vep_parse'):
+            return run_vep_batch.parse_vep_annotations(annotated_files_dict)
+
+
+class LocalVepAnnotator(VepAnnotator):
+    """
+    Runs VEP on this machine.
+    """
+    name = 'local_vep'
+
+    def run(self, variant_vcf_dict):
+        return run_vep_batch.run_vep(variant_vcf_dict, self.config_dict)
+
+
+class RemoteVepAnnotator(VepAnnotator):
+    """
+    Runs VEP on remote_ip over SSH.
+    """
+    name = 'remote_vep'
+
+    def run(self, variant_vcf_dict):
+        return run_vep_batch.run_vep_remotely(variant_vcf_dict, self.config_dict)
+
+
+class BypassAnnotator(Annotator):
+    """
+    Does not annotate, so cases are added without transcripts.
+    """
+    name = 'bypass'
+
+    def annotate(self, variant_list):
+        print("Bypassing VEP")
+        with ingest_timing.span('vep_parse'):
+            return run_vep_batch.parse_vep_annotations()
+
+
+class SyntheticGeneLocation(object):
+    """
+    A gene the SyntheticAnnotator can place variants in, with transcripts
+    and a strand derived from its ID so they are the same for every variant
+    in it.
+
+    Attributes:
+        symbol (str): HGNC symbol.
+        ensembl_id (str): Ensembl gene ID.
+        hgnc_id (str): HGNC ID, without the HGNC: prefix.
+        chromosome (str): chromosome, without chr.
+        start (int): first position of the gene.
+        end (int): last position of the gene.
+        transcripts (list): Ensembl transcript IDs, canonical first.
+        strand (str): 1 or -1, as given by VEP.
+    """
+    def __init__(self, symbol, ensembl_id, hgnc_id, chromosome, start, end):
+        self.symbol = symbol
+        self.ensembl_id = ensembl_id
+        self.hgnc_id = str(hgnc_id)
+        self.chromosome = str(chromosome)
+        self.start = int(start)
+        self.end = int(end)
+        gene_random = random.Random(ensembl_id)
+        self.transcripts = ['ENST{}{}'.format(ensembl_id[4:], number)
+                            for number in range(1, gene_random.randint(1, 4) + 1)]
+        self.strand = gene_random.choice(('1', '-1'))
+
+
+class SyntheticAnnotator(Annotator):
+    """
+    Makes up plausible annotations without VEP, so tests and ingest
+    benchmarks can run the whole transcript pipeline quickly anywhere. The
+    same variant always gets the same genes, transcripts and consequences.
+
+    Variants fall in the genes listed in the tab separated file set by
+    synthetic_annotator_genes in config.txt (symbol, Ensembl ID, HGNC ID,
+    chromosome, start, end; generate_cohort writes one), or otherwise in
+    made up genes covering each 50kb of the genome.
+
+    Attributes:
+        seed (str): mixed into every variant's random choices.
+        genes (defaultdict): chromosome to SyntheticGeneLocations sorted by
+            start.
+        starts (dict): chromosome to the start of each of its genes, for
+            bisecting.
+        block_genes (dict): made up genes created so far, by chromosome and
+            block.
+    """
+    name = 'synthetic'
+
+    def __init__(self, config_dict, genes=None, seed='0'):
+        super().__init__(config_dict)
+        self.seed = str(seed)
+        if genes is None and config_dict.get('synthetic_annotator_genes'):
+            genes = read_gene_locations(config_dict['synthetic_annotator_genes'])
+        self.genes = defaultdict(list)
+        for gene in genes or []:
+            self.genes[gene.chromosome].append(gene)
+        self.starts = {}
+        for chromosome, chromosome_genes in self.genes.items():
+            chromosome_genes.sort(key=lambda gene: gene.start)
+            self.starts[chromosome] = [gene.start for gene in chromosome_genes]
+        self.block_genes = {}
+
+    def gene_at(self, chromosome, position):
+        """
+        :return: the SyntheticGeneLocation covering a position
+        """
+        chromosome = str(chromosome).replace('chr', '')
+        chromosome_genes = self.genes.get(chromosome)
+        if chromosome_genes:
+            index = bisect.bisect_right(self.starts[chromosome], position) - 1
+            if index >= 0 and chromosome_genes[index].end >= position:
+                return chromosome_genes[index]
+
+        block = position // BLOCK_SIZE
+        if (chromosome, block) not in self.block_genes:
+            chromosome_number = CHROMOSOMES.index(chromosome) + 1 if chromosome in CHROMOSOMES else 99
+            self.block_genes[(chromosome, block)] = SyntheticGeneLocation(
+                'SYN{}_{}'.format(chromosome, block),
+                'ENSG8{:02d}{:08d}'.format(chromosome_number, block),
+                '8{:02d}{:05d}'.format(chromosome_number, block),
+                chromosome, block * BLOCK_SIZE, (block + 1) * BLOCK_SIZE - 1)
+        return self.block_genes[(chromosome, block)]
+
+    def annotate(self, variant_list):
+        with ingest_timing.span('annotate'):
+            transcripts = []
+            for variant in variant_list:
+                transcripts += self.annotate_variant(variant)
+            return transcripts
+
+    def annotate_variant(self, variant):
+        """
+        :return: a CaseTranscript for each transcript of the gene the
+            variant is in
+        """
+        gene = self.gene_at(variant.chromosome, int(variant.position))
+        variant_random = random.Random('{}:{}:{}:{}:{}:{}'.format(
+            self.seed, variant.genome_build, variant.chromosome, variant.position, variant.ref, variant.alt))
+        consequences, weights = zip(*SYNTHETIC_CONSEQUENCES)
+        max_af = '' if variant_random.random() < 0.6 else '{:.5f}'.format(variant_random.random() ** 4 / 10)
+        coding_position = variant_random.randint(1, 6000)
+        if len(variant.ref) == 1 and len(variant.alt) == 1:
+            change = '{}>{}'.format(variant.ref, variant.alt)
+        else:
+            change = 'delins{}'.format(variant.alt)
+
+        case_transcripts = []
+        for number, transcript_name in enumerate(gene.transcripts):
+            consequence = variant_random.choices(consequences, weights)[0]
+            polyphen = sift = hgvs_p = ''
+            protein = 'ENSP{}{}'.format(gene.ensembl_id[4:], number + 1)
+            codon = (coding_position + 2) // 3
+            if consequence == 'missense_variant':
+                polyphen_score = variant_random.random()
+                polyphen = '{}({:.3f})'.format(
+                    'probably_damaging' if polyphen_score > 0.85 else 'possibly_damaging'
+                    if polyphen_score > 0.45 else 'benign', polyphen_score)
+                sift_score = variant_random.random()
+                sift = '{}({:.2f})'.format('deleterious' if sift_score < 0.05 else 'tolerated', sift_score)
+                hgvs_p = '{}:p.{}{}{}'.format(protein, variant_random.choice(AMINO_ACIDS), codon,
+                                              variant_random.choice(AMINO_ACIDS))
+            elif consequence == 'stop_gained':
+                hgvs_p = '{}:p.{}{}Ter'.format(protein, variant_random.choice(AMINO_ACIDS), codon)
+            elif consequence == 'synonymous_variant':
+                hgvs_p = '{}:p.{}{}='.format(protein, variant_random.choice(AMINO_ACIDS), codon)
+            elif consequence == 'frameshift_variant':
+                hgvs_p = '{}:p.{}{}fs'.format(protein, variant_random.choice(AMINO_ACIDS), codon)
+
+            case_transcripts.append(CaseTranscript(
+                str(variant.case_id), str(variant.variant_count), gene.ensembl_id, gene.symbol, gene.hgnc_id,
+                transcript_name, 'YES' if number == 0 else False, gene.strand, consequence, max_af,
+                polyphen, sift,
+                '{}:c.{}{}'.format(transcript_name, coding_position, change),
+                hgvs_p,
+                '{}:g.{}{}'.format(variant.chromosome, variant.position, change)))
+        return case_transcripts
+
+
+def read_gene_locations(path):
+    """
+    :param path: tab separated file of symbol, Ensembl ID, HGNC ID,
+        chromosome, start and end
+    :return: list of SyntheticGeneLocations
+    """
+    genes = []
+    with open(path) as gene_file:
+        for line in gene_file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) == 6 and not line.startswith('#'):
+                genes.append(SyntheticGeneLocation(*fields))
+    return genes
+
+
+ANNOTATORS = {annotator.name: annotator for annotator in (
+    LocalVepAnnotator, RemoteVepAnnotator, BypassAnnotator, SyntheticAnnotator)}
+
+
+def get_annotator(config_dict=None):
+    """
+    :return: the Annotator named by annotator in config.txt, or if that is
+        not set, bypass if bypass_VEP is True, else remote_vep or local_vep
+        depending on remoteVEP
+    """
+    config_dict = config_dict or load_config.get_config()
+    name = config_dict.get('annotator')
+    if not name:
+        if config_dict.bypass_VEP:
+            name = 'bypass'
+        elif config_dict.remoteVEP:
+            name = 'remote_vep'
+        else:
+            name = 'local_vep'
+    if name not in ANNOTATORS:
+        raise ValueError('annotator in config.txt must be one of {}, not "{}"'.format(
+            ', '.join(sorted(ANNOTATORS)), name))
+    return ANNOTATORS[name](config_dict)
@@ -19,7 +19,6 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
-from pysam import VariantFile
 
 class ParseVep:
     """
@@ -79,6 +78,7 @@ class ParseVep:
         :param file: A VCF file that as been annotated with VEP
         :return: A list of dictionaries containing information about all the variants
         """
+        from pysam import VariantFile
         vep_vcf = VariantFile(file)
         try:
             csq_fields = str(vep_vcf.header.info['CSQ'].record)
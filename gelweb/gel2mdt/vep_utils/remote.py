@@ -0,0 +1,237 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import logging
+import shlex
+import tempfile
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# seconds between keepalive packets on pooled connections, so idle
+# connections are not dropped by firewalls between ingests
+KEEPALIVE_SECONDS = 30
+# size of each read from, and write to, the exec channel
+CHUNK_SIZE = 64 * 1024
+
+
+class RemoteVepError(RuntimeError):
+    """
+    VEP, or the shell around it, failed on the remote host.
+    """
+
+
+class SSHConnectionPool(object):
+    """
+    Keeps one SSH connection open to each remote host and user, so that
+    every VEP run in the process reuses it instead of logging in again.
+    Each command runs in its own channel of the connection, so several can
+    run at the same time.
+
+    Attributes:
+        clients (dict): (host, username) to a connected paramiko SSHClient.
+    """
+    def __init__(self):
+        self.clients = {}
+        self.lock = threading.Lock()
+
+    def client(self, host, username, password):
+        """
+        :return: a connected SSHClient for host and username, reconnecting
+            if the pooled connection has dropped
+        """
+        import paramiko
+        key = (host, username)
+        with self.lock:
+            client = self.clients.get(key)
+            transport = client.get_transport() if client is not None else None
+            if transport is None or not transport.is_active():
+                if client is not None:
+                    logger.info('Reconnecting to %s', host)
+                    client.close()
+                client = paramiko.SSHClient()
+                client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+                client.connect(host, username=username, password=password)
+                client.get_transport().set_keepalive(KEEPALIVE_SECONDS)
+                self.clients[key] = client
+            return client
+
+    def close_all(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
+
+
+ssh_pool = SSHConnectionPool()
+
+
+def run_remote_command(client, cmd, stdin_file=None, stdout_file=None):
+    """
+    Runs a shell command over SSH, streaming a local file to its stdin and
+    its stdout to a local file as the data arrives.
+    :param client: connected paramiko SSHClient
+    :param cmd: shell command to run
+    :param stdin_file: binary file object to send as stdin, or None
+    :param stdout_file: binary file object to write stdout to, or None to
+        return stdout
+    :return: stdout as bytes if stdout_file is None
+    """
+    channel = client.get_transport().open_session()
+    try:
+        channel.exec_command(cmd)
+        if stdin_file is not None:
+            for chunk in iter(lambda: stdin_file.read(CHUNK_SIZE), b''):
+                channel.sendall(chunk)
+        channel.shutdown_write()
+
+        output = []
+        for chunk in iter(lambda: channel.recv(CHUNK_SIZE), b''):
+            if stdout_file is not None:
+                stdout_file.write(chunk)
+            else:
+                output.append(chunk)
+        stderr = b''
+        while channel.recv_stderr_ready():
+            stderr += channel.recv_stderr(CHUNK_SIZE)
+        exit_status = channel.recv_exit_status()
+    finally:
+        channel.close()
+    if exit_status != 0:
+        raise RemoteVepError('{} exited with status {}: {}'.format(
+            cmd.split()[0], exit_status, stderr.decode('utf-8', 'replace')[-2000:]))
+    return b''.join(output)
+
+
+class GzipCompressor(object):
+    """
+    Readable binary file giving the gzip compression of another, so it can
+    be streamed without writing the compressed copy to disk.
+    """
+    def __init__(self, source):
+        self.source = source
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self.finished = False
+
+    def read(self, size):
+        while not self.finished:
+            chunk = self.source.read(size)
+            if chunk:
+                compressed = self.compressor.compress(chunk)
+            else:
+                compressed = self.compressor.flush()
+                self.finished = True
+            if compressed:
+                return compressed
+        return b''
+
+
+class GunzipWriter(object):
+    """
+    Writable binary file which decompresses gzip data into another.
+    """
+    def __init__(self, target):
+        self.target = target
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        self.target.write(self.decompressor.decompress(data))
+
+    def flush(self):
+        self.target.write(self.decompressor.flush())
+
+
+class RemoteVepRunner(object):
+    """
+    Runs VEP on the host set by remote_ip in config.txt over a pooled SSH
+    connection. Each run works in its own directory made by mktemp under
+    remote_directory, so runs at the same time (e.g. a T3 pull during the
+    nightly update) cannot overwrite each other's files. VCFs are gzipped
+    and streamed to the remote shell's stdin and the annotated VCFs streamed
+    back gzipped through stdout, with both genome builds annotated at once.
+
+    Attributes:
+        config_dict (Config): options from config.txt.
+        command_builder (function): takes the config, assembly, input and
+            output paths and returns the VEP command line.
+    """
+    def __init__(self, config_dict, command_builder):
+        self.config_dict = config_dict
+        self.command_builder = command_builder
+
+    def client(self):
+        return ssh_pool.client(self.config_dict['remote_ip'],
+                               self.config_dict['remote_username'],
+                               self.config_dict['remote_password'])
+
+    def run(self, builds):
+        """
+        :param builds: dict of result key (e.g. hg19_vep) to (assembly,
+            local VCF path)
+        :return: dict of result key to the local path of the annotated VCF
+        """
+        if not builds:
+            return {}
+        client = self.client()
+        remote_directory = self.config_dict['remote_directory'].rstrip('/') or '/tmp'
+        job_dir = run_remote_command(client, 'mktemp -d {}'.format(
+            shlex.quote(remote_directory + '/gel2mdt_vep.XXXXXXXX'))).decode('utf-8').strip()
+        logger.info('Running VEP in %s:%s', self.config_dict['remote_ip'], job_dir)
+        try:
+            with ThreadPoolExecutor(max_workers=len(builds)) as executor:
+                futures = {key: executor.submit(self.annotate, client, job_dir, assembly, vcf)
+                           for key, (assembly, vcf) in builds.items()}
+                return {key: future.result() for key, future in futures.items()}
+        finally:
+            try:
+                run_remote_command(client, 'rm -rf {}'.format(shlex.quote(job_dir)))
+            except Exception:
+                logger.warning('Could not remove %s from %s', job_dir, self.config_dict['remote_ip'],
+                               exc_info=True)
+
+    def annotate(self, client, job_dir, assembly, vcf):
+        """
+        Annotates one VCF in job_dir.
+        :return: local path of the annotated VCF
+        """
+        remote_in = '{}/{}_input.vcf'.format(job_dir, assembly)
+        remote_out = '{}/{}_output.vcf'.format(job_dir, assembly)
+        # VEP's status messages and warnings go to a log rather than the
+        # channel, so they cannot get mixed into the gzipped output
+        log = '{}/{}_vep.log'.format(job_dir, assembly)
+        cmd = 'cd {job_dir} && gzip -dc > {remote_in} && {vep} > {log} 2>&1 && gzip -c {remote_out}'.format(
+            job_dir=shlex.quote(job_dir),
+            remote_in=shlex.quote(remote_in),
+            vep=self.command_builder(self.config_dict, assembly, remote_in, remote_out),
+            log=shlex.quote(log),
+            remote_out=shlex.quote(remote_out))
+        outfile = tempfile.NamedTemporaryFile(suffix='.vcf', delete=False)
+        with outfile, open(vcf, 'rb') as infile:
+            writer = GunzipWriter(outfile)
+            try:
+                run_remote_command(client, cmd, stdin_file=GzipCompressor(infile), stdout_file=writer)
+            except RemoteVepError as e:
+                vep_log = run_remote_command(client, 'tail -c 2000 {} 2> /dev/null; true'.format(shlex.quote(log)))
+                raise RemoteVepError('{}\n{}'.format(e, vep_log.decode('utf-8', 'replace'))) from e
+            writer.flush()
+        return outfile.name
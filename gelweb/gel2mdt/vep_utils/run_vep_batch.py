@@ -20,12 +20,21 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 """
 import os
+import shlex
 import tempfile
 import subprocess
 import csv
 from ..config import load_config
+from ..database_utils import ingest_timing
 from . import parse_vep
-import paramiko
+from .remote import RemoteVepRunner
+from . import worker
+import logging
+
+logger = logging.getLogger(__name__)
+
+# config.txt option holding the reference FASTA of each assembly
+FASTA_OPTIONS = {'GRCh37': 'hg19_fasta_loc', 'GRCh38': 'hg38_fasta_loc'}
 
 class CaseVariant:
     def __init__(self, chromosome, position, case_id, variant_count, ref, alt, genome_build):
@@ -88,6 +97,34 @@ def generate_vcf(variants):
     return variant_dict
 
 
+def vep_command(config_dict, assembly, infile, outfile, fork=4):
+    '''
+    Builds the VEP command line for one genome build from the locations in config.txt, for local and remote runs
+
+    :param config_dict: Configuration dict
+    :param assembly: GRCh37 or GRCh38
+    :param infile: VCF to annotate, or STDIN
+    :param outfile: Where VEP should write the annotated VCF, or STDOUT
+    :param fork: Number of VEP processes, or None for one
+    :return: Command line as a string
+    '''
+    cmd = "{vep} -i {infile} -o {outfile} --species homo_sapiens --force_overwrite --cache --dir_cache {cache} " \
+          "{fork}--vcf --flag_pick --exclude_predicted --assembly {assembly} --everything " \
+          "--hgvsg --dont_skip --total_length --offline --fasta {fasta_loc} --cache_version {cache_version}".format(
+            vep=config_dict['vep'],
+            infile=shlex.quote(infile),
+            outfile=shlex.quote(outfile),
+            cache=config_dict['cache'],
+            cache_version=config_dict['cache_version'],
+            assembly=assembly,
+            fork='--fork {} '.format(fork) if fork else '',
+            fasta_loc=config_dict[FASTA_OPTIONS[assembly]],
+    )
+    if config_dict.mergedVEP:
+        cmd += ' --merged'
+    return cmd
+
+
 def run_vep(infile, config_dict):
     '''
     Function which runs VEP using subprocess. Takes multiple options from config.txt file
@@ -103,37 +140,13 @@ def run_vep(infile, config_dict):
     # run VEP for hg19 variants
     annotated_variant_dict = {}
 
-
     if os.stat(hg19_vcf).st_size != 0: # if file not empty
-        # builds command from locations supplied in config file
-        cmd = "{vep} -i {infile} -o {outfile} --species homo_sapiens --force_overwrite --cache --dir_cache {cache} " \
-              "--fork 4 --vcf --flag_pick --exclude_predicted --assembly GRCh37 --everything " \
-              "--hgvsg --dont_skip --total_length --offline --fasta {fasta_loc} --cache_version {cache_version}".format(
-                vep=config_dict['vep'],
-                infile=hg19_vcf,
-                outfile=hg19_outfile.name,
-                cache=config_dict['cache'],
-                cache_version=config_dict['cache_version'],
-                fasta_loc=config_dict['hg19_fasta_loc'],
-        )
-        if config_dict["mergedVEP"] == 'True':
-            cmd += ' --merged'
+        cmd = vep_command(config_dict, 'GRCh37', hg19_vcf, hg19_outfile.name)
         subprocess.Popen(cmd, stderr=subprocess.STDOUT, shell=True).wait()
         annotated_variant_dict['hg19_vep'] = hg19_outfile.name
     # run VEP for hg38 variants
     if os.stat(hg38_vcf).st_size != 0:
-        cmd = "{vep} -i {infile} -o {outfile} --species homo_sapiens --force_overwrite --cache --dir_cache {cache}" \
-              " --fork 4 --vcf --flag_pick  --exclude_predicted --assembly GRCh38 --everything " \
-              "--hgvsg --dont_skip --total_length --offline --fasta {fasta_loc} --cache_version {cache_version}".format(
-                vep=config_dict['vep'],
-                infile=hg38_vcf,
-                outfile=hg38_outfile.name,
-                cache=config_dict['cache'],
-                cache_version=config_dict['cache_version'],
-                fasta_loc=config_dict['hg38_fasta_loc'],
-        )
-        if config_dict["mergedVEP"] == 'True':
-            cmd += ' --merged'
+        cmd = vep_command(config_dict, 'GRCh38', hg38_vcf, hg38_outfile.name)
         subprocess.Popen(cmd, stderr=subprocess.STDOUT, shell=True).wait()
         annotated_variant_dict['hg38_vep'] = hg38_outfile.name
     return annotated_variant_dict
@@ -141,83 +154,46 @@ def run_vep(infile, config_dict):
 
 def run_vep_remotely(infile, config_dict):
     '''
-    Function which runs VEP using paramiko on a remote machine.
+    Function which runs VEP on a remote machine over a pooled SSH connection. Each run gets its own remote working
+    directory, VCFs are streamed both ways gzipped, and the 2 genome builds are annotated at the same time
 
     :param infile: Dict containing VCFs for the 2 genome builds
     :param config_dict: Configuration dict
     :return: Dict which contains the locations of the 2 results files relating to the 2 genome builds
     '''
-    ssh = paramiko.SSHClient()
-    ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-    # builds command from locations supplied in config file
-    ssh.connect(config_dict['remote_ip'],
-                username=config_dict['remote_username'],
-                password=config_dict['remote_password'])
-    sftp = ssh.open_sftp()
-    # run VEP for hg19 variants
-    annotated_variant_dict = {}
+    builds = {}
+    for vcf_key, vep_key, assembly in (('hg19_vcf', 'hg19_vep', 'GRCh37'), ('hg38_vcf', 'hg38_vep', 'GRCh38')):
+        if vcf_key in infile and os.stat(infile[vcf_key]).st_size != 0:
+            builds[vep_key] = (assembly, infile[vcf_key])
+    return RemoteVepRunner(config_dict, vep_command).run(builds)
 
-    if not os.path.isdir('VEP'):
-        os.makedirs('VEP')
-
-    if 'hg19_vcf' in infile:
-        hg19_vcf = infile['hg19_vcf']
-        hg19_outfile = 'VEP/hg19_results.vcf'
-        if os.stat(hg19_vcf).st_size != 0:
-            sftp.put(hg19_vcf, '{remote_destination}/hg19_destination_file.txt'.format(
-                remote_destination=config_dict['remote_directory']
-            ))
-
-            cmd = "{vep} -i {remote_destination}/hg19_destination_file.txt " \
-                  " -o {remote_destination}/hg19_output.txt --species homo_sapiens "  \
-                  " --force_overwrite --cache --dir_cache {cache} --fork 4 --vcf --flag_pick --assembly GRCh37 " \
-                  " --exclude_predicted --everything --hgvsg --dont_skip --total_length --offline --fasta {fasta_loc} ".format(
-                    vep=config_dict['vep'],
-                    cache=config_dict['cache'],
-                    fasta_loc=config_dict['hg19_fasta_loc'],
-                    remote_destination=config_dict['remote_directory']
-
-            )
-            if config_dict["mergedVEP"] == 'True':
-                cmd += ' --merged'
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-
-            print('stdin:', stdin, 'stdout:', stdout.read(), 'stderr:', stderr.read())
-            sftp.get('{remote_destination}/hg19_output.txt'.format(
-                remote_destination=config_dict['remote_directory']), hg19_outfile
-            )
-            annotated_variant_dict['hg19_vep'] = hg19_outfile
-    # run VEP for hg38 variants
-    if 'hg38_vcf' in infile:
-        hg38_vcf = infile['hg38_vcf']
-        hg38_outfile = 'VEP/hg38_results.vcf'
-        if os.stat(hg38_vcf).st_size != 0:
-            sftp.put(hg38_vcf, '{remote_destination}/hg38_destination_file.txt'.format(
-                remote_destination=config_dict['remote_directory']
-            ))
-
-            cmd = "{vep} -i {remote_destination}/hg38_destination_file.txt " \
-                  " -o {remote_destination}/hg38_output.txt --species homo_sapiens "  \
-                  " --force_overwrite --cache --dir_cache {cache} --fork 4 --vcf --flag_pick --assembly GRCh38 " \
-                  " --exclude_predicted --everything --hgvsg --dont_skip --total_length --offline --fasta {fasta_loc} ".format(
-                    vep=config_dict['vep'],
-                    cache=config_dict['cache'],
-                    fasta_loc=config_dict['hg38_fasta_loc'],
-                    remote_destination=config_dict['remote_directory']
-            )
-            if config_dict["mergedVEP"] == 'True':
-                cmd += ' --merged'
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-
-            print('stdin:', stdin, 'stdout:', stdout.read(), 'stderr:', stderr.read())
-            sftp.get('{remote_destination}/hg38_output.txt'.format(remote_destination=config_dict['remote_directory']),
-                     hg38_outfile)
-            annotated_variant_dict['hg38_vep'] = hg38_outfile
-
-    sftp.close()
-    ssh.close()
-    return annotated_variant_dict
+
+def use_vep_worker(variant_list, config_dict):
+    '''
+    Small requests, such as a single variant added from the proband page, go to the VEP worker if one is configured
+    with vep_worker_address; large batches are quicker with a fresh, forked VEP
+
+    :param variant_list: A list of CaseVariant objects
+    :param config_dict: Configuration dict
+    :return: True if the variants should be annotated by the VEP worker
+    '''
+    return bool(config_dict.get('vep_worker_address')) and \
+        len(variant_list) <= config_dict.get('vep_worker_max_variants', 50)
+
+
+def run_vep_with_worker(infile, config_dict):
+    '''
+    Annotates VCFs with the long running VEP worker (see the run_vep_worker management command)
+
+    :param infile: Dict containing VCFs for the 2 genome builds
+    :param config_dict: Configuration dict
+    :return: Dict of results files like run_vep, or None if the worker could not be used
+    '''
+    try:
+        return worker.annotate_with_worker(infile, config_dict)
+    except (OSError, ValueError, worker.VepWorkerError) as e:
+        logger.warning('VEP worker unavailable, running VEP in batch: %s', e)
+        return None
 
 
 def parse_vep_annotations(infile=None):
@@ -274,26 +250,13 @@ def parse_vep_annotations(infile=None):
 
 def generate_transcripts(variant_list):
     '''
-    Wrapper function for running VEP for MCA. This take as input a variant_list which contains all the variants
-    for the cases which MCA will update/add. If bypass_VEP function is used from the config, this will read in
-    the temp.vep.vcf file for transcripts
+    Wrapper function for annotating variants for MCA. This take as input a variant_list which contains all the
+    variants for the cases which MCA will update/add, and annotates them with the Annotator chosen in the config
+    (see annotators.get_annotator)
 
     :param variant_list: A list of Casevariant objects
     :return: A list of CaseTranscript objects for all the CaseVariants
     '''
-    config_dict = load_config.LoadConfig().load()
-
-    if config_dict["bypass_VEP"] == "True":
-        print("Bypassing VEP")
-        transcript_list = parse_vep_annotations()
-
-    elif config_dict["bypass_VEP"] == "False":
-        print("Running VEP")
-        variant_vcf_dict = generate_vcf(variant_list)
-        if config_dict['remoteVEP'] == 'True':
-            annotated_files_dict = run_vep_remotely(variant_vcf_dict, config_dict)
-        else:
-            annotated_files_dict = run_vep(variant_vcf_dict, config_dict)
-        transcript_list = parse_vep_annotations(annotated_files_dict)
-
-    return transcript_list
+    # imported here as annotators builds on this module
+    from .annotators import get_annotator
+    return get_annotator(load_config.get_config()).annotate(variant_list)
@@ -0,0 +1,285 @@
+"""Copyright (c) 2018 Great Ormond Street Hospital for Children NHS Foundation
+Trust & Birmingham Women's and Children's NHS Foundation Trust
+
+Permission is hereby granted, free of charge, to any person obtaining a copy of
+this software and associated documentation files (the "Software"), to deal in
+the Software without restriction, including without limitation the rights to
+use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies
+of the Software, and to permit persons to whom the Software is furnished to do
+so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+"""
+import json
+import logging
+import os
+import pty
+import select
+import socket
+import socketserver
+import subprocess
+import tempfile
+import termios
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# result key used by parse_vep_annotations, and the VCF key from
+# generate_vcf, of each assembly
+ASSEMBLY_KEYS = (('GRCh37', 'hg19_vcf', 'hg19_vep'), ('GRCh38', 'hg38_vcf', 'hg38_vep'))
+SENTINEL_PREFIX = 'gel2mdt_sentinel'
+
+
+class VepWorkerError(RuntimeError):
+    """
+    The VEP worker could not annotate a request.
+    """
+
+
+class VepProcess(object):
+    """
+    A VEP process for one assembly which is kept running, so its modules,
+    cache and FASTA are only loaded once. Variants are written to its stdin
+    and annotated one at a time (--buffer_size 1). Its stdout is a
+    pseudo-terminal so that Perl writes each line as soon as it is ready
+    rather than when its buffer fills.
+
+    VEP's parser reads one line ahead, so each request is followed by two
+    sentinel variants: once the first comes back every variant before it
+    has been annotated, and the second is held back until the next request
+    and then discarded.
+
+    Attributes:
+        config_dict (Config): options from config.txt.
+        assembly (str): GRCh37 or GRCh38.
+        timeout (float): seconds to wait for a request's annotations.
+        process (Popen): the running VEP, or None before it starts.
+        header (list): VCF header lines written by VEP.
+        requests (int): requests annotated, used to name sentinels.
+    """
+    def __init__(self, config_dict, assembly, timeout=120.0):
+        self.config_dict = config_dict
+        self.assembly = assembly
+        self.timeout = timeout
+        self.process = None
+        self.output_fd = None
+        self.buffer = b''
+        self.header = []
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        from .run_vep_batch import vep_command
+        master, slave = pty.openpty()
+        # keep newlines as they are rather than translating them to \r\n
+        attributes = termios.tcgetattr(slave)
+        attributes[1] &= ~termios.ONLCR
+        termios.tcsetattr(slave, termios.TCSANOW, attributes)
+        cmd = vep_command(self.config_dict, self.assembly, 'STDIN', 'STDOUT', fork=None) + \
+            ' --format vcf --buffer_size 1 --no_stats'
+        logger.info('Starting VEP worker for %s: %s', self.assembly, cmd)
+        self.process = subprocess.Popen(cmd, shell=True, stdin=subprocess.PIPE, stdout=slave,
+                                        stderr=subprocess.DEVNULL, close_fds=True)
+        os.close(slave)
+        self.output_fd = master
+        self.buffer = b''
+        self.header = []
+
+    def stop(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            os.close(self.output_fd)
+            self.process = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def read_line(self, deadline):
+        """
+        :return: the next line VEP has written, without its newline
+        """
+        while b'\n' not in self.buffer:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise VepWorkerError('VEP for {} did not answer within {:.0f}s'.format(
+                    self.assembly, self.timeout))
+            ready, _, _ = select.select([self.output_fd], [], [], remaining)
+            if not ready:
+                continue
+            try:
+                chunk = os.read(self.output_fd, 65536)
+            except OSError:
+                chunk = b''
+            if not chunk:
+                raise VepWorkerError('VEP for {} exited with status {}'.format(
+                    self.assembly, self.process.poll()))
+            self.buffer += chunk
+        line, self.buffer = self.buffer.split(b'\n', 1)
+        return line.decode('utf-8').rstrip('\r')
+
+    def annotate(self, vcf_lines):
+        """
+        :param vcf_lines: list of VCF data lines, as written by generate_vcf
+        :return: the annotated VCF, header included, as a string
+        """
+        with self.lock:
+            if not self.is_running():
+                self.start()
+            self.requests += 1
+            sentinel = '{}_{}'.format(SENTINEL_PREFIX, self.requests)
+            sentinels = ['1\t10001\t{}_{}\tT\tC'.format(sentinel, suffix) for suffix in 'ab']
+            try:
+                self.process.stdin.write(''.join(
+                    line.rstrip('\n') + '\n' for line in list(vcf_lines) + sentinels).encode('utf-8'))
+                self.process.stdin.flush()
+                deadline = time.monotonic() + self.timeout
+                annotated = []
+                while True:
+                    line = self.read_line(deadline)
+                    if line.startswith('#'):
+                        self.header.append(line)
+                        continue
+                    variant_id = line.split('\t')[2] if line.count('\t') >= 2 else ''
+                    if variant_id == sentinel + '_a':
+                        break
+                    if not variant_id.startswith(SENTINEL_PREFIX):
+                        annotated.append(line)
+            except (OSError, VepWorkerError):
+                # the process is in an unknown state; start afresh next time
+                self.stop()
+                raise
+            return '\n'.join(self.header + annotated) + '\n'
+
+
+class VepWorkerHandler(socketserver.StreamRequestHandler):
+    """
+    Answers one request: a JSON line of assembly to VCF text, answered with
+    a JSON object of assembly to annotated VCF text, or {"error": message}.
+    """
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            started = time.perf_counter()
+            response = {assembly: self.server.process(assembly).annotate(vcf.splitlines())
+                        for assembly, vcf in request.items() if vcf.strip()}
+            logger.info('Annotated %s in %.2fs', ', '.join(request), time.perf_counter() - started)
+        except Exception as e:
+            logger.exception('VEP worker request failed')
+            response = {'error': str(e)}
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+
+
+class VepWorkerMixin(object):
+    """
+    Keeps a warm VepProcess for each assembly, shared by every connection.
+    """
+    daemon_threads = True
+
+    def setup_worker(self, config_dict, timeout):
+        self.config_dict = config_dict
+        self.timeout = timeout
+        self.processes = {}
+        self.processes_lock = threading.Lock()
+
+    def process(self, assembly):
+        with self.processes_lock:
+            if assembly not in self.processes:
+                if assembly not in {key[0] for key in ASSEMBLY_KEYS}:
+                    raise VepWorkerError('Unknown assembly {}'.format(assembly))
+                self.processes[assembly] = VepProcess(self.config_dict, assembly, self.timeout)
+            return self.processes[assembly]
+
+    def warm(self, assemblies):
+        """
+        Start VEP for each assembly and annotate nothing, so the first real
+        request does not wait for it to load.
+        """
+        for assembly in assemblies:
+            started = time.perf_counter()
+            self.process(assembly).annotate([])
+            logger.info('VEP for %s ready in %.1fs', assembly, time.perf_counter() - started)
+
+    def stop_processes(self):
+        with self.processes_lock:
+            for process in self.processes.values():
+                process.stop()
+
+
+class UnixVepWorkerServer(VepWorkerMixin, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+class TCPVepWorkerServer(VepWorkerMixin, socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+def parse_address(address):
+    """
+    :param address: path of a unix socket, or host:port
+    :return: (socket family, address for bind or connect)
+    """
+    if address.startswith('/') or ':' not in address:
+        return socket.AF_UNIX, address
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def create_server(address, config_dict, timeout=120.0):
+    """
+    :return: a VEP worker server listening on address, not yet serving
+    """
+    family, bind_address = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(bind_address):
+            os.remove(bind_address)
+        server = UnixVepWorkerServer(bind_address, VepWorkerHandler)
+    else:
+        server = TCPVepWorkerServer(bind_address, VepWorkerHandler)
+    server.setup_worker(config_dict, timeout)
+    return server
+
+
+def annotate_with_worker(infile, config_dict):
+    """
+    Sends the VCFs from generate_vcf to the VEP worker at
+    vep_worker_address in config.txt.
+    :param infile: dict containing VCFs for the 2 genome builds
+    :param config_dict: Configuration dict
+    :return: dict of the annotated VCF for each build, like run_vep
+    """
+    request = {}
+    for assembly, vcf_key, vep_key in ASSEMBLY_KEYS:
+        if vcf_key in infile:
+            with open(infile[vcf_key]) as vcf_file:
+                request[assembly] = vcf_file.read()
+
+    family, address = parse_address(config_dict['vep_worker_address'])
+    timeout = config_dict.get('vep_worker_timeout', 120.0)
+    with socket.socket(family, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(address)
+        connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        connection.shutdown(socket.SHUT_WR)
+        response = b''.join(iter(lambda: connection.recv(65536), b''))
+    response = json.loads(response.decode('utf-8'))
+    if 'error' in response:
+        raise VepWorkerError(response['error'])
+
+    annotated_variant_dict = {}
+    for assembly, vcf_key, vep_key in ASSEMBLY_KEYS:
+        if assembly in response:
+            with tempfile.NamedTemporaryFile(mode='w+t', suffix='.vcf', delete=False) as outfile:
+                outfile.write(response[assembly])
+            annotated_variant_dict[vep_key] = outfile.name
+    return annotated_variant_dict
@@ -22,12 +22,16 @@ SOFTWARE.
 import os
 import json
 import csv
-from datetime import datetime
+from datetime import datetime, timedelta
 from io import BytesIO, StringIO
 
 from django.db import IntegrityError
-from django.db.models import Q, Count
-from django.http import HttpResponseRedirect, HttpResponse, JsonResponse
+from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.db.models import Q, Count, Max, Prefetch
+from django.utils import timezone
+from django.http import HttpResponseRedirect, HttpResponse, JsonResponse, StreamingHttpResponse, FileResponse, HttpResponseForbidden
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.template.loader import render_to_string
 from django.contrib import messages
@@ -39,19 +43,26 @@ from .config import load_config
 from .forms import *
 from .models import *
 from .filters import *
-from .tasks import panel_app, get_gel_content, VariantAdder, update_for_t3, UpdateDemographics, create_bokeh_barplot
-from .exports import write_mdt_outcome_template, write_mdt_export
+from .tasks import panel_app, get_gel_content, VariantAdder, update_for_t3, UpdateDemographics
+from .tasks import export_mdt_outcome_forms as export_mdt_outcome_forms_task
+from .exports import write_mdt_outcome_template, mdt_export_rows, Echo
+from .gel_reports import cached_gel_report
 from .decorators import user_is_clinician
+from .middleware import request_stats
+from .api_utils.retry_policy import retry_stats
+from .api_utils.http_cache import get_http_cache
 
 from .api.api_views import *
 
 from .database_utils.multiple_case_adder import MultipleCaseAdder
+from .database_utils.page_loader import ProbandPageLoader, MDTPageLoader, create_variant_reports
 from .vep_utils.run_vep_batch import CaseVariant
 
-from bokeh.resources import CDN
-from bokeh.embed import components
-from bokeh.layouts import gridplot, row
 
+# number of MDTs shown on each page of recent_mdts
+RECENT_MDTS_PER_PAGE = 25
+# number of days of status counts shown on the audit page
+AUDIT_TREND_DAYS = 365
 
 def register(request):
     '''
@@ -210,6 +221,7 @@ def remove_case(request, case_id):
     case = GELInterpretationReport.objects.get(id=case_id)
     case.assigned_user = None
     case.save()
+    CaseSummary.refresh([case])
     return redirect('profile')
 
 
@@ -247,10 +259,9 @@ def proband_view(request, report_id):
     :param report_id: GEL Report ID
     :return:
     '''
-    report = GELInterpretationReport.objects.get(id=report_id)
-
     # POST request from Demographic Update Form
     if request.method == "POST":
+        report = GELInterpretationReport.objects.get(id=report_id)
         demogs_form = DemogsForm(request.POST, instance=report.ir_family.participant_family.proband)
         case_assign_form = CaseAssignForm(request.POST, instance=report)
         panel_form = PanelForm(request.POST)
@@ -312,23 +323,28 @@ def proband_view(request, report_id):
                          report=report,
                          variant=variant)
             messages.add_message(request, 25, 'Variant Added to Report')
+        CaseSummary.refresh_family(report.ir_family.participant_family)
 
-    relatives = Relative.objects.filter(proband=report.ir_family.participant_family.proband)
-    proband_form = ProbandForm(instance=report.ir_family.participant_family.proband)
+    loader = ProbandPageLoader(report_id)
+    report = loader.report
+    relatives = loader.relatives
+    proband_form = ProbandForm(instance=loader.proband)
     gelir_form = GELIRForm(instance=report)
-    demogs_form = DemogsForm(instance=report.ir_family.participant_family.proband)
-    proband_variants = ProbandVariant.objects.filter(interpretation_report=report)
-    proband_mdt = MDTReport.objects.filter(interpretation_report=report)
-    panels = InterpretationReportFamilyPanel.objects.filter(ir_family=report.ir_family)
+    demogs_form = DemogsForm(instance=loader.proband)
+    proband_variants = loader.proband_variants
+    proband_mdt = loader.proband_mdt
+    panels = loader.panels
     panel_form = PanelForm()
     case_assign_form = CaseAssignForm(instance=report)
     clinician_form = ClinicianForm()
     add_clinician_form = AddClinicianForm()
     add_variant_form = AddVariantForm()
 
+    # query the users once for all of the validation forms
+    user_choices = list(VariantValidationForm().fields['validation_responsible_user'].choices)
     pv_forms_dict = {}
     for pv in proband_variants:
-        pv_forms_dict[pv] = VariantValidationForm(instance=pv)
+        pv_forms_dict[pv] = VariantValidationForm(instance=pv, user_choices=user_choices)
 
     if not request.user.is_staff:
         if report.case_status == "C":
@@ -388,6 +404,7 @@ def update_demographics(request, report_id):
     update_demo = UpdateDemographics(report_id=report_id)
     update_demo.update_clinician()
     update_demo.update_demographics()
+    CaseSummary.refresh_family(update_demo.report.ir_family.participant_family)
     return HttpResponseRedirect(f'/proband/{report_id}')
 
 
@@ -482,7 +499,7 @@ def panel_view(request, panelversion_id):
     :return: Panel View details
     '''
     panel = PanelVersion.objects.get(id=panelversion_id)
-    config_dict = load_config.LoadConfig().load()
+    config_dict = load_config.get_config()
     panelapp_file = f'{config_dict["panelapp_storage"]}/{panel.panel.panelapp_id}_{panel.version_number}.json'
     if os.path.isfile(panelapp_file):
         panelapp_json = json.load(open(panelapp_file))
@@ -526,6 +543,7 @@ def update_proband(request, report_id):
         if proband_form.is_valid() and gelir_form.is_valid():
             proband_form.save()
             gelir_form.save()
+            CaseSummary.refresh_family(report.ir_family.participant_family)
             messages.add_message(request, 25, 'Proband Updated')
         else:
             print(proband_form.errors)
@@ -553,6 +571,8 @@ def select_transcript(request, report_id, pv_id):
                 ptv.selected = False
                 ptv.save()
             selected_count += 1
+    if selected_count > 1:
+        ProbandVariant.update_selected_transcripts(ProbandVariant.objects.filter(id=pv_id))
     report = GELInterpretationReport.objects.get(id=report_id)
     return render(request, 'gel2mdt/select_transcript.html',
                   {'proband_transcript_variants': proband_transcript_variants,
@@ -666,19 +686,7 @@ def mdt_view(request, mdt_id):
     :return: Main MDT page
     """
     mdt_instance = MDT.objects.get(id=mdt_id)
-    report_list = MDTReport.objects.filter(MDT=mdt_instance).values_list('interpretation_report', flat=True)
-    reports = GELInterpretationReport.objects.filter(id__in=report_list)
-
-    proband_variants = ProbandVariant.objects.filter(interpretation_report__in=report_list)
-    proband_variant_count = {}
-    t3_proband_variant_count = {}
-    for report in reports:
-        count = ProbandVariant.objects.filter(interpretation_report=report,
-                                              max_tier__lte=2).count()
-        proband_variant_count[report.id] = count
-        count = ProbandVariant.objects.filter(interpretation_report=report,
-                                              max_tier=3).count()
-        t3_proband_variant_count[report.id] = count
+    mdt_loader = MDTPageLoader(mdt_id)
 
     mdt_form = MdtForm(instance=mdt_instance)
     clinicians = Clinician.objects.filter(mdt=mdt_id).values_list('name', flat=True)
@@ -700,10 +708,11 @@ def mdt_view(request, mdt_id):
 
         return HttpResponseRedirect(f'/mdt_view/{mdt_id}')
     request.session['mdt_id'] = mdt_id
-    return render(request, 'gel2mdt/mdt_view.html', {'proband_variants': proband_variants,
-                                                      'proband_variant_count': proband_variant_count,
-                                                     't3_proband_variant_count': t3_proband_variant_count,
-                                                      'reports': reports,
+    return render(request, 'gel2mdt/mdt_view.html', {'proband_variant_count': mdt_loader.proband_variant_count,
+                                                     't3_proband_variant_count': mdt_loader.t3_proband_variant_count,
+                                                      'reports': mdt_loader.reports,
+                                                      'outcome_export': MDTOutcomeExport.objects.filter(
+                                                          MDT=mdt_instance).order_by('-id').first(),
                                                       'mdt_form': mdt_form,
                                                       'mdt_id': mdt_id,
                                                       'attendees': attendees,
@@ -729,17 +738,11 @@ def mdt_proband_view(request, mdt_id, pk, important):
         proband_variants = ProbandVariant.objects.filter(interpretation_report=report,
                                                          max_tier=3)
 
-    for pv in proband_variants:
-        if mdt_instance.sample_type == 'raredisease':
-            pv.create_rare_disease_report()
-        elif mdt_instance.sample_type == 'cancer':
-            pv.create_cancer_report()
-
+    proband_variants = list(proband_variants)
+    proband_variant_reports = create_variant_reports(proband_variants, mdt_instance.sample_type)
     if mdt_instance.sample_type == 'raredisease':
-        proband_variant_reports = RareDiseaseReport.objects.filter(proband_variant__in=proband_variants)
         VariantForm = modelformset_factory(RareDiseaseReport, form=RareDiseaseMDTForm, extra=0)
     elif mdt_instance.sample_type == 'cancer':
-        proband_variant_reports = CancerReport.objects.filter(proband_variant__in=proband_variants)
         VariantForm = modelformset_factory(CancerReport, form=CancerMDTForm, extra=0)
     variant_formset = VariantForm(queryset=proband_variant_reports)
 
@@ -764,6 +767,7 @@ def mdt_proband_view(request, mdt_id, pk, important):
             variant_formset.save()
             proband_form.save()
             gelir_form.save()
+            CaseSummary.refresh_family(report.ir_family.participant_family)
             messages.add_message(request, 25, 'Proband Updated')
         else:
             print(gelir_form.errors)
@@ -806,22 +810,11 @@ def edit_mdt_proband(request, report_id):
             proband_form.save()
             data['form_is_valid'] = True
 
-            report_list = MDTReport.objects.filter(MDT=mdt_id).values_list('interpretation_report', flat=True)
-            reports = GELInterpretationReport.objects.filter(id__in=report_list)
-            proband_variant_count = {}
-            t3_proband_variant_count = {}
-            for report in reports:
-                count = ProbandVariant.objects.filter(interpretation_report=report,
-                                                      max_tier__lte=2).count()
-                proband_variant_count[report.id] = count
-                count = ProbandVariant.objects.filter(interpretation_report=report,
-                                                      max_tier=3).count()
-                t3_proband_variant_count[report.id] = count
-
+            mdt_loader = MDTPageLoader(mdt_id)
             data['html_mdt_list'] = render_to_string('gel2mdt/includes/mdt_proband_table.html', {
-                'reports': reports,
-                'proband_variant_count': proband_variant_count,
-                't3_proband_variant_count': t3_proband_variant_count,
+                'reports': mdt_loader.reports,
+                'proband_variant_count': mdt_loader.proband_variant_count,
+                't3_proband_variant_count': mdt_loader.t3_proband_variant_count,
                 'mdt_id': request.session['mdt_id']
             })
         else:
@@ -844,28 +837,23 @@ def edit_mdt_proband(request, report_id):
 @login_required
 def recent_mdts(request, sample_type):
     '''
-    Shows table of recent MDTs
+    Shows table of recent MDTs, a page at a time and optionally filtered by date
     :param request:
     :param sample_type: Either cancer or raredisease
     :return: A list of cancer or raredisease MDTs
     '''
-    recent_mdt = list(MDT.objects.filter(sample_type=sample_type).order_by('-date_of_mdt'))
-    config_dict = load_config.LoadConfig().load()
-    # Need to get which probands were in MDT
-    probands_in_mdt = {}
-    for mdt in recent_mdt:
-        probands_in_mdt[mdt.id] = []
-        report_list = MDTReport.objects.filter(MDT=mdt.id)
-        for report in report_list:
-            if config_dict['cip_as_id'] == 'True':
-                probands_in_mdt[mdt.id].append((report.interpretation_report.id,
-                                                report.interpretation_report.ir_family.ir_family_id))
-            else:
-                probands_in_mdt[mdt.id].append((report.interpretation_report.id,
-                                            report.interpretation_report.ir_family.participant_family.proband.gel_id))
+    mdt_list = MDT.objects.filter(sample_type=sample_type).order_by(
+        '-date_of_mdt', '-id').select_related('creator').prefetch_related(
+            # Need to get which probands were in MDT
+            Prefetch('mdtreport_set',
+                     queryset=MDTReport.objects.select_related(
+                         'interpretation_report__ir_family__participant_family__proband')))
+    mdt_filter = MDTFilter(request.GET, queryset=mdt_list)
+    paginator = Paginator(mdt_filter.qs, RECENT_MDTS_PER_PAGE)
+    recent_mdt = paginator.get_page(request.GET.get('page'))
 
     return render(request, 'gel2mdt/recent_mdts.html', {'recent_mdt': recent_mdt,
-                                                        'probands_in_mdt': probands_in_mdt,
+                                                        'mdt_filter': mdt_filter,
                                                         'sample_type': sample_type})
 
 
@@ -1026,13 +1014,47 @@ def export_mdt(request, mdt_id):
     if request.method == "POST":
         mdt_instance = MDT.objects.get(id=mdt_id)
         mdt_reports = MDTReport.objects.filter(MDT=mdt_instance)
-        response = HttpResponse(content_type='text/csv')
+        writer = csv.writer(Echo())
+        response = StreamingHttpResponse((writer.writerow(row) for row in mdt_export_rows(mdt_reports)),
+                                         content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename=MDT_{}.csv'.format(mdt_id)
-        writer = csv.writer(response)
-        writer = write_mdt_export(writer, mdt_instance, mdt_reports)
         return response
 
 
+@login_required
+def export_mdt_outcome_forms(request, mdt_id):
+    '''
+    Starts a background job which generates the MDT outcome forms for every case in an MDT as a zip file
+    :param request:
+    :param mdt_id: MDT instance
+    :return: Back to the MDT view
+    '''
+    if request.method == "POST":
+        mdt_instance = MDT.objects.get(id=mdt_id)
+        export = MDTOutcomeExport.objects.create(MDT=mdt_instance, requested_by=request.user)
+        export_mdt_outcome_forms_task.delay(export.id)
+        messages.add_message(request, 25, 'Outcome forms are being generated, '
+                                          'reload this page in a few minutes to download them')
+    return HttpResponseRedirect(f'/mdt_view/{mdt_id}')
+
+
+@login_required
+def download_mdt_outcome_forms(request, export_id):
+    '''
+    Downloads the zip of MDT outcome forms generated by export_mdt_outcome_forms
+    :param request:
+    :param export_id: MDTOutcomeExport instance
+    :return: ZIP format file, or back to the MDT view if it is not ready
+    '''
+    export = MDTOutcomeExport.objects.get(id=export_id)
+    if export.status != 'C':
+        messages.error(request, 'Outcome forms are {}'.format(export.get_status_display().lower()))
+        return HttpResponseRedirect(f'/mdt_view/{export.MDT_id}')
+    response = FileResponse(open(export.zip_file, 'rb'), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename=MDT_{}_outcome_forms.zip'.format(export.MDT_id)
+    return response
+
+
 @login_required
 def export_mdt_outcome_form(request, report_id):
     '''
@@ -1069,7 +1091,7 @@ def negative_report(request, report_id):
     :param report_id: GEL Report ID
     :return:
     '''
-    config_dict = load_config.LoadConfig().load()
+    config_dict = load_config.get_config()
 
     report = GELInterpretationReport.objects.get(id=report_id)
     panels = InterpretationReportFamilyPanel.objects.filter(ir_family=report.ir_family)
@@ -1092,12 +1114,16 @@ def negative_report(request, report_id):
 @login_required
 def genomics_england_report(request, report_id):
     """
-    Sends the genomics england report to the users email address
+    Shows the genomics england report if it has been rendered since the case last changed, otherwise sends it to the
+    users email address
     :param report_id: GELInterpretation Report iD
-    :return Back to proband page
+    :return The report, or back to proband page
     """
-    report = GELInterpretationReport.objects.get(id=report_id)
+    report = GELInterpretationReport.objects.select_related('ir_family').get(id=report_id)
     cip_id = report.ir_family.ir_family_id.split('-')
+    report_path = cached_gel_report(cip_id[0], cip_id[1], not_before=report.updated)
+    if report_path:
+        return FileResponse(open(report_path, 'rb'), content_type='text/html')
     get_gel_content.delay(request.user.email, cip_id[0], cip_id[1])
     messages.add_message(request, 25, 'Report will be emailed to you if it exists')
     return HttpResponseRedirect(f'/proband/{report_id}')
@@ -1106,39 +1132,88 @@ def genomics_england_report(request, report_id):
 @login_required
 def audit(request, sample_type):
     '''
-    Create figures giving breakdown of case status and NPF cases
+    Create figures giving breakdown of case status and NPF cases, and how the status counts have changed over time.
+    Figures are drawn from the daily CaseStatusSnapshot table and cached until a new snapshot is recorded
     :param request:
     :param sample_type: Choice of raredisease and cancer
     :return:
     '''
-    config_dict = load_config.LoadConfig().load()
+    config_dict = load_config.get_config()
+    today = timezone.localdate()
+    if not CaseStatusSnapshot.objects.filter(date=today).exists():
+        # snapshots are normally recorded by celery beat, this covers the first visit of the day without it
+        CaseStatusSnapshot.record(today)
+    snapshots = CaseStatusSnapshot.objects.filter(sample_type=sample_type,
+                                                  date__gte=today - timedelta(days=AUDIT_TREND_DAYS))
+    last_recorded = snapshots.aggregate(Max('recorded_at'))['recorded_at__max']
+    split_pilot = config_dict.plot_pilot_and_main_status_breakdown
+    cache_key = 'audit:{}:{}:{}'.format(sample_type, split_pilot,
+                                        last_recorded.timestamp() if last_recorded else 0)
+    plot_components = cache.get(cache_key)
+    if plot_components is None:
+        from bokeh.embed import components
+        from bokeh.resources import CDN
+        plot_components = components(audit_plots(snapshots, split_pilot), CDN)
+        cache.set(cache_key, plot_components, 60 * 60 * 24)
+    script, div = plot_components
+    return render(request, 'gel2mdt/audit.html', {'script': script,
+                  'div': div, 'sample_type': sample_type})
+
+
+def audit_plots(snapshots, split_pilot):
+    '''
+    Bokeh layout of the latest status counts and the daily status count trend
+    :param snapshots: CaseStatusSnapshot queryset for one sample type
+    :param split_pilot: Whether to plot pilot and main study cases separately
+    :return: Bokeh layout
+    '''
+    from bokeh.layouts import row, column
+    from .plots import create_bokeh_barplot, create_bokeh_lineplot
+
     # Status choices and names
     status_choices = dict(GELInterpretationReport._meta.get_field('case_status').choices)
     status_names = list(status_choices.values())
+    counts = {}
+    for date, pilot_case, case_status, count in snapshots.values_list('date', 'pilot_case', 'case_status', 'count'):
+        counts[(date, pilot_case, case_status)] = count
+    dates = sorted({key[0] for key in counts})
+    latest = dates[-1] if dates else None
+
+    def status_counts(date, pilot_cases):
+        return [sum(counts.get((date, pilot_case, status), 0) for pilot_case in pilot_cases)
+                for status in status_choices]
+
     # Total Case status plot
-    if config_dict['plot_pilot_and_main_status_breakdown'] == 'False':
-        case_status_breakdown = GELInterpretationReport.objects.filter(sample_type=sample_type).values(
-            'case_status').annotate(Count('case_status'))
-        case_status_breakdown = {item['case_status']: item['case_status__count'] for item in case_status_breakdown}
-        status_counts = [case_status_breakdown.get(f, 0) for f in status_choices]
-        plots = create_bokeh_barplot(status_names, status_counts,
-                                                'Total Status Count')
+    if not split_pilot:
+        plots = create_bokeh_barplot(status_names, status_counts(latest, (False, True)),
+                                     'Total Status Count')
     else:
         # Main study status plot
-        case_status_breakdown = GELInterpretationReport.objects.filter(sample_type=sample_type, pilot_case=False).values(
-            'case_status').annotate(Count('case_status'))
-        case_status_breakdown = {item['case_status']: item['case_status__count'] for item in case_status_breakdown}
-        status_counts = [case_status_breakdown.get(f, 0) for f in status_choices]
-        main_study_count_plot = create_bokeh_barplot(status_names, status_counts,
+        main_study_count_plot = create_bokeh_barplot(status_names, status_counts(latest, (False,)),
                                                      'Main Study Status Count')
-
         # Pilot study status plot
-        case_status_breakdown = GELInterpretationReport.objects.filter(sample_type=sample_type, pilot_case=True).values(
-            'case_status').annotate(Count('case_status'))
-        case_status_breakdown = {item['case_status']: item['case_status__count'] for item in case_status_breakdown}
-        status_counts = [case_status_breakdown.get(f, 0) for f in status_choices]
-        pilot_study_count_plot = create_bokeh_barplot(status_names, status_counts, 'Pilot Study Status Count')
+        pilot_study_count_plot = create_bokeh_barplot(status_names, status_counts(latest, (True,)),
+                                                      'Pilot Study Status Count')
         plots = row([main_study_count_plot, pilot_study_count_plot])
-    script, div = components(plots, CDN)
-    return render(request, 'gel2mdt/audit.html', {'script': script,
-                  'div': div, 'sample_type': sample_type})
+
+    # Status count over time
+    daily_counts = [status_counts(date, (False, True)) for date in dates]
+    trend = {status_name: [day[i] for day in daily_counts] for i, status_name in enumerate(status_names)}
+    trend_plot = create_bokeh_lineplot(dates, trend, 'Status Count Over Time')
+    return column([plots, trend_plot])
+
+
+def metrics(request):
+    '''
+    Request latency and query count percentiles for each view, recorded by
+    PerformanceMiddleware in this process, and retry and HTTP cache counts
+    of each API polled by this process. Open to staff and INTERNAL_IPS.
+    :param request:
+    :return: Prometheus text format metrics
+    '''
+    if not request.user.is_staff and request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS:
+        return HttpResponseForbidden()
+    http_cache = get_http_cache()
+    return HttpResponse(request_stats.metrics() + retry_stats.metrics()
+                        + (http_cache.metrics() if http_cache else ''),
+                        content_type='text/plain; version=0.0.4')
@@ -14,6 +14,7 @@ import os
 import sys
 from django.contrib.messages import constants as messages
 from datetime import datetime
+from celery.schedules import crontab
 
 # Check that the expected local_settings values are present
 try:
@@ -53,6 +54,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'gel2mdt.middleware.PerformanceMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -75,6 +77,7 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'gel2mdt.context_processors.config_access',
+                'gel2mdt.context_processors.build_info',
             ],
         },
     },
@@ -121,6 +124,14 @@ LOGGING = {
                 dt=datetime_str_format),
             'formatter': 'simple'
         },
+        'performance': {
+            'level': 'WARNING',
+            'class': 'logging.handlers.RotatingFileHandler',
+            'filename': 'logs/performance.log',
+            'maxBytes': 10 * 1024 * 1024,
+            'backupCount': 5,
+            'formatter': 'verbose'
+        },
     },
     'loggers': {
         'django': {
@@ -128,10 +139,60 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        'gel2mdt.performance': {
+            'handlers': ['performance'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
     }
 }
+
+# Requests slower than this, or which run the same SQL at least
+# PERFORMANCE_DUPLICATE_QUERY_THRESHOLD times (usually a query per row), are
+# written to logs/performance.log. Percentiles of the latest
+# PERFORMANCE_SAMPLE_SIZE requests to each view are served at /metrics.
+PERFORMANCE_SLOW_REQUEST_MS = 1000
+PERFORMANCE_DUPLICATE_QUERY_THRESHOLD = 10
+PERFORMANCE_SAMPLE_SIZE = 1000
 #ssh
 
+# Caching
+# https://docs.djangoproject.com/en/2.0/topics/cache/
+# Local memory by default; set CACHES in local_settings.py to use a shared
+# backend (e.g. FileBasedCache) when running several worker processes.
+
+try:
+    from .local_settings import CACHES
+except ImportError:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'gel2mdt',
+        }
+    }
+
+# seconds a cached case list is kept; entries are keyed by data version so
+# stale lists are never served, this only bounds memory use
+CASE_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Celery beat
+# http://docs.celeryproject.org/en/latest/userguide/periodic-tasks.html
+
+CELERY_BEAT_SCHEDULE = {
+    'snapshot-case-status': {
+        'task': 'gel2mdt.tasks.snapshot_case_status',
+        'schedule': crontab(hour=23, minute=30),
+    },
+}
+
+# MDT outcome documents generated by celery, cached by content version, and
+# the zips of every document in an MDT
+MDT_OUTCOME_STORAGE = os.path.join(BASE_DIR, 'mdt_outcomes')
+
+# GeL clinical reports rendered by celery with their panel genes, one file
+# per interpretation request version and cip version
+GEL_REPORT_STORAGE = os.path.join(BASE_DIR, 'gel_reports')
+
 # Password validation
 # https://docs.djangoproject.com/en/2.0/ref/settings/#auth-password-validators
 